@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+compare.py
+Compare two run_benchmarks.py JSON files stage by stage.
+
+Usage:
+    python benchmarks/compare.py results/base.json results/new.json [--threshold 1.2]
+
+Exits with status 1 if any stage is slower than `threshold` x the base
+(per-item time), so it can gate a change in a script.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> tuple:
+    with open(path) as f:
+        data = json.load(f)
+    rows = {
+        (r["group"], r["stage"], r["size"]): r
+        for r in data["results"]
+        if r.get("per_item_ms") is not None
+    }
+    return data["environment"], rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    base_env, base = load(args.base)
+    new_env, new = load(args.new)
+    print(f"base: {base_env['commit']} ({base_env['time']})  new: {new_env['commit']} ({new_env['time']})")
+    print(f"{'group':>7} {'stage':<13} {'size':>7} {'base ms':>10} {'new ms':>10} {'ratio':>7}")
+
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        b, n = base[key]["per_item_ms"], new[key]["per_item_ms"]
+        ratio = n / b if b else float("inf")
+        flag = ""
+        if ratio > args.threshold:
+            flag = "  ⚠️ slower"
+            regressions += 1
+        elif ratio < 1 / args.threshold:
+            flag = "  ✅ faster"
+        print(f"{key[0]:>7} {key[1]:<13} {key[2]:>7} {b:10.3f} {n:10.3f} {ratio:7.2f}{flag}")
+
+    for key in sorted(base.keys() ^ new.keys()):
+        print(f"{key[0]:>7} {key[1]:<13} {key[2]:>7}  only in {'base' if key in base else 'new'}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
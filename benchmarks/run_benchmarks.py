@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py
+Performance benchmarks for the preparation and docking orchestration hot paths.
+
+Preparation (needs RDKit; OpenBabel or MolScrub for protonation), timed
+per stage on a sample of each synthetic library:
+- read       utils.ligand_io.iter_ligands over the .smi library
+- sanitize   Chem.MolFromSmiles
+- protonate  ph_correct_smiles_openbabel_batch / ph_correct_smiles_molscrub
+- embed      smiles_to_3d_mol / mol_to_3d_mol (per protonation backend),
+             the time spent in their "embed" logger stages
+- minimize   the same calls, time spent in their "minimize" stages
+- write      SDWriter
+
+Docking orchestration (stub GNINA, no GPU), on a synthetic 3D SDF:
+- split          load_ligands, first launch: builds the SDF offset index
+                 (needs RDKit)
+- split_resume   load_ligands again, from the existing index
+- ledger_write   RUNNING + DONE per ligand in the job ledger
+- ledger_read    all_details() + count_by_status()
+- run_gnina      end-to-end run_gnina() per ligand with stub_gnina.py
+- parse          parse_best_score() over every docked.sdf
+- aggregate      results_aggregation.aggregate_results()
+
+Stages whose dependencies are missing are recorded as skipped.
+Results are written as JSON (benchmarks/results/<time>_<commit>.json);
+compare two runs with benchmarks/compare.py.
+
+Usage (CPU-only Linux box, from the repository root):
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCKING_DIR = os.path.join(REPO_ROOT, "flexible_docking_with_GNINA")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, DOCKING_DIR)
+
+from synthetic import drug_like_smiles, write_smi, write_3d_sdf  # noqa: E402
+from utils.ligand_io import iter_ligands  # noqa: E402
+from job_ledger import JobLedger  # noqa: E402
+from gnina_output import read_sdf_records  # noqa: E402
+from results_aggregation import aggregate_results  # noqa: E402
+import stub_gnina  # noqa: E402
+
+STUB_GNINA = os.path.join(DOCKING_DIR, "stub_gnina.py")
+
+
+# =========================
+# RESULT RECORDS
+# =========================
+def record(results: list, group: str, stage: str, size: int, n: int,
+           seconds: float | None, n_ok: int | None = None, skipped: str | None = None):
+    entry = {
+        "group": group,
+        "stage": stage,
+        "size": size,
+        "n": n,
+        "seconds": None if seconds is None else round(seconds, 6),
+        "per_item_ms": None if not seconds or not n else round(1000 * seconds / n, 4),
+        "items_per_s": None if not seconds else round(n / seconds, 2),
+        "n_ok": n if n_ok is None else n_ok,
+    }
+    if skipped:
+        entry["skipped"] = skipped
+    results.append(entry)
+
+    if skipped:
+        print(f"  {group:>7} {stage:<13} size={size:<7} skipped: {skipped}")
+    else:
+        per_item = entry["per_item_ms"]
+        print(f"  {group:>7} {stage:<13} size={size:<7} n={n:<7} {seconds:9.3f} s"
+              + (f"  {per_item:9.3f} ms/item" if per_item is not None else ""))
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True
+        ).stdout.strip() or "unknown"
+    except OSError:
+        commit = "unknown"
+
+    env = {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        from rdkit import rdBase
+        env["rdkit"] = rdBase.rdkitVersion
+    except ImportError:
+        env["rdkit"] = None
+    return env
+
+
+# =========================
+# PREPARATION STAGES
+# =========================
+def bench_preparation(results: list, smi_path: str, size: int, n: int,
+                      protonation: str, ph: float, seed: int, workdir: str,
+                      rdkit_stages: bool = True):
+    """Read the whole library; run the RDKit stages on its first n molecules."""
+    with Timer() as t:
+        records = list(iter_ligands(smi_path, "SMILES", "ID"))
+    record(results, "prep", "read", size, len(records), t.seconds)
+    if not rdkit_stages:
+        return
+    records = records[:n]
+
+    try:
+        from rdkit import Chem
+        from utils import logger
+        from utils.chemistry import (
+            PROTONATION_MOLSCRUB, EmbeddingFailure, init_protonation_backend,
+            mol_to_3d_mol, smiles_to_3d_mol,
+            ph_correct_smiles_openbabel_batch, ph_correct_smiles_molscrub
+        )
+    except ImportError as e:
+        for stage in ("sanitize", "protonate", "embed", "minimize", "write"):
+            record(results, "prep", stage, size, n, None, skipped=str(e))
+        return
+
+    smiles = [s for _, s in records]
+
+    with Timer() as t:
+        mols = [Chem.MolFromSmiles(s) for s in smiles]
+    valid = [s for s, m in zip(smiles, mols) if m is not None]
+    record(results, "prep", "sanitize", size, len(smiles), t.seconds, len(valid))
+
+    # Protonated states as ligand_logic._embed takes them: SMILES for
+    # OpenBabel (smiles_to_3d_mol), mols for MolScrub (mol_to_3d_mol)
+    to_3d = smiles_to_3d_mol
+    try:
+        init_protonation_backend(protonation, ph)
+        with Timer() as t:
+            if protonation == PROTONATION_MOLSCRUB:
+                to_3d = mol_to_3d_mol
+                states = [ph_correct_smiles_molscrub(s, ph) for s in valid]
+                states = [m for m in states if m is not None]
+            else:
+                # Same chunking as ligand_logic._prepare_chunk
+                ph_smiles = []
+                for i in range(0, len(valid), 64):
+                    ph_smiles += ph_correct_smiles_openbabel_batch(valid[i:i + 64], ph)
+                states = [s for s in ph_smiles if s]
+        record(results, "prep", "protonate", size, len(valid), t.seconds, len(states))
+    except (ImportError, OSError) as e:
+        record(results, "prep", "protonate", size, len(valid), None, skipped=str(e))
+        to_3d, states = smiles_to_3d_mol, valid
+
+    # The pipeline's own 3D generation; its logger stages split the time
+    # into embed (whole ETKDG ladder) and minimize
+    was_enabled = logger.is_enabled()
+    logger.configure(enabled=True)
+    logger.drain()
+    embedded = []
+    try:
+        for state in states:
+            try:
+                mol = to_3d(state, seed)
+            except EmbeddingFailure:
+                mol = None
+            if mol is not None:
+                embedded.append(mol)
+        stages = logger.summary()
+    finally:
+        logger.drain()
+        logger.configure(enabled=was_enabled)
+    n_minimized = stages.get("minimize", {}).get("count", 0)
+    for stage, n_in, n_out in (("embed", len(states), n_minimized),
+                               ("minimize", n_minimized, len(embedded))):
+        if n_in:
+            record(results, "prep", stage, size, n_in, stages[stage]["total_s"], n_out)
+        else:
+            record(results, "prep", stage, size, 0, None, skipped="no input molecules")
+
+    out_sdf = os.path.join(workdir, f"prepared_{size}.sdf")
+    with Timer() as t:
+        writer = Chem.SDWriter(out_sdf)
+        for i, mol in enumerate(embedded):
+            mol.SetProp("_Name", f"BENCH_{i:06d}")
+            writer.write(mol)
+        writer.close()
+    record(results, "prep", "write", size, len(embedded), t.seconds)
+
+
+# =========================
+# DOCKING ORCHESTRATION
+# =========================
+def _split_text(input_sdf: str, ligands_root: str) -> list:
+    """RDKit-free stand-in for load_ligands, so the later stages still run."""
+    ligands = []
+    for idx, (name, record_text) in enumerate(read_sdf_records(input_sdf), start=1):
+        lig_id = f"LIG_{idx:04d}"
+        lig_root = os.path.join(ligands_root, f"{lig_id}__{name}")
+        os.makedirs(os.path.join(lig_root, "input"), exist_ok=True)
+        ligand_sdf = os.path.join(lig_root, "input", "ligand.sdf")
+        with open(ligand_sdf, "w") as f:
+            f.write(record_text)
+        ligands.append({"lig_id": lig_id, "lig_root": lig_root,
+                        "ligand_sdf": ligand_sdf, "fingerprint": str(idx)})
+    return ligands
+
+
+def bench_docking(results: list, size: int, run_limit: int, workdir: str):
+    results_dir = os.path.join(workdir, f"docking_{size}")
+    ligands_root = os.path.join(results_dir, "ligands")
+    os.makedirs(os.path.join(results_dir, "summary"), exist_ok=True)
+    input_sdf = write_3d_sdf(os.path.join(workdir, f"ligands_{size}.sdf"), size)
+
+    try:
+        import flexible_docking_execution as fde
+    except ImportError as e:
+        fde = None
+        record(results, "docking", "split", size, size, None, skipped=str(e))
+        ligands = _split_text(input_sdf, ligands_root)
+    else:
+        with Timer() as t, contextlib.redirect_stdout(io.StringIO()):
+            ligands = fde.load_ligands(input_sdf, ligands_root, settings_fp="bench")
+        record(results, "docking", "split", size, size, t.seconds, len(ligands))
+        if len(ligands) != size:
+            # Merged duplicates would shrink n of every later stage
+            raise RuntimeError(f"load_ligands kept {len(ligands)} of {size} synthetic ligands")
+        with Timer() as t, contextlib.redirect_stdout(io.StringIO()):
+            ligands = fde.load_ligands(input_sdf, ligands_root, settings_fp="bench")
+        record(results, "docking", "split_resume", size, size, t.seconds, len(ligands))
+
+    # Job ledger
+    ledger = JobLedger(os.path.join(results_dir, "summary", "bench_ledger.sqlite"))
+    job_ids = [os.path.basename(lig["lig_root"]) for lig in ligands]
+    with Timer() as t:
+        for job_id in job_ids:
+            ledger.write_status(job_id, "RUNNING")
+            ledger.write_status(job_id, "DONE", elapsed_min="0.01", best_cnn_score="0.9")
+    record(results, "docking", "ledger_write", size, len(job_ids), t.seconds)
+
+    with Timer() as t:
+        ledger.all_details()
+        ledger.count_by_status()
+    record(results, "docking", "ledger_read", size, len(job_ids), t.seconds)
+    ledger.close()
+
+    # End-to-end run_gnina with the stub executable (process spawn + bookkeeping)
+    sample = ligands[:run_limit]
+    if fde is None:
+        record(results, "docking", "run_gnina", size, len(sample), None,
+               skipped="flexible_docking_execution not importable")
+    else:
+        fde.GNINA_BIN = STUB_GNINA
+        fde.RESULTS_DIR = results_dir
+        fde.open_ledger(os.path.join(results_dir, "summary"), [])
+        slot = {"name": "cpu0", "cpu": 1}
+        with Timer() as t, contextlib.redirect_stdout(io.StringIO()):
+            statuses = [fde.run_gnina(lig, i, len(sample), slot)
+                        for i, lig in enumerate(sample, start=1)]
+        fde._LEDGER.close()
+        record(results, "docking", "run_gnina", size, len(sample), t.seconds,
+               statuses.count(fde.STATUS_DONE))
+
+    # Remaining outputs straight from the stub, in-process (setup, not timed)
+    for lig in ligands[len(sample) if fde is not None else 0:]:
+        if fde is not None:
+            fde.materialize_input(lig)
+        out_dir = os.path.join(lig["lig_root"], "output")
+        log_dir = os.path.join(lig["lig_root"], "logs")
+        os.makedirs(out_dir, exist_ok=True)
+        os.makedirs(log_dir, exist_ok=True)
+        stub_gnina.main([
+            "-l", lig["ligand_sdf"],
+            "-o", os.path.join(out_dir, "docked.sdf"),
+            "--out_flex", os.path.join(out_dir, "flex_residues.pdb"),
+            "--log", os.path.join(log_dir, "gnina.log"),
+            "--flexres", "A:182,A:181,A:215,A:262,A:49",
+            "--num_modes", "10",
+        ])
+
+    docked = [os.path.join(lig["lig_root"], "output", "docked.sdf") for lig in ligands]
+    if fde is not None:
+        with Timer() as t:
+            for path in docked:
+                fde.parse_best_score(path)
+        record(results, "docking", "parse", size, len(docked), t.seconds)
+    else:
+        record(results, "docking", "parse", size, len(docked), None,
+               skipped="flexible_docking_execution not importable")
+
+    with Timer() as t, contextlib.redirect_stdout(io.StringIO()):
+        aggregate_results(results_dir)
+    record(results, "docking", "aggregate", size, len(docked), t.seconds)
+
+
+# =========================
+# MAIN
+# =========================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Preparation / docking orchestration benchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Synthetic library sizes (default: %(default)s)")
+    parser.add_argument("--prep-limit", type=int, default=1000,
+                        help="Molecules per size for the RDKit preparation stages")
+    parser.add_argument("--run-limit", type=int, default=200,
+                        help="Ligands per size for the end-to-end run_gnina stage")
+    parser.add_argument("--only", choices=("prep", "docking"), default=None)
+    parser.add_argument("--protonation", default="openbabel", choices=("openbabel", "molscrub"))
+    parser.add_argument("--ph", type=float, default=7.4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None,
+                        help="Scratch directory (default: a temporary directory, removed)")
+    parser.add_argument("--output", default=None,
+                        help="JSON file (default: benchmarks/results/<time>_<commit>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    env = environment()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="gnina_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+
+    print(f"Benchmarks @ {env['commit']} ({env['cpu_count']} CPUs) → {workdir}")
+    try:
+        prep_done = set()
+        for size in sizes:
+            if args.only in (None, "prep"):
+                smi_path = write_smi(os.path.join(workdir, f"library_{size}.smi"),
+                                     drug_like_smiles(size, seed=args.seed))
+                # Sizes above --prep-limit share the same RDKit sample: run it once
+                n = min(size, args.prep_limit)
+                bench_preparation(results, smi_path, size, n,
+                                  args.protonation, args.ph, args.seed, workdir,
+                                  rdkit_stages=n not in prep_done)
+                prep_done.add(n)
+            if args.only in (None, "docking"):
+                bench_docking(results, size, args.run_limit, workdir)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results",
+        f"{time.strftime('%Y%m%d-%H%M%S')}_{env['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"environment": env, "settings": vars(args), "results": results}, f, indent=2)
+    print(f"✔ Results written to {output}")
+    return output
+
+
+if __name__ == "__main__":
+    main()
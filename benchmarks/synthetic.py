@@ -0,0 +1,90 @@
+"""
+synthetic.py
+Deterministic synthetic inputs for the benchmarks (stdlib only).
+
+- drug_like_smiles(): fragment-assembled SMILES (caps, ring cores,
+  linkers), roughly 200-500 Da, reproducible for a given seed
+- write_smi(): a .smi library readable by utils.ligand_io
+- write_3d_sdf(): a multi-molecule 3D SDF with valid V2000 blocks, the
+  shape of a prepared ligand file, without needing RDKit to build it;
+  every molecule is a distinct structure, so ligand dedup keeps them all
+"""
+
+import math
+import random
+
+START_CAPS = ["C", "CC", "CO", "N#C", "FC(F)(F)", "CN(C)", "O=C(O)", "c1ccccc1", "Clc1ccccc1", "CC(C)"]
+CORES = ["c1ccc(cc1)", "c1ccc(nc1)", "c1ccc(F)c(c1)", "C1CCN(CC1)", "N1CCN(CC1)",
+         "C1CCC(CC1)", "c1csc(n1)", "c1cnc(nc1)", "c1cc(on1)"]
+LINKERS = ["", "C", "CC", "C(=O)N", "NC(=O)", "O", "S(=O)(=O)N", "OC", "C(=O)", "N"]
+END_CAPS = ["C", "O", "N", "F", "Cl", "C(F)(F)F", "C(=O)O", "C#N", "OC", "N(C)C", "c1ccccc1", "C1CC1"]
+
+
+def drug_like_smiles(n: int, seed: int = 0) -> list:
+    """n unique SMILES: cap + 2-3 cores joined by linkers + cap."""
+    rng = random.Random(seed)
+    seen = set()
+    library = []
+    while len(library) < n:
+        parts = [rng.choice(START_CAPS), rng.choice(CORES)]
+        for _ in range(rng.choice((1, 2))):
+            parts += [rng.choice(LINKERS), rng.choice(CORES)]
+        parts += [rng.choice(LINKERS), rng.choice(END_CAPS)]
+        smiles = "".join(parts)
+        if smiles not in seen:
+            seen.add(smiles)
+            library.append(smiles)
+    return library
+
+
+def write_smi(path: str, smiles_list: list) -> str:
+    """Write `SMILES ID` lines with a header (utils.ligand_io .smi format)."""
+    with open(path, "w") as f:
+        f.write("SMILES ID\n")
+        for i, smiles in enumerate(smiles_list, start=1):
+            f.write(f"{smiles} BENCH_{i:06d}\n")
+    return path
+
+
+def chain_elements(index: int, n_atoms: int) -> list:
+    """
+    Element of every chain atom of molecule `index`: an N at one end, and
+    C, O or N at every other even position from the base-3 digits of
+    `index` (heteroatoms never bonded to each other). Distinct for every
+    index below 3 ** ((n_atoms - 3) // 2), i.e. about 1.6 M for 30 atoms.
+    """
+    elements = ["N"] + ["C"] * (n_atoms - 1)
+    for position in range(2, n_atoms - 2, 2):
+        index, digit = divmod(index, 3)
+        elements[position] = "CON"[digit]
+    if index:
+        raise ValueError(f"n_atoms={n_atoms} is too short for this many distinct molecules")
+    return elements
+
+
+def _chain_molblock(name: str, elements: list, rng: random.Random) -> str:
+    """Zig-zag chain with hydrogens omitted; valid V2000 for any parser."""
+    n_atoms = len(elements)
+    lines = [name, "     bench          3D", ""]
+    lines.append(f"{n_atoms:3d}{n_atoms - 1:3d}  0  0  0  0  0  0  0  0999 V2000")
+    ox, oy, oz = (rng.uniform(-2.0, 2.0) for _ in range(3))
+    for i, element in enumerate(elements):
+        x = ox + 1.25 * i
+        y = oy + (0.8 if i % 2 else 0.0)
+        z = oz + 0.3 * math.sin(i)
+        lines.append(f"{x:10.4f}{y:10.4f}{z:10.4f} {element:<3} 0  0  0  0  0  0  0  0  0  0  0  0")
+    for i in range(1, n_atoms):
+        lines.append(f"{i:3d}{i + 1:3d}  1  0")
+    lines.append("M  END")
+    return "\n".join(lines)
+
+
+def write_3d_sdf(path: str, n: int, n_atoms: int = 30, seed: int = 0) -> str:
+    """Write n distinct synthetic 3D molecules (BENCH_000001, ...) with a SMILES_raw property."""
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for i in range(1, n + 1):
+            elements = chain_elements(i - 1, n_atoms)
+            f.write(_chain_molblock(f"BENCH_{i:06d}", elements, rng))
+            f.write(f"\n>  <SMILES_raw>\n{''.join(elements)}\n\n$$$$\n")
+    return path
@@ -3,107 +3,221 @@
 """
 flexible_docking_execution.py
 Optimized GNINA flexible docking pipeline with:
-- Task tracking (status, timing, progress)
-- Resume capability  
-- Robust error handling
+- Task tracking (status, timing, progress) in an SQLite job ledger
+- Resume capability
+- Robust error handling (timeouts, retries, batch bisection)
+- Concurrent GNINA jobs on GPU and CPU slots
+Features and options: readme.md in this folder; --help.
 """
 
 import os
 import re
-import subprocess
+import socket
 import time
 import csv
 import shutil
-import socket
 import traceback
+import argparse
+import math
+import queue
+import signal
+import threading
+import sys
 from pathlib import Path
 from rdkit import Chem
 
+# Shared instrumentation layer lives in the repository's utils/ package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import logger
+from utils.chemistry import ALIAS_PROP, ALIAS_SEP, microspecies_key
+
+from job_ledger import JobLedger, lease_alive, new_lease_owner, parse_shard, shard_of
+from result_cache import (
+    file_sha256, settings_fingerprint, ligand_fingerprint,
+    has_result, store_result, restore_result
+)
+from gnina_output import (
+    read_sdf_records, retitle_record, split_flex_models, split_log_tables,
+    iter_sdf_text_properties, set_record_property
+)
+from results_aggregation import (
+    read_pose_scores, text_pose_scores, best_pose_scores, aggregate_results
+)
+from receptor_crop import DEFAULT_MARGIN, crop_receptor
+from pose_analysis import analyze_poses
+import gnina_runner
+from packed_store import PackedStore
+from sdf_index import SdfIndex, read_record
+
 # =========================
 # GLOBAL CONFIG
 # =========================
-BASE_DIR = "/kaggle/working"
-RESULTS_DIR = f"{BASE_DIR}/docking_results/8skl"
-GNINA_BIN = "/kaggle/working/gnina"
-PROTEIN_PATH = "/kaggle/input/docking-profile/protein_8skl_protonated_chimera.pdb"
-REF_LIGAND = "/kaggle/input/docking-profile/v2o_ligand_8skl.sdf"
-LIGAND_SDF = "/kaggle/input/docking-profile/ligands_for_8skl_prepared_v2.0.sdf"
+# Paths come from the `docking:` section of the config file; CLI flags override
+CONFIG_PATH = str(Path(__file__).resolve().parent.parent / "config.yaml")
+RESULTS_DIR = None
+GNINA_BIN = "gnina"
+PROTEIN_PATH = None
+REF_LIGAND = None
+LIGAND_SDF = None
 FLEX_RESIDUES = "A:182,A:181,A:215,A:262,A:49"
 SEED = "42"
 GPU_DEVICE = "0"
+CROP_MARGIN = None  # Å around the autobox; None docks against the full receptor
+LEASE_TTL = 600.0   # s; a job lease not renewed for this long is taken over
+PACKED = False      # packed output store instead of per-ligand folders
+JOB_TIMEOUT = None  # s of wall clock per GNINA job (per ligand in a batch); None = no limit
+STALL_TIMEOUT = None  # s without new GNINA output (log/stdout) before a job counts as hung
+PROGRESS_INTERVAL = 60.0  # s between live progress notes of a running job
+
+# Attempts after a timeout or a GNINA crash, in order. Each entry
+# overrides gnina_docking_args(): seed_offset is added to the seed,
+# exhaustiveness_scale multiplies the exhaustiveness, any other key is
+# a GNINA flag set to that value. [] = fail at once.
+RETRY_POLICY = [{"seed_offset": 1}, {"seed_offset": 2, "exhaustiveness_scale": 0.5}]
+
+# Docking protocols (gnina_docking_args): the full flexible one, and the
+# cheap rigid screen of the funnel's first stage
+PROFILE_FLEXIBLE = "flexible"
+PROFILE_RIGID = "rigid"
+PROFILE = PROFILE_FLEXIBLE
+SCREEN_EXHAUSTIVENESS = 8
+SCREEN_NUM_MODES = 3
+
+# Funnel ranking keys (results_aggregation.best_pose_scores) → higher is better?
+RANK_KEYS = {"best_cnn_score": True, "best_cnn_affinity": True, "best_affinity": False}
+
+# SD property of promoted.sdf records: the screen's folder name, reused by
+# the flexible stage so a hit keeps its LIG ID across stages and reruns
+DIR_NAME_PROP = "Docking_Dir"
 
 # Status constants
 STATUS_PENDING = "PENDING"
 STATUS_RUNNING = "RUNNING"
 STATUS_DONE = "DONE"
 STATUS_FAILED = "FAILED"
+STATUS_INTERRUPTED = "INTERRUPTED"  # killed by Ctrl-C/SIGTERM, retried on resume
+CLAIMED_ELSEWHERE = "CLAIMED"       # scheduler outcome only, never written to the ledger
+
+# Scheduler state shared between worker threads and the signal handler
+_STOP = threading.Event()
+_ACTIVE_PROCS = {}
+_ACTIVE_LOCK = threading.Lock()
+
+# Job ledger, opened by open_ledger() once RESULTS_DIR is known
+_LEDGER = None
+
+# This session's lease owner ID in the ledger, and its heartbeat
+_LEASE_OWNER = None
+_HEARTBEAT_STOP = threading.Event()
+
+# Packed output store (--packed), opened by open_store() per results tree
+_STORE = None
 
 # =========================
-# STATUS MANAGEMENT (FIXED)
+# STATUS MANAGEMENT (LEDGER)
 # =========================
-def write_status(lig_root: str, status: str, **kwargs):
+def open_ledger(summary_dir: str, ligands: list, import_legacy: bool = False) -> JobLedger:
     """
-    Write status to STATUS.txt.
-    For RUNNING: overwrites file (new run)
-    For DONE/FAILED: appends to preserve history
+    Open summary/ledger.sqlite. Legacy STATUS.txt files are imported when
+    the ledger is new (or on request), so existing result trees resume.
     """
-    status_file = os.path.join(lig_root, "STATUS.txt")
+    global _LEDGER
+    if _LEDGER is not None:
+        _LEDGER.close()  # previous funnel stage
+    _LEDGER = JobLedger(os.path.join(summary_dir, "ledger.sqlite"))
     
-    if status == STATUS_RUNNING:
-        # New run - overwrite
-        with open(status_file, "w") as f:
-            f.write(f"STATUS={status}\n")
-            f.write(f"HOST={socket.gethostname()}\n")
-            f.write(f"START_TIME={time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-    else:
-        # Completion - append
-        with open(status_file, "a") as f:
-            f.write(f"STATUS={status}\n")
-            for key, value in kwargs.items():
-                f.write(f"{key.upper()}={value}\n")
-            f.write(f"END_TIME={time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    if import_legacy or len(_LEDGER) == 0:
+        n = _LEDGER.import_status_files({
+            _job_id(lig["lig_root"]): os.path.join(lig["lig_root"], "STATUS.txt")
+            for lig in ligands
+        })
+        if n:
+            print(f"✔ Imported {n} STATUS.txt records into the job ledger")
+    
+    return _LEDGER
+
+
+def _job_id(lig_root: str) -> str:
+    return os.path.basename(os.path.normpath(lig_root))
+
+
+def write_status(lig_root: str, status: str, **kwargs):
+    """
+    Record a status change in the job ledger.
+    For RUNNING: starts a new attempt (host, start time)
+    For DONE/FAILED/INTERRUPTED: completes it; history is kept as events
+    """
+    _LEDGER.write_status(_job_id(lig_root), status, running_status=STATUS_RUNNING, **kwargs)
 
 
 def read_status(lig_root: str) -> str:
     """
-    Read the LAST status from STATUS.txt.
-    Returns: PENDING, RUNNING, DONE, or FAILED
+    Read the current status from the ledger.
+    Returns: PENDING, RUNNING, DONE, FAILED or INTERRUPTED
     """
-    status_file = os.path.join(lig_root, "STATUS.txt")
-    
-    if not os.path.exists(status_file):
-        return STATUS_PENDING
-    
-    last_status = STATUS_PENDING
-    try:
-        with open(status_file, "r") as f:
-            for line in f:
-                if line.startswith("STATUS="):
-                    last_status = line.strip().split("=", 1)[1]
-    except Exception:
-        pass
-    
-    return last_status
+    return _LEDGER.read_status(_job_id(lig_root), default=STATUS_PENDING)
 
 
 def get_status_details(lig_root: str) -> dict:
-    """Parse full status file into dictionary"""
-    status_file = os.path.join(lig_root, "STATUS.txt")
-    details = {}
-    
-    if os.path.exists(status_file):
-        with open(status_file, "r") as f:
-            for line in f:
-                if "=" in line:
-                    key, value = line.strip().split("=", 1)
-                    details[key] = value
+    """Full status record as a dictionary (STATUS, HOST, START_TIME, ...)"""
+    return _LEDGER.get_status_details(_job_id(lig_root))
+
+
+# =========================
+# SHARDING & LEASES
+# =========================
+def in_shard(lig: dict, shard: tuple | None) -> bool:
+    """Whether `lig` belongs to shard (i, N) of this session (None = all); see shard_of."""
+    return shard is None or shard_of(_job_id(lig["lig_root"]), shard[1]) == shard[0]
+
+
+def claim_ligand(lig: dict) -> bool:
+    """
+    Take the ledger lease of a ligand before docking it. Refused when
+    another session holds a live lease or the ligand is already DONE
+    with the same fingerprint (finished elsewhere in the meantime).
+    """
+    return _LEDGER.claim(
+        _job_id(lig["lig_root"]), _LEASE_OWNER, LEASE_TTL,
+        fingerprint=lig["fingerprint"],
+        done_status=STATUS_DONE,
+        pending_status=STATUS_PENDING
+    )
+
+
+def _heartbeat():
+    """Renew this session's leases every TTL/3 until the run ends."""
+    while not _HEARTBEAT_STOP.wait(LEASE_TTL / 3):
+        try:
+            _LEDGER.renew_leases(_LEASE_OWNER, LEASE_TTL)
+        except Exception as e:
+            print(f"⚠️ Lease heartbeat failed: {e}")
+
+
+def print_stale_jobs():
+    """RUNNING jobs without a live lease, grouped by the HOST that started them."""
+    stale = _LEDGER.stale_jobs(running_status=STATUS_RUNNING)
+    by_host = {}
+    for job in stale:
+        by_host.setdefault(job["host"] or "unknown", []).append(job)
     
-    return details
+    print(f"🧟 {len(stale)} stale {STATUS_RUNNING} job(s) (lease expired or owner gone)")
+    for host, jobs in sorted(by_host.items()):
+        print(f"   {host}: {len(jobs)} — e.g. {jobs[0]['job_id']} since {jobs[0]['start_time']}")
+    return stale
 
 
 # =========================
 # UTILS
 # =========================
+def _tmp_path(path: str) -> str:
+    """
+    Private temp name next to `path`, published with os.replace(); unique
+    per host and process, as sessions may share the results tree.
+    """
+    return f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+
+
 def sanitize_name(name: str, max_len: int = 80) -> str:
     """Make a filesystem-safe ligand name."""
     if not name:
@@ -136,100 +250,561 @@ def prepare_root_folders():
     protein_dest = f"{RESULTS_DIR}/protein/receptor.pdb"
     ref_dest = f"{RESULTS_DIR}/reference/ref_ligand.sdf"
     
-    if not os.path.exists(protein_dest):
-        shutil.copy(PROTEIN_PATH, protein_dest)
-        print(f"✔ Copied receptor to {protein_dest}")
+    # Refresh copies whose source changed, so we never dock against stale inputs
+    for src, dest, label in (
+        (PROTEIN_PATH, protein_dest, "receptor"),
+        (REF_LIGAND, ref_dest, "reference ligand"),
+    ):
+        if not os.path.exists(dest):
+            shutil.copy(src, _tmp_path(dest))
+            os.replace(_tmp_path(dest), dest)
+            print(f"✔ Copied {label} to {dest}")
+        elif file_sha256(src) != file_sha256(dest):
+            shutil.copy(src, _tmp_path(dest))
+            os.replace(_tmp_path(dest), dest)
+            print(f"⚠️ {label.capitalize()} changed — updated {dest}")
     
-    if not os.path.exists(ref_dest):
-        shutil.copy(REF_LIGAND, ref_dest)
-        print(f"✔ Copied reference ligand to {ref_dest}")
+    # Pocket-cropped receptor, rebuilt from the current copies every run
+    if CROP_MARGIN is not None:
+        stats = crop_receptor(
+            protein_dest, ref_dest, _tmp_path(receptor_path()),
+            autobox_add=autobox_add(),
+            margin=CROP_MARGIN,
+            flex_residues=FLEX_RESIDUES
+        )
+        os.replace(_tmp_path(receptor_path()), receptor_path())
+        print(f"✔ Cropped receptor to {stats['residues_kept']}/{stats['residues_total']} residues "
+              f"({stats['atoms_kept']}/{stats['atoms_total']} atoms, margin {CROP_MARGIN} Å)")
 
 
 # =========================
 # SPLIT LIGANDS
 # =========================
-def split_ligands(input_sdf: str, ligands_root: str) -> list:
+def _split_aliases(value: str | None) -> list:
+    """Alias names stored in an ALIAS_PROP value."""
+    return [a for a in (value or "").split(ALIAS_SEP) if a]
+
+
+def describe_record(record: str, settings_fp: str) -> dict | None:
+    """
+    Index fields of one input SDF record (sdf_index build callback);
+    None when RDKit cannot read it.
+    """
+    mol = Chem.MolFromMolBlock(record, removeHs=False)
+    if mol is None:
+        return None
+    _, props = next(
+        iter_sdf_text_properties(record, (ALIAS_PROP, "Conformer_Rank", DIR_NAME_PROP)), ("", {})
+    )
+    key = microspecies_key(mol)
+    return {
+        "name": mol.GetProp("_Name") if mol.HasProp("_Name") else "NA",
+        "smiles": Chem.MolToSmiles(mol),
+        # Duplicates: same microspecies (and Conformer_Rank in ensemble SDFs)
+        "dedup_key": f"{key}\t{props.get('Conformer_Rank', '')}" if key is not None else None,
+        "aliases": props.get(ALIAS_PROP, ""),
+        "dir_name": props.get(DIR_NAME_PROP, ""),
+        "fingerprint": ligand_fingerprint(Chem.MolToMolBlock(mol), settings_fp),
+    }
+
+
+def record_fingerprint(record: str, settings_fp: str) -> str:
+    return ligand_fingerprint(Chem.MolToMolBlock(Chem.MolFromMolBlock(record, removeHs=False)),
+                              settings_fp)
+
+
+def load_ligands(input_sdf: str, ligands_root: str, settings_fp: str = "",
+                 dedup: bool = True) -> list:
     """
-    Split multi-ligand SDF into per-ligand folders.
+    Ligands of a multi-ligand SDF, from its byte-offset index
+    (sdf_index): built on first use, then reused by every launch and
+    session, so a resume starts without re-reading the library.
+    Nothing is written per ligand up front: materialize_input() slices
+    a ligand's record out of the SDF right before it is docked.
     
-    Returns: List of tuples (lig_id, lig_dirname, lig_root, ligand_sdf_path)
+    Each ligand gets a result fingerprint (3D content + docking
+    settings), kept in the index per settings digest.
+    
+    With dedup, duplicate structures (same microspecies, and the same
+    Conformer_Rank in ensemble SDFs) are not docked: their names become
+    aliases of the first record, kept in its ALIAS_PROP, META.txt and
+    ligand_mapping.csv (ALIAS_OF rows). IDs stay tied to SDF positions,
+    so earlier results still resume; records carrying DIR_NAME_PROP
+    (the funnel's promoted.sdf) keep that folder name and its LIG ID.
+    
+    Returns: list of ligand dicts (lig_id, lig_dirname, lig_root,
+    ligand_sdf, input_span, fingerprint, aliases, ...)
     """
     os.makedirs(ligands_root, exist_ok=True)
     
-    suppl = Chem.SDMolSupplier(input_sdf, removeHs=False)
+    index = SdfIndex.open(input_sdf, fallback_dir=ligands_root)
+    if not index.is_current():
+        start = time.time()
+        n = index.build(lambda record: describe_record(record, settings_fp), settings_fp)
+        print(f"✔ Indexed {n} SDF records in {time.time() - start:.1f} s → {index.index_path}")
+    records = index.records()
+    fingerprints = index.fingerprints(settings_fp)
+    if not fingerprints and any(row["valid"] for row in records):
+        # Same library, new receptor or docking settings
+        fingerprints = index.add_fingerprints(
+            settings_fp, lambda record: record_fingerprint(record, settings_fp)
+        )
+    index.close()
+    
+    # Dedup: later records with the key of an earlier one become its aliases
+    first, alias_of, merged = {}, {}, {}
+    for row in records:
+        key = row["dedup_key"]
+        if not dedup or not row["valid"] or key is None:
+            continue
+        if key not in first:
+            first[key] = row["sdf_index"]
+            continue
+        alias_of[row["sdf_index"]] = first[key]
+        merged.setdefault(first[key], []).extend([row["name"]] + _split_aliases(row["aliases"]))
+    
     ligands = []
-    mapping = []
     
-    for idx, mol in enumerate(suppl, start=1):
-        if mol is None:
+    for row in records:
+        idx = row["sdf_index"]
+        if not row["valid"]:
             print(f"⚠️ Skipping invalid molecule at index {idx}")
             continue
+        if idx in alias_of:
+            continue
         
-        # Canonical ID
-        lig_id = f"LIG_{idx:04d}"
-        
-        # Original name from SDF
-        orig_name = mol.GetProp("_Name") if mol.HasProp("_Name") else "NA"
-        safe_name = sanitize_name(orig_name)
-        
-        # Directory structure
-        lig_dirname = f"{lig_id}__{safe_name}"
-        lig_root = os.path.join(ligands_root, lig_dirname)
-        input_dir = os.path.join(lig_root, "input")
-        os.makedirs(input_dir, exist_ok=True)
-        
-        # Write single-ligand SDF
-        ligand_sdf = os.path.join(input_dir, "ligand.sdf")
-        writer = Chem.SDWriter(ligand_sdf)
-        writer.write(mol)
-        writer.close()
-        
-        # Metadata
-        smiles = Chem.MolToSmiles(mol)
-        with open(os.path.join(lig_root, "META.txt"), "w") as f:
-            f.write(f"ID={lig_id}\n")
-            f.write(f"DIR_NAME={lig_dirname}\n")
-            f.write(f"ORIGINAL_NAME={orig_name}\n")
-            f.write(f"SMILES={smiles}\n")
-            f.write(f"SDF_INDEX={idx}\n")
+        # Every name this structure stands for
+        aliases = list(dict.fromkeys(_split_aliases(row["aliases"]) + merged.get(idx, [])))
         
-        ligands.append({
-            "lig_id": lig_id,
-            "lig_dirname": lig_dirname,
-            "lig_root": lig_root,
-            "ligand_sdf": ligand_sdf,
-            "orig_name": orig_name,
-            "smiles": smiles
-        })
-        
-        mapping.append((lig_id, lig_dirname, orig_name, smiles))
+        lig = new_ligand(idx, row["name"], row["smiles"], fingerprints[idx], aliases, ligands_root,
+                         dir_name=row["dir_name"])
+        lig["input_span"] = (input_sdf, row["offset"], row["length"])
+        ligands.append(lig)
     
-    # Write mapping file
-    mapping_file = os.path.join(ligands_root, "ligand_mapping.csv")
-    with open(mapping_file, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["ID", "DIR_NAME", "ORIGINAL_NAME", "SMILES"])
-        for row in mapping:
-            writer.writerow(row)
+    mapping_file = write_mapping(ligands, ligands_root)
     
-    print(f"✔ Split {len(ligands)} ligands")
+    print(f"✔ Loaded {len(ligands)} ligands"
+          + (f" ({len(alias_of)} duplicate records merged as aliases)" if alias_of else ""))
     print(f"✔ Mapping written to {mapping_file}")
     
     return ligands
 
 
+def new_ligand(idx: int, orig_name: str, smiles: str, fingerprint: str, aliases: list,
+               ligands_root: str, dir_name: str | None = None) -> dict:
+    """
+    Ligand dict of the record at SDF position `idx` (without its input
+    source). `dir_name`: folder name given by the record (DIR_NAME_PROP),
+    which also fixes the LIG ID.
+    """
+    # Canonical ID
+    lig_id = dir_name.split("__", 1)[0] if dir_name else f"LIG_{idx:04d}"
+    
+    # Directory structure (created when the ligand is docked)
+    lig_dirname = dir_name or f"{lig_id}__{sanitize_name(orig_name)}"
+    lig_root = os.path.join(ligands_root, lig_dirname)
+    
+    return {
+        "lig_id": lig_id,
+        "lig_dirname": lig_dirname,
+        "lig_root": lig_root,
+        "ligand_sdf": os.path.join(lig_root, "input", "ligand.sdf"),
+        "orig_name": orig_name,
+        "smiles": smiles,
+        "fingerprint": fingerprint,
+        "aliases": aliases,
+        "sdf_index": idx
+    }
+
+
+def write_mapping(ligands: list, ligands_root: str) -> str:
+    """ligand_mapping.csv: one row per ligand, plus one ALIAS_OF row per alias name."""
+    mapping_file = os.path.join(ligands_root, "ligand_mapping.csv")
+    with open(_tmp_path(mapping_file), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ID", "DIR_NAME", "ORIGINAL_NAME", "SMILES", "ALIAS_OF"])
+        for lig in ligands:
+            writer.writerow([lig["lig_id"], lig["lig_dirname"], lig["orig_name"], lig["smiles"], ""])
+            for alias in lig["aliases"]:
+                writer.writerow([lig["lig_id"], lig["lig_dirname"], alias, lig["smiles"],
+                                 lig["orig_name"]])
+    os.replace(_tmp_path(mapping_file), mapping_file)
+    return mapping_file
+
+
+def stream_ligands(records, ligands_root: str, ligands: list, settings_fp: str = "",
+                   dedup: bool = True):
+    """
+    load_ligands() for a library that is still being prepared
+    (run_pipeline.py): yields (idx, ligand) for every SDF record text
+    taken from `records`, as it arrives, and appends it to `ligands`.
+    
+    Records are numbered like the finished SDF, so IDs, folders and
+    fingerprints match a later load_ligands() of it and results resume
+    either way. The SDF is still being written, so the record text is
+    kept in the ligand dict ("record") instead of an input_span.
+    Duplicates become aliases of the first record, as in load_ligands().
+    """
+    os.makedirs(ligands_root, exist_ok=True)
+    first = {}
+    
+    for idx, record in enumerate(records, start=1):
+        info = describe_record(record, settings_fp)
+        if info is None:
+            print(f"⚠️ Skipping invalid molecule at index {idx}")
+            continue
+        
+        key = info["dedup_key"] if dedup else None
+        if key is not None and key in first:
+            aliases = first[key]["aliases"]
+            for alias in [info["name"]] + _split_aliases(info["aliases"]):
+                if alias not in aliases:
+                    aliases.append(alias)
+            continue
+        
+        lig = new_ligand(idx, info["name"], info["smiles"], info["fingerprint"],
+                         _split_aliases(info["aliases"]), ligands_root, dir_name=info["dir_name"])
+        lig["record"] = record
+        if key is not None:
+            first[key] = lig
+        ligands.append(lig)
+        yield idx, lig
+
+
+def meta_text(lig: dict) -> str:
+    """META.txt content of a ligand."""
+    lines = [
+        f"ID={lig['lig_id']}",
+        f"DIR_NAME={lig['lig_dirname']}",
+        f"ORIGINAL_NAME={lig['orig_name']}",
+        f"SMILES={lig['smiles']}",
+        f"SDF_INDEX={lig['sdf_index']}",
+        f"FINGERPRINT={lig['fingerprint']}",
+    ]
+    if lig["aliases"]:
+        lines.append(f"ALIASES={ALIAS_SEP.join(lig['aliases'])}")
+    return "\n".join(lines) + "\n"
+
+
+# =========================
+# PACKED OUTPUT
+# =========================
+def open_store() -> PackedStore:
+    """Open <RESULTS_DIR>/packed (closing the previous funnel stage's store)."""
+    global _STORE
+    if _STORE is not None:
+        _STORE.close()
+    _STORE = PackedStore(f"{RESULTS_DIR}/packed")
+    return _STORE
+
+
+def read_ligand_input(lig: dict) -> str:
+    """
+    SDF text of a ligand's input record, sliced from the mmap'ed input
+    SDF (or streamed from ligand preparation); merged alias names are
+    added as ALIAS_PROP.
+    """
+    record = lig.get("record") or read_record(*lig["input_span"])
+    if lig["aliases"]:
+        record = set_record_property(record, ALIAS_PROP, ALIAS_SEP.join(lig["aliases"]))
+    return record
+
+
+def materialize_input(lig: dict):
+    """
+    Write input/ligand.sdf (and META.txt, unless PACKED) of a ligand
+    about to be docked. Rewritten every time, so a changed input SDF
+    never leaves a stale record behind.
+    """
+    os.makedirs(os.path.dirname(lig["ligand_sdf"]), exist_ok=True)
+    with open(_tmp_path(lig["ligand_sdf"]), "w") as f:
+        f.write(read_ligand_input(lig))
+    os.replace(_tmp_path(lig["ligand_sdf"]), lig["ligand_sdf"])
+    if not PACKED:
+        meta_file = os.path.join(lig["lig_root"], "META.txt")
+        with open(_tmp_path(meta_file), "w") as f:
+            f.write(meta_text(lig))
+        os.replace(_tmp_path(meta_file), meta_file)
+
+
+def pack_ligand(lig: dict, info: dict, cache: bool = True):
+    """
+    Move a docked ligand's folder into the packed store and remove it.
+    cache=False: not findable by fingerprint (docked with other flags).
+    """
+    lig_root = lig["lig_root"]
+    with logger.stage("pack", lig["lig_id"]):
+        _STORE.put_folder(
+            _job_id(lig_root), lig_root,
+            files={"META.txt": meta_text(lig)},
+            lig_id=lig["lig_id"],
+            fingerprint=lig["fingerprint"] if cache else None,
+            info=info
+        )
+    shutil.rmtree(lig_root, ignore_errors=True)
+
+
+def restore_packed(lig: dict) -> dict | None:
+    """
+    Result cache for packed trees: point the ligand at a stored result
+    with its fingerprint (index rows only). Returns its info, or None.
+    """
+    hit = _STORE.find_result(lig["fingerprint"])
+    if hit is None:
+        return None
+    source, info = hit
+    job_id = _job_id(lig["lig_root"])
+    if source != job_id:
+        _STORE.link_result(job_id, source, lig_id=lig["lig_id"])
+        _STORE.put(job_id, {"META.txt": meta_text(lig),
+                            "input/ligand.sdf": read_ligand_input(lig)})
+    return info
+
+
+def docked_pose_scores(lig: dict) -> dict:
+    """parse_best_score() of a ligand's docked poses, packed or in its folder."""
+    if PACKED:
+        text = _STORE.get_text(_job_id(lig["lig_root"]), "output/docked.sdf")
+        return best_pose_scores(text_pose_scores(text) if text else [])
+    return parse_best_score(os.path.join(lig["lig_root"], "output", "docked.sdf"))
+
+
 # =========================
 # RUN GNINA FOR ONE LIGAND
 # =========================
-def run_gnina(ligand_info: dict, idx: int, total: int) -> bool:
+def gnina_docking_args() -> list:
+    """
+    GNINA search/scoring flags shared by every ligand.
+    No paths and no device: this list is part of the result fingerprint.
+    
+    PROFILE_RIGID (funnel screen): no flexible residues, low
+    exhaustiveness, few modes; CNN rescoring is kept for the ranking.
+    """
+    if PROFILE == PROFILE_RIGID:
+        return [
+            "--autobox_add", "5",
+            "--autobox_extend", "1",
+            "--num_modes", str(SCREEN_NUM_MODES),
+            "--exhaustiveness", str(SCREEN_EXHAUSTIVENESS),
+            "--cnn_scoring", "rescore",
+            "--cnn_empirical_weight", "2.0",
+            "--pose_sort_order", "CNNscore",
+            "--seed", SEED,
+        ]
+    return [
+        "--autobox_add", "5",
+        "--autobox_extend", "1",
+        "--flexres", FLEX_RESIDUES,
+        "--num_modes", "10",
+        "--exhaustiveness", "32",
+        "--cnn_scoring", "rescore",
+        "--cnn_empirical_weight", "2.0",
+        "--pose_sort_order", "CNNscore",
+        "--seed", SEED,
+        "--atom_term_data",
+    ]
+
+
+def autobox_add() -> float:
+    args = gnina_docking_args()
+    return float(args[args.index("--autobox_add") + 1])
+
+
+def retry_args(docking_args: list, overrides: dict) -> list:
+    """Docking flags with one RETRY_POLICY entry applied."""
+    args = list(docking_args)
+    for key, value in overrides.items():
+        if key == "seed_offset":
+            flag, value = "--seed", int(args[args.index("--seed") + 1]) + int(value)
+        elif key == "exhaustiveness_scale":
+            current = int(args[args.index("--exhaustiveness") + 1])
+            flag, value = "--exhaustiveness", max(1, round(current * float(value)))
+        else:
+            flag = "--" + key
+        if flag in args:
+            args[args.index(flag) + 1] = str(value)
+        else:
+            args += [flag, str(value)]
+    return args
+
+
+def describe_retry(docking_args: list, overrides: dict) -> str:
+    """'seed=43 exhaustiveness=16': the flags a retry changed, for status and logs."""
+    changed = []
+    for key in overrides:
+        flag = {"seed_offset": "--seed", "exhaustiveness_scale": "--exhaustiveness"}.get(key, "--" + key)
+        changed.append(f"{flag[2:]}={docking_args[docking_args.index(flag) + 1]}")
+    return " ".join(changed)
+
+
+def receptor_path() -> str:
+    """Receptor passed to GNINA: the pocket crop when --crop-margin is set."""
+    if CROP_MARGIN is not None:
+        return f"{RESULTS_DIR}/protein/receptor_pocket.pdb"
+    return f"{RESULTS_DIR}/protein/receptor.pdb"
+
+
+def cache_root() -> str:
+    return f"{RESULTS_DIR}/cache"
+
+
+def slot_args(slot: dict) -> list:
+    """GNINA device arguments for a scheduler slot."""
+    if slot.get("cpu"):
+        return ["--no_gpu", "--cpu", str(slot["cpu"])]
+    return ["--device", str(slot.get("device", GPU_DEVICE))]
+
+
+def build_gnina_cmd(ligand_sdf: str, out_lig: str, out_flex: str, log_file: str,
+                    slot: dict, receptor: str = None, docking_args: list = None) -> list:
+    docking_args = docking_args or gnina_docking_args()
+    # Flexible side-chain poses only exist with --flexres
+    flex_args = ["--out_flex", out_flex] if "--flexres" in docking_args else []
+    return [
+        GNINA_BIN,
+        "-r", receptor or receptor_path(),
+        "-l", ligand_sdf,
+        "--autobox_ligand", f"{RESULTS_DIR}/reference/ref_ligand.sdf",
+        *docking_args,
+        *slot_args(slot),
+        "-o", out_lig,
+        *flex_args,
+        "--log", log_file,
+    ]
+
+
+def _run_process(cmd: list, stderr_file: str, key: str, stage: str = "gnina",
+                 log_file: str = None, wall_timeout: float = None,
+                 progress_root: str = None) -> dict:
+    """
+    Run one GNINA process with gnina_runner (stdout and `log_file`
+    tailed while it runs), stderr to file.
+    Own session, so Ctrl-C reaches the scheduler first and children
+    are terminated (and marked) in a controlled way. Jobs over
+    `wall_timeout` or silent for STALL_TIMEOUT seconds are killed.
+    Every PROGRESS_INTERVAL the completion estimate is printed and, for
+    `progress_root`, noted in the ledger (PROGRESS).
+    The wall time is recorded as metrics `stage` for item `key`.
+    
+    Returns: {"returncode", "timeout", "progress", "elapsed_s"}
     """
-    Run GNINA docking for a single ligand.
+    def on_start(handle):
+        with _ACTIVE_LOCK:
+            _ACTIVE_PROCS[key] = handle
+            if _STOP.is_set():
+                handle.terminate()
     
-    Returns: True if successful, False otherwise
+    last_note = [0.0]
+    
+    def on_progress(percent, elapsed):
+        if elapsed - last_note[0] < PROGRESS_INTERVAL:
+            return
+        last_note[0] = elapsed
+        print(f"⏳ {key}: ~{percent}% after {elapsed / 60:.1f} min")
+        if progress_root:
+            _LEDGER.note(_job_id(progress_root), progress=f"{percent}%")
+    
+    try:
+        with logger.stage(stage, key):
+            return gnina_runner.run(
+                cmd, stderr_file, log_file,
+                wall_timeout=wall_timeout,
+                stall_timeout=STALL_TIMEOUT,
+                on_start=on_start,
+                on_progress=on_progress
+            )
+    finally:
+        with _ACTIVE_LOCK:
+            _ACTIVE_PROCS.pop(key, None)
+
+
+def gnina_error(result: dict, out_lig: str, wall_timeout: float = None) -> tuple | None:
+    """
+    Why a GNINA run did not produce a result.
+    Returns: (error message, metrics failure reason), or None on success
+    """
+    if result["timeout"] == gnina_runner.TIMEOUT_WALL:
+        return (f"GNINA wall-clock timeout ({wall_timeout:g} s, ~{result['progress']}% done)",
+                "timeout_wall")
+    if result["timeout"] == gnina_runner.TIMEOUT_STALL:
+        return (f"GNINA stalled (no output for {STALL_TIMEOUT:g} s, ~{result['progress']}% done)",
+                "timeout_stall")
+    if result["returncode"] != 0:
+        return f"GNINA exit code {result['returncode']}", f"exit_code_{result['returncode']}"
+    if not os.path.exists(out_lig) or os.path.getsize(out_lig) == 0:
+        return "GNINA produced empty output SDF", "empty_output"
+    return None
+
+
+def _finish_ligand(ligand_info: dict, elapsed: float, idx: int, total: int,
+                   cache: bool = True, **extra) -> str:
+    """
+    Parse the best score, mark DONE and keep the result under its
+    fingerprint (cache=False: docked with other flags, e.g. a retry).
+    With PACKED, the folder is moved into the packed store first.
+    """
+    lig_root = ligand_info["lig_root"]
+    out_lig = os.path.join(lig_root, "output", "docked.sdf")
+    
+    # Parse best scores from output
+    with logger.stage("parse", ligand_info["lig_id"]):
+        best = parse_best_score(out_lig)
+    best_score = best["best_cnn_score"]
+    best_affinity = best["best_affinity"]
+    
+    result_info = {
+        "elapsed_min": f"{elapsed:.2f}",
+        "best_cnn_score": f"{best_score:.4f}" if best_score is not None else "NA",
+        "best_affinity": f"{best_affinity:.2f}" if best_affinity is not None else "NA",
+    }
+    if PACKED:
+        pack_ligand(ligand_info, result_info, cache=cache)
+    write_status(
+        lig_root, 
+        STATUS_DONE,
+        fingerprint=ligand_info["fingerprint"],
+        **result_info,
+        **extra
+    )
+    if cache and not PACKED:
+        with logger.stage("result_store", ligand_info["lig_id"]):
+            store_result(cache_root(), ligand_info["fingerprint"], lig_root, result_info)
+    
+    print(f"✅ [{idx}/{total}] {ligand_info['lig_id']} DONE in {elapsed:.2f} min "
+          f"(CNNscore: {result_info['best_cnn_score']}, affinity: {result_info['best_affinity']})")
+    return STATUS_DONE
+
+
+def _mark_interrupted(items: list, start: float, total: int) -> dict:
+    elapsed = (time.time() - start) / 60
+    for idx, lig in items:
+        write_status(
+            lig["lig_root"],
+            STATUS_INTERRUPTED,
+            elapsed_min=f"{elapsed:.2f}",
+            error="Interrupted by signal"
+        )
+        print(f"🛑 [{idx}/{total}] {lig['lig_id']} INTERRUPTED — will retry on resume")
+        logger.failure("gnina", "interrupted", lig["lig_id"])
+    return {lig["lig_id"]: STATUS_INTERRUPTED for _, lig in items}
+
+
+def run_gnina(ligand_info: dict, idx: int, total: int, slot: dict = None) -> str:
+    """
+    Run GNINA docking for a single ligand on one scheduler slot.
+    
+    Timeouts and crashes are retried under RETRY_POLICY; each retry is
+    a new RUNNING attempt in the ledger (RETRY, PREVIOUS_ERROR and the
+    changed flags), and the final status records RETRY/RETRY_ARGS.
+    Retry results are not stored in the result cache (other flags than
+    the fingerprint).
+    
+    Returns: final status (DONE, FAILED or INTERRUPTED)
     """
     lig_id = ligand_info["lig_id"]
     lig_root = ligand_info["lig_root"]
     ligand_sdf = ligand_info["ligand_sdf"]
+    slot = slot or {"name": "gpu0", "device": GPU_DEVICE}
     
     out_dir = os.path.join(lig_root, "output")
     log_dir = os.path.join(lig_root, "logs")
@@ -244,211 +819,971 @@ def run_gnina(ligand_info: dict, idx: int, total: int) -> bool:
     
     # Mark as RUNNING
     write_status(lig_root, STATUS_RUNNING)
+    materialize_input(ligand_info)
     
-    print(f"\n🔄 [{idx}/{total}] Docking {lig_id} ...")
+    print(f"\n🔄 [{idx}/{total}] Docking {lig_id} on {slot['name']} ...")
     start = time.time()
+    error = None
     
-    cmd = [
-        GNINA_BIN,
-        "-r", f"{RESULTS_DIR}/protein/receptor.pdb",
-        "-l", ligand_sdf,
-        "--autobox_ligand", f"{RESULTS_DIR}/reference/ref_ligand.sdf",
-        "--autobox_add", "5",
-        "--autobox_extend", "1",
-        "--flexres", FLEX_RESIDUES,
-        "--num_modes", "10",
-        "--exhaustiveness", "32",
-        "--cnn_scoring", "rescore",
-        "--cnn_empirical_weight", "2.0",
-        "--pose_sort_order", "CNNscore",
-        "--device", GPU_DEVICE,
-        "--seed", SEED,
-        "--atom_term_data",
-        "-o", out_lig,
-        "--out_flex", out_flex,
-        "--log", log_file,
-    ]
+    for attempt, overrides in enumerate([{}] + RETRY_POLICY):
+        docking_args = retry_args(gnina_docking_args(), overrides)
+        retry_info = {}
+        if attempt:
+            retry_info = {"retry": attempt, "retry_args": describe_retry(docking_args, overrides)}
+            # New attempt, same lease: the failed one is kept as an event
+            write_status(lig_root, STATUS_RUNNING, previous_error=error, **retry_info)
+            print(f"🔁 [{idx}/{total}] {lig_id} retry {attempt}/{len(RETRY_POLICY)} "
+                  f"({retry_info['retry_args']}) on {slot['name']} ...")
+        
+        # A killed attempt may leave partial output behind
+        for path in (out_lig, out_flex):
+            if os.path.exists(path):
+                os.remove(path)
+        
+        cmd = build_gnina_cmd(ligand_sdf, out_lig, out_flex, log_file, slot,
+                              docking_args=docking_args)
+        
+        # Save command for debugging
+        with open(cmd_file, "w") as f:
+            f.write(" \\\n    ".join(cmd))
+        
+        try:
+            result = _run_process(cmd, stderr_file, lig_id, log_file=log_file,
+                                  wall_timeout=JOB_TIMEOUT, progress_root=lig_root)
+            
+            if result["returncode"] != 0 and _STOP.is_set():
+                _mark_interrupted([(idx, ligand_info)], start, total)
+                return STATUS_INTERRUPTED
+            
+            failure = gnina_error(result, out_lig, JOB_TIMEOUT)
+            if failure is None:
+                elapsed = (time.time() - start) / 60
+                return _finish_ligand(ligand_info, elapsed, idx, total,
+                                      cache=not attempt, **retry_info)
+            
+        except Exception as e:
+            elapsed = (time.time() - start) / 60
+            write_status(
+                lig_root, 
+                STATUS_FAILED,
+                elapsed_min=f"{elapsed:.2f}",
+                error=str(e),
+                traceback=traceback.format_exc().replace("\n", " | "),
+                **retry_info
+            )
+            print(f"❌ [{idx}/{total}] {lig_id} FAILED: {e}")
+            logger.failure("gnina", type(e).__name__, lig_id)
+            return STATUS_FAILED
+        
+        error, reason = failure
+        logger.failure("gnina", reason, lig_id, attempt=attempt)
+        if attempt < len(RETRY_POLICY):
+            print(f"⚠️ [{idx}/{total}] {lig_id}: {error}")
+    
+    elapsed = (time.time() - start) / 60
+    write_status(
+        lig_root, 
+        STATUS_FAILED,
+        elapsed_min=f"{elapsed:.2f}",
+        error=error,
+        **retry_info
+    )
+    print(f"❌ [{idx}/{total}] {lig_id} FAILED: {error}")
+    return STATUS_FAILED
+
+
+# =========================
+# BATCHED GNINA (MULTI-LIGAND)
+# =========================
+def run_gnina_batch(batch: list, total: int, slot: dict = None) -> dict:
+    """
+    Dock a chunk of ligands [(idx, ligand_info), ...] in ONE GNINA process,
+    so the receptor, grids and CNN model are loaded once per chunk.
+    
+    Poses, flex residues and the log are split back into each ligand's
+    folder. If GNINA fails, the batch is bisected and both halves retried,
+    down to single ligands (plain run_gnina).
     
-    # Save command for debugging
-    with open(cmd_file, "w") as f:
+    Returns: {lig_id: final status}
+    """
+    if len(batch) == 1:
+        idx, lig = batch[0]
+        return {lig["lig_id"]: run_gnina(lig, idx, total, slot)}
+    
+    slot = slot or {"name": "gpu0", "device": GPU_DEVICE}
+    first_id, last_id = batch[0][1]["lig_id"], batch[-1][1]["lig_id"]
+    batch_name = f"{first_id}__{last_id}"
+    batch_dir = os.path.join(RESULTS_DIR, "batches", batch_name)
+    os.makedirs(batch_dir, exist_ok=True)
+    
+    in_sdf = os.path.join(batch_dir, "ligands.sdf")
+    out_lig = os.path.join(batch_dir, "docked.sdf")
+    out_flex = os.path.join(batch_dir, "flex_residues.pdb")
+    log_file = os.path.join(batch_dir, "gnina.log")
+    stderr_file = os.path.join(batch_dir, "gnina_stderr.log")
+    
+    for _, lig in batch:
+        write_status(lig["lig_root"], STATUS_RUNNING)
+    
+    # Titles are replaced by lig_id so output poses map back unambiguously
+    titles = {}
+    with open(in_sdf, "w") as f:
+        for _, lig in batch:
+            materialize_input(lig)
+            for title, record in read_sdf_records(lig["ligand_sdf"]):
+                titles[lig["lig_id"]] = title
+                f.write(retitle_record(record, lig["lig_id"]))
+    
+    print(f"\n🔄 [{batch[0][0]}-{batch[-1][0]}/{total}] Docking batch of {len(batch)} "
+          f"({first_id}..{last_id}) on {slot['name']} ...")
+    start = time.time()
+    
+    cmd = build_gnina_cmd(in_sdf, out_lig, out_flex, log_file, slot)
+    with open(os.path.join(batch_dir, "command.txt"), "w") as f:
         f.write(" \\\n    ".join(cmd))
     
-    # Run GNINA - redirect stderr to file instead of PIPE
+    wall_timeout = JOB_TIMEOUT * len(batch) if JOB_TIMEOUT else None
     try:
-        with open(stderr_file, "w") as stderr_f:
-            result = subprocess.run(
-                cmd,
-                check=True,
-                stdout=subprocess.DEVNULL,  # Discard stdout (logs go to file)
-                stderr=stderr_f,
-                text=True
+        result = _run_process(cmd, stderr_file, batch_name, stage="gnina_batch",
+                              log_file=log_file, wall_timeout=wall_timeout)
+        if result["returncode"] != 0 and _STOP.is_set():
+            return _mark_interrupted(batch, start, total)
+        failure = gnina_error(result, out_lig, wall_timeout)
+        error = failure[0] if failure else None
+    except Exception as e:
+        error = str(e)
+    
+    if error is not None:
+        # Bisect: one bad ligand must not fail its neighbours
+        print(f"⚠️ Batch {batch_name} failed ({error}) — bisecting")
+        logger.failure("gnina_batch", "bisected", batch_name)
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        mid = len(batch) // 2
+        results = run_gnina_batch(batch[:mid], total, slot)
+        if _STOP.is_set():
+            results.update(_mark_interrupted(batch[mid:], start, total))
+        else:
+            results.update(run_gnina_batch(batch[mid:], total, slot))
+        return results
+    
+    elapsed = (time.time() - start) / 60
+    results = _split_batch_output(batch, batch_dir, titles, elapsed, total)
+    shutil.rmtree(batch_dir, ignore_errors=True)
+    return results
+
+
+def _split_batch_output(batch: list, batch_dir: str, titles: dict, elapsed: float,
+                        total: int) -> dict:
+    """Write each ligand's share of a batch run into the per-ligand layout."""
+    records = read_sdf_records(os.path.join(batch_dir, "docked.sdf"))
+    pose_owner = [title for title, _ in records]
+    
+    flex_file = os.path.join(batch_dir, "flex_residues.pdb")
+    models = split_flex_models(flex_file) if os.path.exists(flex_file) else []
+    if len(models) != len(records):
+        models = None  # cannot attribute flex poses reliably
+    
+    log_file = os.path.join(batch_dir, "gnina.log")
+    preamble, tables = split_log_tables(log_file) if os.path.exists(log_file) else ("", [])
+    docked_order = list(dict.fromkeys(pose_owner))
+    if len(tables) != len(docked_order):
+        tables = None
+    
+    with open(os.path.join(batch_dir, "command.txt")) as f:
+        command = f.read()
+    
+    per_ligand = elapsed / len(batch)
+    batch_name = os.path.basename(batch_dir)
+    results = {}
+    
+    for idx, lig in batch:
+        lig_id = lig["lig_id"]
+        lig_root = lig["lig_root"]
+        out_dir = os.path.join(lig_root, "output")
+        log_dir = os.path.join(lig_root, "logs")
+        os.makedirs(out_dir, exist_ok=True)
+        os.makedirs(log_dir, exist_ok=True)
+        
+        pose_idx = [i for i, owner in enumerate(pose_owner) if owner == lig_id]
+        if not pose_idx:
+            write_status(
+                lig_root,
+                STATUS_FAILED,
+                elapsed_min=f"{per_ligand:.2f}",
+                error="No poses in batch output",
+                batch=batch_name
             )
+            print(f"❌ [{idx}/{total}] {lig_id} FAILED: no poses in batch output")
+            results[lig_id] = STATUS_FAILED
+            continue
         
-        # Sanity check
-        if not os.path.exists(out_lig) or os.path.getsize(out_lig) == 0:
-            raise RuntimeError("GNINA produced empty output SDF")
+        with open(os.path.join(out_dir, "docked.sdf"), "w") as f:
+            for i in pose_idx:
+                f.write(retitle_record(records[i][1], titles.get(lig_id, lig_id)))
         
-        elapsed = (time.time() - start) / 60
+        if models is not None:
+            with open(os.path.join(out_dir, "flex_residues.pdb"), "w") as f:
+                f.write("".join(models[i] for i in pose_idx))
         
-        # Parse best score from output
-        best_score = parse_best_score(out_lig)
+        with open(os.path.join(log_dir, "gnina.log"), "w") as f:
+            if tables is not None:
+                f.write(preamble + tables[docked_order.index(lig_id)])
+            else:
+                with open(log_file) as src:
+                    f.write(src.read())
         
-        # Mark as DONE
-        write_status(
-            lig_root, 
-            STATUS_DONE,
-            elapsed_min=f"{elapsed:.2f}",
-            best_cnn_score=f"{best_score:.4f}" if best_score else "NA"
+        with open(os.path.join(log_dir, "command.txt"), "w") as f:
+            f.write(command)
+        shutil.copyfile(
+            os.path.join(batch_dir, "gnina_stderr.log"),
+            os.path.join(log_dir, "gnina_stderr.log")
         )
         
-        print(f"✅ [{idx}/{total}] {lig_id} DONE in {elapsed:.2f} min (score: {best_score:.4f})")
-        return True
+        results[lig_id] = _finish_ligand(lig, per_ligand, idx, total, batch=batch_name)
+    
+    return results
+
+
+def parse_best_score(sdf_path: str) -> dict:
+    """
+    Best pose per scoring term from a docked SDF (text-level, no RDKit).
+    
+    Poses are sorted by CNNscore, so the best CNNscore is the maximum and
+    the best Vina affinity is the minimum minimizedAffinity.
+    
+    Returns: best_pose_scores() dict; values are None when unavailable
+    """
+    try:
+        return best_pose_scores(read_pose_scores(sdf_path))
+    except OSError:
+        return best_pose_scores([])
+
+
+# =========================
+# CROPPED RECEPTOR VALIDATION
+# =========================
+def validate_crop(ligands: list, n_sample: int, slot: dict, summary_dir: str) -> list:
+    """
+    Dock an evenly spaced sample with the full and the cropped receptor
+    and compare best scores (same seed, same flags).
+    
+    Report: summary/crop_validation.csv
+    Returns: list of report rows
+    """
+    full = f"{RESULTS_DIR}/protein/receptor.pdb"
+    pocket = receptor_path()
+    val_root = f"{RESULTS_DIR}/crop_validation"
+    
+    step = max(1, len(ligands) // max(1, n_sample))
+    sample = ligands[::step][:n_sample]
+    
+    rows = []
+    for idx, lig in enumerate(sample, start=1):
+        materialize_input(lig)
+        scores = {}
+        for label, receptor in (("full", full), ("pocket", pocket)):
+            out_dir = os.path.join(val_root, label, lig["lig_dirname"])
+            os.makedirs(out_dir, exist_ok=True)
+            out_lig = os.path.join(out_dir, "docked.sdf")
+            cmd = build_gnina_cmd(
+                lig["ligand_sdf"], out_lig,
+                os.path.join(out_dir, "flex_residues.pdb"),
+                os.path.join(out_dir, "gnina.log"),
+                slot, receptor=receptor
+            )
+            start = time.time()
+            result = _run_process(cmd, os.path.join(out_dir, "gnina.stderr"),
+                                  key=f"crop-{label}-{lig['lig_id']}",
+                                  wall_timeout=JOB_TIMEOUT)
+            elapsed = time.time() - start
+            ok = result["returncode"] == 0 and result["timeout"] is None
+            best = parse_best_score(out_lig) if ok else best_pose_scores([])
+            scores[label] = (best, elapsed)
+        
+        (full_best, full_sec), (pocket_best, pocket_sec) = scores["full"], scores["pocket"]
         
-    except subprocess.CalledProcessError as e:
-        elapsed = (time.time() - start) / 60
-        write_status(
-            lig_root, 
-            STATUS_FAILED,
-            elapsed_min=f"{elapsed:.2f}",
-            error=f"GNINA exit code {e.returncode}"
-        )
-        print(f"❌ [{idx}/{total}] {lig_id} FAILED: GNINA exit code {e.returncode}")
-        return False
+        def delta(key):
+            a, b = full_best[key], pocket_best[key]
+            return b - a if a is not None and b is not None else None
         
-    except Exception as e:
-        elapsed = (time.time() - start) / 60
-        write_status(
-            lig_root, 
-            STATUS_FAILED,
-            elapsed_min=f"{elapsed:.2f}",
-            error=str(e),
-            traceback=traceback.format_exc().replace("\n", " | ")
-        )
-        print(f"❌ [{idx}/{total}] {lig_id} FAILED: {e}")
-        return False
+        rows.append({
+            "ID": lig["lig_id"],
+            "FULL_CNN_SCORE": full_best["best_cnn_score"],
+            "POCKET_CNN_SCORE": pocket_best["best_cnn_score"],
+            "DELTA_CNN_SCORE": delta("best_cnn_score"),
+            "FULL_AFFINITY": full_best["best_affinity"],
+            "POCKET_AFFINITY": pocket_best["best_affinity"],
+            "DELTA_AFFINITY": delta("best_affinity"),
+            "FULL_SEC": f"{full_sec:.1f}",
+            "POCKET_SEC": f"{pocket_sec:.1f}",
+        })
+        print(f"🔍 [{idx}/{len(sample)}] {lig['lig_id']} "
+              f"ΔCNNscore={rows[-1]['DELTA_CNN_SCORE']} Δaffinity={rows[-1]['DELTA_AFFINITY']} "
+              f"({full_sec:.1f}s → {pocket_sec:.1f}s)")
+    
+    report = os.path.join(summary_dir, "crop_validation.csv")
+    with open(report, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["ID"])
+        writer.writeheader()
+        writer.writerows(rows)
+    
+    d_cnn = [abs(r["DELTA_CNN_SCORE"]) for r in rows if r["DELTA_CNN_SCORE"] is not None]
+    d_aff = [abs(r["DELTA_AFFINITY"]) for r in rows if r["DELTA_AFFINITY"] is not None]
+    t_full = sum(float(r["FULL_SEC"]) for r in rows)
+    t_pocket = sum(float(r["POCKET_SEC"]) for r in rows)
+    print("\n" + "=" * 60)
+    print("📐 CROP VALIDATION")
+    print("=" * 60)
+    print(f"Ligands compared: {len(d_cnn)}/{len(rows)}")
+    if d_cnn:
+        print(f"max |ΔCNNscore|: {max(d_cnn):.4f} | max |Δaffinity|: {max(d_aff or [0.0]):.2f} kcal/mol")
+    if t_pocket > 0:
+        print(f"GNINA time: {t_full:.1f}s full → {t_pocket:.1f}s cropped ({t_full / t_pocket:.2f}x)")
+    print(f"📁 Report: {report}")
+    print("=" * 60)
+    
+    return rows
 
 
-def parse_best_score(sdf_path: str) -> float:
-    """Extract best minimizedAffinity (or CNN score from docked SDF"""
-    try:
-        suppl = Chem.SDMolSupplier(sdf_path, removeHs=False)
-        best_score = None
-        for mol in suppl:
-            if mol is None:
-                continue
-            if mol.HasProp("minimizedAffinity"):
-                score = float(mol.GetProp("minimizedAffinity"))
-                if best_score is None or score > best_score:
-                    best_score = score
-        return best_score if best_score else 0.0
-    except:
-        return 0.0
+# =========================
+# FUNNEL PROMOTION
+# =========================
+def promote_hits(ligands: list, rank_by: str, top_k: int | None, top_fraction: float | None,
+                 summary_dir: str) -> str | None:
+    """
+    Rank the screened ligands by `rank_by` and keep the best top_k (or
+    ceil(top_fraction * ranked)). Waits for the whole screen, i.e. for
+    every shard: promotion is a global ranking.
+    
+    Writes: summary/promotion.csv (every ranked ligand) and
+            summary/promoted.sdf (input structures of the promoted ones,
+            with their screen folder name as DIR_NAME_PROP)
+    Returns: path of promoted.sdf, or None while the screen is incomplete
+    """
+    all_details = _LEDGER.all_details()
+    open_jobs = [
+        lig for lig in ligands
+        if all_details.get(_job_id(lig["lig_root"]), {}).get("STATUS") not in (STATUS_DONE, STATUS_FAILED)
+    ]
+    if open_jobs:
+        print(f"⏳ Screen incomplete ({len(open_jobs)} ligands not finished, "
+              f"e.g. {open_jobs[0]['lig_id']}) — rerun to promote hits")
+        return None
+    
+    higher_is_better = RANK_KEYS[rank_by]
+    ranked = []
+    for lig in ligands:
+        if all_details[_job_id(lig["lig_root"])]["STATUS"] != STATUS_DONE:
+            continue
+        score = docked_pose_scores(lig)[rank_by]
+        if score is not None:
+            ranked.append((score, lig))
+    ranked.sort(key=lambda item: -item[0] if higher_is_better else item[0])
+    
+    n_promote = top_k if top_k else math.ceil((top_fraction or 0) * len(ranked))
+    n_promote = min(n_promote, len(ranked))
+    
+    promotion_file = os.path.join(summary_dir, "promotion.csv")
+    with open(_tmp_path(promotion_file), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["RANK", "ID", "DIR_NAME", "ORIGINAL_NAME", rank_by.upper(), "PROMOTED",
+                         "ALIASES"])
+        for rank, (score, lig) in enumerate(ranked, start=1):
+            writer.writerow([rank, lig["lig_id"], lig["lig_dirname"], lig["orig_name"],
+                             score, int(rank <= n_promote), ALIAS_SEP.join(lig["aliases"])])
+    os.replace(_tmp_path(promotion_file), promotion_file)
+    
+    promoted_sdf = os.path.join(summary_dir, "promoted.sdf")
+    with open(_tmp_path(promoted_sdf), "w") as out:
+        for _, lig in ranked[:n_promote]:
+            out.write(set_record_property(read_ligand_input(lig), DIR_NAME_PROP,
+                                          lig["lig_dirname"]))
+    os.replace(_tmp_path(promoted_sdf), promoted_sdf)
+    
+    print(f"🏆 Promoted {n_promote}/{len(ranked)} screened ligands by {rank_by} → {promoted_sdf}")
+    return promoted_sdf
 
 
 # =========================
 # PROGRESS TRACKING
 # =========================
 def update_progress_csv(ligands: list, summary_dir: str):
-    """Generate progress.csv with current status of all ligands"""
+    """Generate progress.csv with current status of all ligands (one ledger query)"""
+    logger.flush()
     progress_file = os.path.join(summary_dir, "progress.csv")
+    all_details = _LEDGER.all_details()
     
-    with open(progress_file, "w", newline="", encoding="utf-8") as f:
+    with open(_tmp_path(progress_file), "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow([
             "ID", "DIR_NAME", "STATUS", "ELAPSED_MIN", 
-            "BEST_CNN_SCORE", "START_TIME", "END_TIME"
+            "BEST_CNN_SCORE", "BEST_AFFINITY", "START_TIME", "END_TIME", "HOST",
+            "ALIASES", "PROGRESS", "RETRY", "ERROR"
         ])
         
         for lig in ligands:
-            details = get_status_details(lig["lig_root"])
+            details = all_details.get(_job_id(lig["lig_root"]), {})
             writer.writerow([
                 lig["lig_id"],
                 lig["lig_dirname"],
                 details.get("STATUS", STATUS_PENDING),
                 details.get("ELAPSED_MIN", ""),
                 details.get("BEST_CNN_SCORE", ""),
+                details.get("BEST_AFFINITY", ""),
                 details.get("START_TIME", ""),
-                details.get("END_TIME", "")
+                details.get("END_TIME", ""),
+                details.get("HOST", ""),
+                ALIAS_SEP.join(lig.get("aliases", [])),
+                details.get("PROGRESS", ""),
+                details.get("RETRY_ARGS", ""),
+                details.get("ERROR", "")
             ])
+    os.replace(_tmp_path(progress_file), progress_file)
+
+
+def write_status_lists(ligands: list, summary_dir: str):
+    """
+    finished_ligands.txt / failed_ligands.txt from the ledger's DONE / FAILED
+    rows (one query), so sessions sharing the tree never drop each other's.
+    """
+    all_details = _LEDGER.all_details()
+    for status, name in ((STATUS_DONE, "finished_ligands.txt"),
+                         (STATUS_FAILED, "failed_ligands.txt")):
+        path = os.path.join(summary_dir, name)
+        with open(_tmp_path(path), "w", encoding="utf-8") as f:
+            f.write("\n".join(
+                lig["lig_id"] for lig in ligands
+                if all_details.get(_job_id(lig["lig_root"]), {}).get("STATUS") == status
+            ))
+        os.replace(_tmp_path(path), path)
 
 
 def print_progress_summary(finished: list, failed: list, skipped: list, total: int):
     """Print current progress"""
     done = len(finished) + len(skipped)
+    if not isinstance(total, int):
+        # Streaming: the library size is not known yet
+        print(f"\n📊 Progress: {done} done | ✅ {len(finished)} new | ⏭️ {len(skipped)} skipped | ❌ {len(failed)} failed")
+        return
     pct = (done / total) * 100 if total > 0 else 0
     print(f"\n📊 Progress: {done}/{total} ({pct:.1f}%) | ✅ {len(finished)} new | ⏭️ {len(skipped)} skipped | ❌ {len(failed)} failed")
 
 
+# =========================
+# CONCURRENT SCHEDULER
+# =========================
+def build_slots(devices: str, slots_per_device: int, cpu_slots: int, cpu_threads: int) -> list:
+    """
+    Expand the CLI device options into scheduler slots.
+    
+    - GPU hosts: `slots_per_device` slots on each device in `devices`
+    - CPU-only hosts (cpu_slots > 0): `cpu_slots` slots of `cpu_threads` threads
+    """
+    if cpu_slots > 0:
+        return [{"name": f"cpu{i}", "cpu": cpu_threads} for i in range(cpu_slots)]
+    
+    slots = []
+    for dev in [d.strip() for d in devices.split(",") if d.strip()]:
+        for k in range(slots_per_device):
+            slots.append({"name": f"gpu{dev}.{k}", "device": dev})
+    return slots
+
+
+def _request_stop(signum, frame):
+    """Ctrl-C/SIGTERM: stop scheduling and terminate running GNINA jobs."""
+    if _STOP.is_set():
+        return
+    print(f"\n🛑 {signal.Signals(signum).name} received — stopping, running jobs will be marked {STATUS_INTERRUPTED}")
+    _STOP.set()
+    with _ACTIVE_LOCK:
+        for proc in _ACTIVE_PROCS.values():
+            proc.terminate()
+
+
+def run_scheduler(pending, slots: list, ligands: list, total: int,
+                  skipped: list, summary_dir: str, batch_size: int = 1) -> dict:
+    """
+    Dock `pending` [(idx, ligand_info), ...] with one worker thread per slot.
+    With batch_size > 1, each job is one multi-ligand GNINA invocation.
+    Each ligand is claimed in the ledger right before docking; ligands
+    leased by (or finished in) another session are left to it.
+    
+    `pending` may also be an iterator that yields ligands as they are
+    prepared (streaming pipeline). A feeder thread moves it into a work
+    queue of at most one job per slot, so the iterator is advanced only
+    as fast as the slots take work (backpressure on the producer).
+    
+    Returns: {lig_id: (idx, final_status or CLAIMED_ELSEWHERE)} for every
+    job that was taken from the queue
+    """
+    work = queue.Queue(maxsize=len(slots))
+    fed = threading.Event()
+    feed_error = []
+    
+    results = {}
+    lock = threading.Lock()
+    reported = [0]
+    
+    def put(batch):
+        while not _STOP.is_set():
+            try:
+                work.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def feeder():
+        try:
+            batch = []
+            for item in pending:
+                if _STOP.is_set():
+                    return
+                batch.append(item)
+                if len(batch) == batch_size:
+                    put(batch)
+                    batch = []
+            if batch:
+                put(batch)
+        except Exception as e:
+            feed_error.append(e)  # re-raised by the main thread
+        finally:
+            fed.set()
+    
+    def worker(slot):
+        while not _STOP.is_set():
+            try:
+                batch = work.get(timeout=0.5)
+            except queue.Empty:
+                if fed.is_set() and work.empty():
+                    return
+                continue
+            
+            claimed = []
+            for idx, lig in batch:
+                if claim_ligand(lig):
+                    claimed.append((idx, lig))
+                    continue
+                print(f"🔒 [{idx}/{total}] {lig['lig_id']} leased or finished by another session — skipping")
+                lig.pop("record", None)
+                with lock:
+                    results[lig["lig_id"]] = (idx, CLAIMED_ELSEWHERE)
+            if not claimed:
+                continue
+            
+            statuses = run_gnina_batch(claimed, total, slot)
+            # Streamed input text is not needed once a ligand is finished
+            for _, lig in claimed:
+                lig.pop("record", None)
+            
+            with lock:
+                for idx, lig in claimed:
+                    if lig["lig_id"] in statuses:
+                        results[lig["lig_id"]] = (idx, statuses[lig["lig_id"]])
+                # Update progress every 10 ligands
+                if len(results) // 10 > reported[0]:
+                    reported[0] = len(results) // 10
+                    update_progress_csv(ligands, summary_dir)
+                    finished = [k for k, (_, st) in results.items() if st == STATUS_DONE]
+                    failed = [k for k, (_, st) in results.items() if st == STATUS_FAILED]
+                    print_progress_summary(finished, failed, skipped, total)
+    
+    # Daemon: after a stop it may still be blocked on its producer
+    threading.Thread(target=feeder, name="feeder", daemon=True).start()
+    threads = [
+        threading.Thread(target=worker, args=(slot,), name=slot["name"])
+        for slot in slots
+    ]
+    for t in threads:
+        t.start()
+    
+    # Join with a timeout so the main thread keeps handling signals
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(timeout=0.5)
+    
+    if feed_error:
+        raise feed_error[0]
+    return results
+
+
 # =========================
 # MAIN PIPELINE
 # =========================
-def main():
+def load_config(path: str) -> dict:
+    """
+    `docking:` section of a config file, used as CLI defaults.
+    Relative paths resolve against the config file's folder; a bare
+    executable name (e.g. gnina) is left to the PATH lookup.
+    """
+    import yaml  # only needed when a config file is used
+    
+    with open(path, "r", encoding="utf-8") as f:
+        section = dict((yaml.safe_load(f) or {}).get("docking") or {})
+    
+    base = os.path.dirname(os.path.abspath(path))
+    for key in ("results_dir", "gnina", "receptor", "ref_ligand", "ligands"):
+        value = section.get(key)
+        if not value or os.path.isabs(value):
+            continue
+        if key == "gnina" and os.sep not in value:
+            continue
+        section[key] = os.path.join(base, value)
+    return section
+
+
+def parse_args(argv=None):
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument("--config", default=CONFIG_PATH,
+                     help="YAML file with a `docking:` section (default: %(default)s)")
+    known, _ = pre.parse_known_args(argv)
+    cfg = load_config(known.config) if known.config and os.path.exists(known.config) else {}
+    
+    parser = argparse.ArgumentParser(description="GNINA flexible docking pipeline",
+                                     parents=[pre])
+    parser.add_argument("--devices", default=GPU_DEVICE,
+                        help="Comma-separated GPU devices (default: %(default)s)")
+    parser.add_argument("--slots-per-device", type=int, default=1,
+                        help="Concurrent GNINA jobs per GPU device")
+    parser.add_argument("--cpu-slots", type=int, default=0,
+                        help="CPU-only mode: number of concurrent GNINA jobs")
+    parser.add_argument("--cpu-threads", type=int, default=None,
+                        help="--cpu threads per CPU slot (default: cores / cpu-slots)")
+    parser.add_argument("--gnina", default=cfg.get("gnina", GNINA_BIN), help="GNINA executable")
+    parser.add_argument("--results-dir", default=cfg.get("results_dir", RESULTS_DIR))
+    parser.add_argument("--receptor", default=cfg.get("receptor", PROTEIN_PATH))
+    parser.add_argument("--ref-ligand", default=cfg.get("ref_ligand", REF_LIGAND))
+    parser.add_argument("--ligands", default=cfg.get("ligands", LIGAND_SDF),
+                        help="Prepared multi-ligand SDF")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Ligands per GNINA invocation (receptor/CNN loaded once per batch)")
+    parser.add_argument("--import-status", action="store_true",
+                        help="Import legacy STATUS.txt files missing from the ledger")
+    parser.add_argument("--crop-margin", type=float, default=cfg.get("crop_margin", CROP_MARGIN),
+                        help="Dock against residues within this many Å of the autobox "
+                             f"(>= {DEFAULT_MARGIN:g} covers the CNN grid; check with "
+                             "--validate-crop first); default: full receptor")
+    parser.add_argument("--no-metrics", action="store_true",
+                        help="Disable summary/metrics.jsonl and summary/metrics.prom")
+    parser.add_argument("--validate-crop", type=int, default=0, metavar="N",
+                        help="Dock N sample ligands with full and cropped receptor, "
+                             "write summary/crop_validation.csv and exit")
+    parser.add_argument("--packed", action="store_true", default=cfg.get("packed", PACKED),
+                        help="Append outputs to shard files indexed in <results-dir>/packed "
+                             "instead of a folder per ligand (export: packed_store.py)")
+    parser.add_argument("--analyze-poses", action="store_true",
+                        default=cfg.get("analyze_poses", False),
+                        help="After docking, write per-pose receptor contacts, H-bonds and "
+                             "reference RMSD (summary/pose_contacts, summary/residue_contacts)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Dock duplicate structures separately instead of as aliases")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                        help="Only dock shard i (0-based) of N; each host/session takes one")
+    parser.add_argument("--lease-ttl", type=float, default=cfg.get("lease_ttl_s", LEASE_TTL),
+                        help="Seconds before an unrenewed job lease is taken over "
+                             "(default: %(default)s)")
+    parser.add_argument("--list-stale", action="store_true",
+                        help=f"List {STATUS_RUNNING} jobs whose session is gone, by host, and exit")
+    
+    timeouts = cfg.get("timeouts") or {}
+    parser.add_argument("--job-timeout", type=float, default=timeouts.get("job_s", JOB_TIMEOUT),
+                        metavar="SEC",
+                        help="Kill a GNINA job after this wall time (per ligand in a batch)")
+    parser.add_argument("--stall-timeout", type=float,
+                        default=timeouts.get("stall_s", STALL_TIMEOUT), metavar="SEC",
+                        help="Kill a GNINA job that writes no output for this long")
+    parser.add_argument("--no-retry", action="store_true",
+                        help="Fail timed-out or crashed jobs at once (ignore docking.retries)")
+    
+    funnel = cfg.get("funnel") or {}
+    parser.add_argument("--funnel", action="store_true", default=funnel.get("enabled", False),
+                        help="Two stages: rigid screen of all ligands (<results-dir>/screen), "
+                             "then flexible docking of the top hits only")
+    parser.add_argument("--rank-by", choices=sorted(RANK_KEYS),
+                        default=funnel.get("rank_by", "best_cnn_score"),
+                        help="Screen score used for promotion (default: %(default)s)")
+    parser.add_argument("--promote-top", type=int, default=funnel.get("top_k"), metavar="K",
+                        help="Promote the K best screened ligands")
+    parser.add_argument("--promote-fraction", type=float,
+                        default=funnel.get("top_fraction", 0.05), metavar="F",
+                        help="Promote this fraction of the screened ligands when "
+                             "--promote-top is not set (default: %(default)s)")
+    parser.add_argument("--screen-exhaustiveness", type=int,
+                        default=funnel.get("screen_exhaustiveness", SCREEN_EXHAUSTIVENESS))
+    parser.add_argument("--screen-num-modes", type=int,
+                        default=funnel.get("screen_num_modes", SCREEN_NUM_MODES))
+    args = parser.parse_args(argv)
+    args.retries = [] if args.no_retry else list(cfg.get("retries", RETRY_POLICY) or [])
+    
+    for name in ("results_dir", "receptor", "ref_ligand", "ligands"):
+        if not getattr(args, name):
+            parser.error(f"--{name.replace('_', '-')} is required "
+                         f"(or set docking.{name} in {known.config})")
+    return args
+
+
+def main(argv=None, records=None):
+    """
+    Docking CLI. `records` (run_pipeline.py): SDF record texts streamed
+    from ligand preparation, docked as they arrive; with --funnel they
+    feed the screen, and the flexible stage runs once it is complete.
+    """
+    global GNINA_BIN, RESULTS_DIR, PROTEIN_PATH, REF_LIGAND, LIGAND_SDF, CROP_MARGIN
+    global LEASE_TTL, PROFILE, SCREEN_EXHAUSTIVENESS, SCREEN_NUM_MODES
+    global JOB_TIMEOUT, STALL_TIMEOUT, RETRY_POLICY, PACKED
+    
+    args = parse_args(argv)
+    GNINA_BIN = args.gnina
+    RESULTS_DIR = args.results_dir
+    PROTEIN_PATH = args.receptor
+    REF_LIGAND = args.ref_ligand
+    LIGAND_SDF = args.ligands
+    CROP_MARGIN = args.crop_margin
+    LEASE_TTL = args.lease_ttl
+    JOB_TIMEOUT = args.job_timeout
+    STALL_TIMEOUT = args.stall_timeout
+    RETRY_POLICY = args.retries
+    PACKED = args.packed
+    SCREEN_EXHAUSTIVENESS = args.screen_exhaustiveness
+    SCREEN_NUM_MODES = args.screen_num_modes
+    if args.validate_crop and CROP_MARGIN is None:
+        CROP_MARGIN = DEFAULT_MARGIN
+    
+    cpu_threads = args.cpu_threads or max(1, (os.cpu_count() or 1) // max(1, args.cpu_slots))
+    slots = build_slots(args.devices, args.slots_per_device, args.cpu_slots, cpu_threads)
+    if not slots:
+        print("❌ No scheduler slots configured!")
+        return
+    
     print("=" * 60)
     print("🧬 GNINA Flexible Docking Pipeline")
     print("=" * 60)
     
+    if not args.funnel:
+        run_stage(args, slots, records)
+        return
+    
+    # Funnel: each stage is a complete results tree (ledger, cache,
+    # summaries), so both resume independently
+    flexible_dir = RESULTS_DIR
+    
+    print("\n🔻 STAGE 1/2: rigid screen")
+    PROFILE, RESULTS_DIR = PROFILE_RIGID, os.path.join(flexible_dir, "screen")
+    screened = run_stage(args, slots, records)
+    if screened is None or _STOP.is_set():
+        return
+    
+    promoted_sdf = promote_hits(
+        screened, args.rank_by, args.promote_top, args.promote_fraction,
+        f"{RESULTS_DIR}/summary"
+    )
+    if promoted_sdf is None:
+        return
+    
+    print("\n🔻 STAGE 2/2: flexible docking of promoted hits")
+    PROFILE, RESULTS_DIR, LIGAND_SDF = PROFILE_FLEXIBLE, flexible_dir, promoted_sdf
+    run_stage(args, slots)
+
+
+def triage_ligand(idx: int, lig: dict, total: int, all_details: dict, skipped: list) -> bool:
+    """
+    Resume check of one ligand against the ledger snapshot `all_details`.
+    
+    Returns: False when it is DONE with the same fingerprint or restored
+    from the result cache (appended to `skipped`), True when it has to be
+    docked
+    """
+    lig_id = lig["lig_id"]
+    lig_root = lig["lig_root"]
+    fp = lig["fingerprint"]
+    
+    # Check resume status: DONE only counts for the same fingerprint.
+    # Legacy (pre-fingerprint) DONE records are trusted as before.
+    details = all_details.get(_job_id(lig_root), {})
+    status = details.get("STATUS", STATUS_PENDING)
+    done_fp = details.get("FINGERPRINT")
+    
+    if status == STATUS_DONE and done_fp in (None, fp):
+        print(f"⏭️ [{idx}/{total}] {lig_id} already DONE — skipping")
+        skipped.append(lig_id)
+        return False
+    
+    # Same ligand + settings docked before (other position or run)
+    if PACKED and _STORE.find_result(fp) is not None and claim_ligand(lig):
+        with logger.stage("cache_restore", lig_id):
+            cached = restore_packed(lig)
+        if cached is not None:
+            logger.count("result_cache_hit")
+            write_status(lig_root, STATUS_RUNNING)
+            write_status(lig_root, STATUS_DONE, fingerprint=fp, cached="1", **cached)
+            print(f"⏭️ [{idx}/{total}] {lig_id} restored from packed store — skipping")
+            skipped.append(lig_id)
+            return False
+        _LEDGER.release(_job_id(lig_root), _LEASE_OWNER)
+    elif not PACKED and has_result(cache_root(), fp) and claim_ligand(lig):
+        with logger.stage("cache_restore", lig_id):
+            cached = restore_result(cache_root(), fp, lig_root)
+        if cached is not None:
+            logger.count("result_cache_hit")
+            write_status(lig_root, STATUS_RUNNING)
+            write_status(lig_root, STATUS_DONE, fingerprint=fp, cached="1", **cached)
+            print(f"⏭️ [{idx}/{total}] {lig_id} restored from result cache — skipping")
+            skipped.append(lig_id)
+            return False
+        _LEDGER.release(_job_id(lig_root), _LEASE_OWNER)
+    
+    if status == STATUS_DONE:
+        print(f"⚠️ [{idx}/{total}] {lig_id} ligand or settings changed — re-docking")
+    elif status == STATUS_RUNNING and lease_alive(details.get("LEASE_OWNER"),
+                                                  details.get("LEASE_EXPIRES")):
+        print(f"🔒 [{idx}/{total}] {lig_id} RUNNING on {details.get('HOST')} "
+              f"(lease held) — taken over only if that session dies")
+    elif status in (STATUS_RUNNING, STATUS_INTERRUPTED):
+        print(f"⚠️ [{idx}/{total}] {lig_id} was {status} on {details.get('HOST')} "
+              f"(incomplete) — retrying")
+    return True
+
+
+def run_stage(args, slots: list, records=None) -> list | None:
+    """
+    Dock LIGAND_SDF into RESULTS_DIR with the current PROFILE: load,
+    resume from the ledger, schedule, summarize.
+    
+    `records`: iterable of SDF record texts still being prepared
+    (run_pipeline.py). Ligands are then docked as they arrive, and
+    LIGAND_SDF, finished by the end of the stream, is only indexed for
+    the final mapping and summaries.
+    
+    Returns: the loaded ligands, or None when nothing was scheduled
+    (no ligands, --validate-crop, --list-stale)
+    """
+    global _LEASE_OWNER
+    
+    # Per-session summary files when the results tree is sharded
+    suffix = f".shard{args.shard[0]}of{args.shard[1]}" if args.shard else ""
+    
+    # Metrics: per-ligand JSON lines + Prometheus textfile snapshot
+    logger.configure(
+        enabled=not args.no_metrics,
+        jsonl_path=f"{RESULTS_DIR}/summary/metrics.jsonl",
+        prometheus_path=f"{RESULTS_DIR}/summary/metrics{suffix}.prom"
+    )
+    
     # Setup
     prepare_root_folders()
     
-    # Split ligands
-    ligands = split_ligands(
-        LIGAND_SDF,
-        ligands_root=f"{RESULTS_DIR}/ligands"
+    settings_fp = settings_fingerprint(
+        receptor_path(),
+        f"{RESULTS_DIR}/reference/ref_ligand.sdf",
+        gnina_docking_args()
     )
     
-    total = len(ligands)
-    if total == 0:
-        print("❌ No valid ligands found!")
+    # Ligands from the input SDF's offset index (or from the preparation stream)
+    if records is None:
+        with logger.stage("load_ligands"):
+            ligands = load_ligands(
+                LIGAND_SDF,
+                ligands_root=f"{RESULTS_DIR}/ligands",
+                settings_fp=settings_fp,
+                dedup=not args.no_dedup
+            )
+        total = len(ligands)
+        if total == 0:
+            print("❌ No valid ligands found!")
+            return
+    else:
+        ligands = []
+        total = "?"
+    
+    summary_dir = f"{RESULTS_DIR}/summary"
+    
+    if args.validate_crop and records is None:
+        validate_crop(ligands, args.validate_crop, slots[0], summary_dir)
+        logger.flush()
         return
     
-    finished = []
-    failed = []
-    skipped = []
+    open_ledger(summary_dir, ligands, import_legacy=args.import_status)
+    _LEASE_OWNER = new_lease_owner()
+    if PACKED:
+        open_store()
     
-    print(f"\n🚀 Starting batch docking: {total} ligands\n")
-    start_all = time.time()
+    if args.list_stale:
+        print_stale_jobs()
+        return
     
-    for idx, lig in enumerate(ligands, start=1):
-        lig_id = lig["lig_id"]
-        lig_root = lig["lig_root"]
-        
-        # Check resume status
-        status = read_status(lig_root)
-        
-        if status == STATUS_DONE:
-            print(f"⏭️ [{idx}/{total}] {lig_id} already DONE — skipping")
-            skipped.append(lig_id)
-            continue
-        
-        if status == STATUS_RUNNING:
-            print(f"⚠️ [{idx}/{total}] {lig_id} was RUNNING (incomplete) — retrying")
+    if args.shard and records is None:
+        n_shard = sum(in_shard(lig, args.shard) for lig in ligands)
+        print(f"🧩 Shard {args.shard[0]}/{args.shard[1]}: {n_shard} of {total} ligands")
+    
+    skipped = []
+    all_details = _LEDGER.all_details()
+    
+    if records is None:
+        pending = [
+            (idx, lig) for idx, lig in enumerate(ligands, start=1)
+            if in_shard(lig, args.shard) and triage_ligand(idx, lig, total, all_details, skipped)
+        ]
+        print(f"\n🚀 Starting batch docking: {len(pending)} ligands on {len(slots)} slot(s): "
+              f"{', '.join(s['name'] for s in slots)}\n")
+    else:
+        pending = []  # filled by the scheduler's feeder as ligands arrive
         
-        # Run docking
-        success = run_gnina(lig, idx, total)
+        def streamed():
+            for idx, lig in stream_ligands(records, f"{RESULTS_DIR}/ligands", ligands,
+                                           settings_fp, dedup=not args.no_dedup):
+                if in_shard(lig, args.shard) and triage_ligand(idx, lig, total,
+                                                               all_details, skipped):
+                    pending.append((idx, lig))
+                    yield idx, lig
+                else:
+                    lig.pop("record", None)
         
-        if success:
-            finished.append(lig_id)
+        print(f"\n🚀 Docking ligands as they are prepared, on {len(slots)} slot(s): "
+              f"{', '.join(s['name'] for s in slots)}\n")
+    start_all = time.time()
+    
+    previous_handlers = {
+        sig: signal.signal(sig, _request_stop)
+        for sig in (signal.SIGINT, signal.SIGTERM)
+    }
+    _HEARTBEAT_STOP.clear()
+    heartbeat = threading.Thread(target=_heartbeat, name="lease-heartbeat", daemon=True)
+    heartbeat.start()
+    try:
+        results = run_scheduler(
+            pending if records is None else streamed(), slots, ligands, total, skipped,
+            summary_dir, batch_size=max(1, args.batch_size)
+        )
+    finally:
+        _HEARTBEAT_STOP.set()
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+    
+    ordered = sorted(results.items(), key=lambda item: item[1][0])
+    finished = [lig_id for lig_id, (_, st) in ordered if st == STATUS_DONE]
+    failed = [lig_id for lig_id, (_, st) in ordered if st == STATUS_FAILED]
+    interrupted = [lig_id for lig_id, (_, st) in ordered if st == STATUS_INTERRUPTED]
+    elsewhere = [lig_id for lig_id, (_, st) in ordered if st == CLAIMED_ELSEWHERE]
+    not_started = len(pending) - len(results)
+    
+    if records is not None:
+        if _STOP.is_set():
+            write_mapping(ligands, f"{RESULTS_DIR}/ligands")
         else:
-            failed.append(lig_id)
-        
-        # Update progress every 10 ligands
-        if idx % 10 == 0:
-            update_progress_csv(ligands, f"{RESULTS_DIR}/summary")
-            print_progress_summary(finished, failed, skipped, total)
+            # The prepared SDF is complete (with its Alias_IDs): index it as a
+            # standalone run would, for the full mapping and later launches
+            with logger.stage("load_ligands"):
+                ligands = load_ligands(LIGAND_SDF, f"{RESULTS_DIR}/ligands", settings_fp,
+                                       dedup=not args.no_dedup)
     
     # Final summary
     elapsed_all = (time.time() - start_all) / 60
     
     # Write final files
-    summary_dir = f"{RESULTS_DIR}/summary"
-    
-    with open(f"{summary_dir}/finished_ligands.txt", "w") as f:
-        f.write("\n".join(finished + skipped))
-    
-    with open(f"{summary_dir}/failed_ligands.txt", "w") as f:
-        f.write("\n".join(failed))
-    
+    write_status_lists(ligands, summary_dir)
     update_progress_csv(ligands, summary_dir)
+    aggregate_results(RESULTS_DIR, summary_dir)
+    if args.analyze_poses:
+        analyze_poses(RESULTS_DIR, summary_dir)
     
     # Print summary
     print("\n" + "=" * 60)
@@ -458,12 +1793,24 @@ def main():
     print(f"✅ Completed (new): {len(finished)}")
     print(f"⏭️  Skipped (cached): {len(skipped)}")
     print(f"❌ Failed: {len(failed)}")
+    if elsewhere:
+        print(f"🔒 Left to other sessions: {len(elsewhere)}")
+    if _STOP.is_set():
+        print(f"🛑 Interrupted: {len(interrupted)} (+{not_started} not started) — rerun to resume")
     print(f"📁 Results: {RESULTS_DIR}")
+    if logger.is_enabled():
+        for stage, stats in sorted(logger.summary().items()):
+            print(f"⏱️  {stage:<14} n={stats['count']:<6} total={stats['total_s']:.1f}s "
+                  f"mean={stats['mean_s']:.3f}s")
     print("=" * 60)
     
     if failed:
         print(f"\n⚠️ Failed ligands: {', '.join(failed[:10])}" + 
               (f"... and {len(failed)-10} more" if len(failed) > 10 else ""))
+    
+    # The next funnel stage starts from empty metrics
+    logger.drain()
+    return ligands
 
 
 # =========================
@@ -0,0 +1,158 @@
+"""
+gnina_output.py
+Text-level readers/splitters for GNINA output files (no RDKit needed).
+
+Used to split the output of a multi-ligand GNINA invocation back into
+per-ligand docked.sdf / flex_residues.pdb / gnina.log files.
+"""
+
+
+def read_sdf_records(path: str) -> list:
+    """
+    Split an SDF file into raw records.
+
+    Returns: list of (title, record_text); record_text ends with '$$$$\\n'
+    """
+    records = []
+    lines = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.rstrip("\r\n") == "$$$$":
+                lines.append("$$$$\n")
+                records.append((lines[0].strip(), "".join(lines)))
+                lines = []
+            else:
+                lines.append(line)
+    if any(l.strip() for l in lines):
+        lines.append("$$$$\n")
+        records.append((lines[0].strip(), "".join(lines)))
+    return records
+
+
+def retitle_record(record: str, title: str) -> str:
+    """Replace the first (title) line of an SDF record."""
+    _, _, rest = record.partition("\n")
+    return f"{title}\n{rest}"
+
+
+def set_record_property(record: str, name: str, value: str) -> str:
+    """Set an SD data item of one record (replaced if present, else appended)."""
+    lines = record.splitlines(keepends=True)
+    end = next((i for i, l in enumerate(lines) if l.rstrip("\r\n") == "$$$$"), len(lines))
+    body, tail = lines[:end], lines[end:] or ["$$$$\n"]
+
+    out, skip, in_data = [], False, False
+    for line in body:
+        if line.startswith("M  END"):
+            in_data = True
+        elif in_data and line.startswith(">") and f"<{name}>" in line:
+            skip = True
+            continue
+        if skip:
+            if not line.strip():
+                skip = False
+            continue
+        out.append(line)
+    if out and not out[-1].endswith("\n"):
+        out[-1] += "\n"
+    return "".join(out) + f">  <{name}>\n{value}\n\n" + "".join(tail)
+
+
+def split_flex_models(path: str) -> list:
+    """Split a GNINA --out_flex PDB into MODEL ... ENDMDL blocks (one per pose)."""
+    with open(path, "r") as f:
+        return _split_models(f)
+
+
+def split_flex_text(text: str) -> list:
+    """split_flex_models() of PDB text (a packed flex_residues.pdb)."""
+    return _split_models(text.splitlines(keepends=True))
+
+
+def _split_models(lines) -> list:
+    models = []
+    current = None
+    for line in lines:
+        if line.startswith("MODEL"):
+            current = [line]
+        elif line.startswith("ENDMDL"):
+            if current is not None:
+                current.append(line)
+                models.append("".join(current))
+            current = None
+        elif current is not None:
+            current.append(line)
+    return models
+
+
+def split_log_tables(path: str) -> tuple:
+    """
+    Split a GNINA log into its preamble and one block per docked ligand.
+
+    Each block starts at a 'mode |  affinity ...' table header.
+
+    Returns: (preamble_text, [block_text, ...])
+    """
+    preamble = []
+    blocks = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("mode |"):
+                blocks.append([line])
+            elif blocks:
+                blocks[-1].append(line)
+            else:
+                preamble.append(line)
+    return "".join(preamble), ["".join(b) for b in blocks]
+
+
+def iter_sdf_properties(path: str, wanted: tuple = None):
+    """
+    Stream SD data items without building molecules.
+
+    Only the title line and the '>  <NAME>' data blocks are looked at;
+    atom/bond blocks are skipped line by line.
+
+    Yields: (title, {name: value}) per record; with `wanted`, only those names
+    """
+    with open(path, "r") as f:
+        yield from _iter_properties(f, wanted)
+
+
+def iter_sdf_text_properties(text: str, wanted: tuple = None):
+    """iter_sdf_properties() over SDF text already in memory (e.g. a packed record)."""
+    yield from _iter_properties(text.splitlines(), wanted)
+
+
+def _iter_properties(lines, wanted: tuple = None):
+    title = None
+    props = {}
+    key = None
+    in_data = False
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line == "$$$$":
+            yield title or "", props
+            title, props, key, in_data = None, {}, None, False
+            continue
+        if title is None:
+            title = line.strip()
+            continue
+        if not in_data:
+            if line.startswith("M  END"):
+                in_data = True
+            continue
+        if line.startswith(">"):
+            start = line.find("<")
+            end = line.find(">", start + 1)
+            name = line[start + 1:end] if start != -1 and end != -1 else None
+            key = name if wanted is None or name in wanted else None
+        elif key is not None:
+            if line.strip():
+                props[key] = props[key] + "\n" + line if key in props else line
+            else:
+                key = None
+
+    if title is not None and (props or in_data):
+        yield title, props
@@ -0,0 +1,152 @@
+"""
+gnina_runner.py
+asyncio runner for one GNINA process, watched while it runs.
+
+- stdout and the --log file are tailed as they are written; any new
+  output counts as progress, and the search progress bar (51 '*' from
+  0 to 100 %) gives a completion estimate
+- wall_timeout: limit on the whole run
+- stall_timeout: limit on the time without any new output (driver
+  stalls, pathological flexres searches)
+- on a timeout the process group gets SIGTERM, then SIGKILL after
+  KILL_GRACE seconds
+
+run() drives the coroutine in a private event loop, so each worker
+thread of the docking scheduler can call it for its own slot.
+"""
+
+import asyncio
+import os
+import signal
+import time
+
+PROGRESS_STARS = 51   # GNINA/Vina progress bar: 0 % ... 100 %
+POLL_INTERVAL = 1.0   # s between log polls / timeout checks
+KILL_GRACE = 10.0     # s between SIGTERM and SIGKILL
+
+TIMEOUT_WALL = "wall"
+TIMEOUT_STALL = "stall"
+
+
+class ProcessHandle:
+    """terminate() for the whole process group, safe to call from any thread."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass  # already gone
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+
+class _Watch:
+    """Output seen so far: time of the last new byte and progress-bar stars."""
+
+    def __init__(self):
+        self.last_output = time.monotonic()
+        self.stars = {"stdout": 0, "log": 0}
+        self.log_pos = 0
+
+    def feed(self, source: str, chunk: bytes):
+        if chunk:
+            self.last_output = time.monotonic()
+            self.stars[source] += chunk.count(b"*")
+
+    def progress(self) -> int:
+        # --log repeats stdout; take whichever source is further along
+        return min(100, round(100 * max(self.stars.values()) / PROGRESS_STARS))
+
+
+def _tail(path: str, watch: _Watch):
+    """Read whatever was appended to `path` since the last call."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(watch.log_pos)
+            chunk = f.read()
+    except OSError:
+        return  # not created yet
+    watch.log_pos += len(chunk)
+    watch.feed("log", chunk)
+
+
+async def _read_stdout(stream, watch: _Watch):
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            return
+        watch.feed("stdout", chunk)
+
+
+async def run_async(cmd: list, stderr_file: str, log_file: str | None = None,
+                    wall_timeout: float | None = None, stall_timeout: float | None = None,
+                    on_start=None, on_progress=None) -> dict:
+    """
+    Run `cmd` in its own session, stderr to file, until it exits or
+    times out.
+
+    on_start(handle): called once with the ProcessHandle (register it
+    for signal handling). on_progress(percent, elapsed_s): called after
+    every poll.
+
+    Returns: {"returncode", "timeout" (None, TIMEOUT_WALL or
+    TIMEOUT_STALL), "progress" (%), "elapsed_s"}
+    """
+    with open(stderr_file, "w") as stderr_f:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=stderr_f,
+            start_new_session=True
+        )
+    handle = ProcessHandle(proc.pid)
+    if on_start is not None:
+        on_start(handle)
+
+    start = time.monotonic()
+    watch = _Watch()
+    reader = asyncio.ensure_future(_read_stdout(proc.stdout, watch))
+    waiter = asyncio.ensure_future(proc.wait())
+    timeout = None
+
+    while True:
+        done, _ = await asyncio.wait({waiter}, timeout=POLL_INTERVAL)
+        if log_file:
+            _tail(log_file, watch)
+        if done:
+            break
+
+        now = time.monotonic()
+        if on_progress is not None:
+            on_progress(watch.progress(), now - start)
+        if wall_timeout and now - start > wall_timeout:
+            timeout = TIMEOUT_WALL
+        elif stall_timeout and now - watch.last_output > stall_timeout:
+            timeout = TIMEOUT_STALL
+        if timeout:
+            handle.terminate()
+            done, _ = await asyncio.wait({waiter}, timeout=KILL_GRACE)
+            if not done:
+                handle.kill()
+                await waiter
+            break
+
+    await reader
+    return {
+        "returncode": waiter.result(),
+        "timeout": timeout,
+        "progress": watch.progress(),
+        "elapsed_s": time.monotonic() - start,
+    }
+
+
+def run(cmd: list, stderr_file: str, log_file: str | None = None, **kwargs) -> dict:
+    """Blocking wrapper around run_async() for thread-based callers."""
+    return asyncio.run(run_async(cmd, stderr_file, log_file, **kwargs))
@@ -0,0 +1,426 @@
+"""
+job_ledger.py
+Single-file job ledger (SQLite, WAL mode) for the docking pipeline.
+
+Replaces the per-ligand STATUS.txt files: every status change is one
+indexed write, and progress reports are one query instead of one file
+open per ligand. Full history is kept in the `events` table, the same
+way STATUS.txt appended DONE/FAILED records after RUNNING.
+
+Several sessions (hosts, notebooks, processes) can share one ledger on a
+shared filesystem: a job is docked by whoever holds its lease. Leases
+are claimed atomically (BEGIN IMMEDIATE), renewed by heartbeats and
+expire, so jobs of a crashed session are picked up again. Expiry is
+wall-clock based: hosts need roughly synchronized clocks (NTP), far
+tighter than the lease TTL. SQLite needs working POSIX locks on the
+shared filesystem (local disks, NFSv4, Lustre; not most SMB mounts).
+Sessions can also split the jobs up front by job ID hash (shard_of).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# Columns with a dedicated field; any other keyword goes into EXTRA (JSON)
+_COLUMNS = ("status", "host", "start_time", "end_time", "elapsed_min",
+            "best_cnn_score", "error")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id          TEXT PRIMARY KEY,
+    status          TEXT NOT NULL,
+    host            TEXT,
+    start_time      TEXT,
+    end_time        TEXT,
+    elapsed_min     TEXT,
+    best_cnn_score  TEXT,
+    error           TEXT,
+    extra           TEXT NOT NULL DEFAULT '{}',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    updated         REAL NOT NULL,
+    lease_owner     TEXT,
+    lease_expires   REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE TABLE IF NOT EXISTS events (
+    job_id  TEXT NOT NULL,
+    status  TEXT NOT NULL,
+    time    TEXT NOT NULL,
+    fields  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_job ON events(job_id);
+"""
+
+
+# Columns added after the first schema: name -> type (see _migrate)
+_LATER_COLUMNS = {"lease_owner": "TEXT", "lease_expires": "REAL"}
+
+
+def _now() -> str:
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def new_lease_owner() -> str:
+    """Lease owner ID of this session: host:pid:token."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def parse_shard(value: str) -> tuple:
+    """'i/N' → (i, N), 0 <= i < N (argparse type of --shard)"""
+    try:
+        index, count = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..{count - 1}, got {index}")
+    return index, count
+
+
+def shard_of(job_id: str, count: int) -> int:
+    """
+    Deterministic partition by job ID hash: every host splitting the same
+    SDF assigns each ligand to the same shard, and shards stay balanced
+    even when the library is sorted by size or series.
+    """
+    digest = hashlib.sha256(job_id.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % count
+
+
+def lease_alive(owner: str | None, expires: float | None, now: float | None = None) -> bool:
+    """
+    Whether a lease still blocks other sessions.
+
+    Expired leases are dead. Leases of this host are also dead as soon
+    as the owning process is gone, so a crashed local run is resumed
+    without waiting for the TTL.
+    """
+    if not owner or expires is None or expires <= (now or time.time()):
+        return False
+    host, _, rest = owner.partition(":")
+    pid = rest.partition(":")[0]
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+    return True
+
+
+class JobLedger:
+    """
+    Transactional per-ligand status store.
+
+    Thread-safe (one connection guarded by a lock), so the scheduler's
+    worker threads can share a single instance.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Add columns missing from ledgers created by older versions."""
+        with self._lock:
+            have = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in _LATER_COLUMNS.items():
+                if name not in have:
+                    try:
+                        self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+                    except sqlite3.OperationalError:
+                        pass  # added concurrently by another session
+
+    # -------------------------
+    # Writes
+    # -------------------------
+    def write_status(self, job_id: str, status: str, running_status: str = "RUNNING",
+                     **kwargs):
+        """
+        Record a status change.
+
+        running_status starts a new attempt: host/start time are set,
+        previous results are cleared and EXTRA holds just the given fields
+        (e.g. retry, previous_error). Any other status completes the
+        attempt with END_TIME and the given fields, merged into EXTRA, and
+        releases its lease.
+        """
+        now = _now()
+        fields = {k.lower(): str(v) for k, v in kwargs.items()}
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if status == running_status:
+                    fields.setdefault("host", socket.gethostname())
+                    fields.setdefault("start_time", now)
+                    extra = {k: v for k, v in fields.items() if k not in _COLUMNS}
+                    self._conn.execute(
+                        "INSERT INTO jobs (job_id, status, host, start_time, extra, attempts,"
+                        " updated) VALUES (?, ?, ?, ?, ?, 1, ?)"
+                        " ON CONFLICT(job_id) DO UPDATE SET"
+                        "  status = excluded.status, host = excluded.host,"
+                        "  start_time = excluded.start_time, end_time = NULL,"
+                        "  elapsed_min = NULL, best_cnn_score = NULL, error = NULL,"
+                        "  extra = excluded.extra, attempts = attempts + 1,"
+                        "  updated = excluded.updated",
+                        (job_id, status, fields["host"], fields["start_time"],
+                         json.dumps(extra), time.time())
+                    )
+                else:
+                    fields.setdefault("end_time", now)
+                    self._upsert(job_id, status, fields)
+                    self._conn.execute(
+                        "UPDATE jobs SET lease_owner = NULL, lease_expires = NULL"
+                        " WHERE job_id = ?", (job_id,)
+                    )
+
+                self._conn.execute(
+                    "INSERT INTO events (job_id, status, time, fields) VALUES (?, ?, ?, ?)",
+                    (job_id, status, now, json.dumps(fields))
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _upsert(self, job_id: str, status: str, fields: dict):
+        row = self._conn.execute(
+            "SELECT extra FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        extra = json.loads(row[0]) if row else {}
+        columns = {}
+        for key, value in fields.items():
+            if key in _COLUMNS:
+                columns[key] = value
+            else:
+                extra[key] = value
+
+        columns["status"] = status
+        names = list(columns)
+        self._conn.execute(
+            f"INSERT INTO jobs (job_id, {', '.join(names)}, extra, updated)"
+            f" VALUES (?, {', '.join('?' for _ in names)}, ?, ?)"
+            " ON CONFLICT(job_id) DO UPDATE SET "
+            + ", ".join(f"{n} = excluded.{n}" for n in names)
+            + ", extra = excluded.extra, updated = excluded.updated",
+            (job_id, *columns.values(), json.dumps(extra), time.time())
+        )
+
+    def note(self, job_id: str, **kwargs):
+        """
+        Update EXTRA fields of the current attempt without a status
+        change or event (live progress of a running job).
+        """
+        fields = {k.lower(): str(v) for k, v in kwargs.items()}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT extra FROM jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()
+                if row is not None:
+                    extra = json.loads(row[0])
+                    extra.update(fields)
+                    self._conn.execute(
+                        "UPDATE jobs SET extra = ?, updated = ? WHERE job_id = ?",
+                        (json.dumps(extra), time.time(), job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # -------------------------
+    # Leases
+    # -------------------------
+    def claim(self, job_id: str, owner: str, ttl: float, fingerprint: str | None = None,
+              done_status: str = "DONE", pending_status: str = "PENDING") -> bool:
+        """
+        Atomically take the lease of a job for `ttl` seconds.
+
+        Refused while another session holds a live lease (lease_alive),
+        or when the job is already done_status for `fingerprint` (a
+        legacy DONE without fingerprint counts as done). New jobs are
+        inserted as pending_status; the status itself is left to the
+        caller's next write_status().
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT status, extra, lease_owner, lease_expires FROM jobs WHERE job_id = ?",
+                    (job_id,)
+                ).fetchone()
+                if row is not None:
+                    status, extra, holder, expires = row
+                    done_fp = json.loads(extra).get("fingerprint")
+                    if status == done_status and done_fp in (None, fingerprint):
+                        self._conn.execute("ROLLBACK")
+                        return False
+                    if holder != owner and lease_alive(holder, expires, now):
+                        self._conn.execute("ROLLBACK")
+                        return False
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, status, updated, lease_owner, lease_expires)"
+                    " VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT(job_id) DO UPDATE SET"
+                    "  lease_owner = excluded.lease_owner,"
+                    "  lease_expires = excluded.lease_expires",
+                    (job_id, pending_status, now, owner, now + ttl)
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def renew_leases(self, owner: str, ttl: float) -> int:
+        """Heartbeat: extend every lease held by `owner`. Returns the number renewed."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE lease_owner = ?",
+                (time.time() + ttl, owner)
+            )
+            return cur.rowcount
+
+    def release(self, job_id: str, owner: str):
+        """Give a lease back without a status change (job not started)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_owner = NULL, lease_expires = NULL"
+                " WHERE job_id = ? AND lease_owner = ?", (job_id, owner)
+            )
+
+    def stale_jobs(self, running_status: str = "RUNNING") -> list:
+        """
+        running_status jobs nobody is working on any more: their lease
+        expired, their owner process on this host is gone, or they
+        predate leases. Rows: {"job_id", "host", "start_time", "lease_owner"}.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, host, start_time, lease_owner, lease_expires"
+                " FROM jobs WHERE status = ?", (running_status,)
+            ).fetchall()
+        now = time.time()
+        return [
+            {"job_id": job_id, "host": host, "start_time": start, "lease_owner": owner}
+            for job_id, host, start, owner, expires in rows
+            if not lease_alive(owner, expires, now)
+        ]
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def read_status(self, job_id: str, default: str = "PENDING") -> str:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return row[0] if row else default
+
+    def get_status_details(self, job_id: str) -> dict:
+        """Same shape as the old parsed STATUS.txt: upper-case keys."""
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            row = cur.fetchone()
+            names = [d[0] for d in cur.description]
+        return self._row_to_details(names, row) if row else {}
+
+    def all_details(self) -> dict:
+        """{job_id: details} for every job, in one query."""
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM jobs")
+            names = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+        return {row[0]: self._row_to_details(names, row) for row in rows}
+
+    def count_by_status(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    @staticmethod
+    def _row_to_details(names: list, row) -> dict:
+        data = dict(zip(names, row))
+        details = {
+            key.upper(): data[key]
+            for key in _COLUMNS
+            if data.get(key) is not None
+        }
+        details.update({k.upper(): v for k, v in json.loads(data["extra"]).items()})
+        details["ATTEMPTS"] = data["attempts"]
+        if data.get("lease_owner"):
+            details["LEASE_OWNER"] = data["lease_owner"]
+            details["LEASE_EXPIRES"] = data["lease_expires"]
+        return details
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    # -------------------------
+    # Migration
+    # -------------------------
+    def import_status_files(self, status_files: dict) -> int:
+        """
+        Import legacy STATUS.txt files: {job_id: path}.
+
+        The last value of every key wins, which is exactly how the old
+        get_status_details() parsed them. Jobs already in the ledger are
+        left untouched.
+        """
+        imported = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for job_id, path in status_files.items():
+                    if not os.path.exists(path):
+                        continue
+                    exists = self._conn.execute(
+                        "SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)
+                    ).fetchone()
+                    if exists:
+                        continue
+
+                    fields = {}
+                    with open(path, "r") as f:
+                        for line in f:
+                            if "=" in line:
+                                key, value = line.strip().split("=", 1)
+                                fields[key.lower()] = value
+                    status = fields.pop("status", None)
+                    if status is None:
+                        continue
+
+                    self._upsert(job_id, status, fields)
+                    self._conn.execute(
+                        "UPDATE jobs SET attempts = 1 WHERE job_id = ?", (job_id,)
+                    )
+                    imported += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return imported
+
+    def close(self):
+        self._conn.close()
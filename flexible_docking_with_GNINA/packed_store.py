@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+packed_store.py
+Append-only packed store of per-ligand docking files (--packed).
+
+Instead of a folder of small files per ligand, each writer session
+appends to a few shard files, and an offset index gives the byte range
+of any ligand's file:
+- <root>/<writer>.poses.sdf   docked poses (plain SDF, readable as-is)
+- <root>/<writer>.flex.pdb    flexible residue models
+- <root>/<writer>.inputs.sdf  input structures
+- <root>/<writer>.logs.z      gnina.log, stderr, command, META.txt
+                              (zlib per record)
+- <root>/index.sqlite         (job_id, file) -> shard, offset, length, codec;
+                              per job: ligand ID, fingerprint, result info
+
+Writers are named host.pid, so sessions sharing a results tree never
+append to the same shard; the index is SQLite (WAL) like the job ledger.
+Re-docking a ligand appends new records and repoints the index; the old
+bytes stay in their shard.
+
+Files are addressed by their path in the per-ligand layout
+(output/docked.sdf, logs/gnina.log, ...), and export() rebuilds that
+layout for selected ligands.
+
+Usage (exporter):
+    python packed_store.py /kaggle/working/docking_results/8skl LIG_0001 LIG_0042 --out export/
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+
+# Layout path -> (shard suffix, codec)
+FILES = {
+    "input/ligand.sdf": ("inputs.sdf", None),
+    "META.txt": ("logs.z", "zlib"),
+    "output/docked.sdf": ("poses.sdf", None),
+    "output/flex_residues.pdb": ("flex.pdb", None),
+    "logs/gnina.log": ("logs.z", "zlib"),
+    "logs/gnina_stderr.log": ("logs.z", "zlib"),
+    "logs/command.txt": ("logs.z", "zlib"),
+}
+
+# Files that make up a docking result (shared by jobs with one fingerprint)
+RESULT_FILES = ("output/docked.sdf", "output/flex_residues.pdb", "logs/gnina.log")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id       TEXT PRIMARY KEY,
+    lig_id       TEXT,
+    fingerprint  TEXT,
+    info         TEXT NOT NULL DEFAULT '{}',
+    updated      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_lig ON jobs(lig_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_fp ON jobs(fingerprint);
+CREATE TABLE IF NOT EXISTS files (
+    job_id  TEXT NOT NULL,
+    path    TEXT NOT NULL,
+    shard   TEXT NOT NULL,
+    offset  INTEGER NOT NULL,
+    length  INTEGER NOT NULL,
+    codec   TEXT,
+    PRIMARY KEY (job_id, path)
+);
+"""
+
+
+class PackedStore:
+    """
+    Shard writer + index for one results tree.
+
+    Thread-safe (one lock around appends and the index connection), so
+    the scheduler's worker threads can share a single instance.
+    """
+
+    def __init__(self, root: str, writer: str | None = None):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.writer = writer or f"{socket.gethostname()}.{os.getpid()}"
+        self._lock = threading.Lock()
+        self._appenders = {}
+        self._conn = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), timeout=30,
+            isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # -------------------------
+    # Writes
+    # -------------------------
+    def _append(self, suffix: str, data: bytes) -> tuple:
+        """Append to this writer's shard; returns (shard name, offset)."""
+        shard = f"{self.writer}.{suffix}"
+        f = self._appenders.get(shard)
+        if f is None:
+            f = self._appenders[shard] = open(os.path.join(self.root, shard), "ab")
+        offset = f.tell()
+        f.write(data)
+        return shard, offset
+
+    def put(self, job_id: str, files: dict, lig_id: str | None = None,
+            fingerprint: str | None = None, info: dict | None = None):
+        """
+        Store a job's files ({layout path: str or bytes}); replaces any
+        earlier version of those files in the index.
+        """
+        with self._lock:
+            rows = []
+            for path, content in files.items():
+                suffix, codec = FILES[path]
+                data = content.encode("utf-8") if isinstance(content, str) else content
+                if codec == "zlib":
+                    data = zlib.compress(data)
+                shard, offset = self._append(suffix, data)
+                rows.append((job_id, path, shard, offset, len(data), codec))
+            # Bytes must be visible to other sessions before the index points at them
+            for f in self._appenders.values():
+                f.flush()
+
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, lig_id, fingerprint, info, updated)"
+                    " VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT(job_id) DO UPDATE SET"
+                    "  lig_id = COALESCE(excluded.lig_id, lig_id),"
+                    "  fingerprint = COALESCE(excluded.fingerprint, fingerprint),"
+                    "  info = CASE WHEN excluded.info = '{}' THEN info ELSE excluded.info END,"
+                    "  updated = excluded.updated",
+                    (job_id, lig_id, fingerprint, json.dumps(info or {}), time.time())
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files (job_id, path, shard, offset, length, codec)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def put_folder(self, job_id: str, lig_root: str, files: dict | None = None, **kwargs):
+        """Store every layout file present under a ligand folder (plus `files`)."""
+        files = dict(files or {})
+        for path in FILES:
+            src = os.path.join(lig_root, path)
+            if os.path.exists(src):
+                with open(src, "rb") as f:
+                    files[path] = f.read()
+        self.put(job_id, files, **kwargs)
+
+    def link_result(self, job_id: str, source_job_id: str, lig_id: str | None = None):
+        """
+        Point a job at another job's result files (same fingerprint):
+        a result cache hit costs index rows, not bytes.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (job_id, lig_id, fingerprint, info, updated)"
+                    " SELECT ?, ?, fingerprint, info, ? FROM jobs WHERE job_id = ?",
+                    (job_id, lig_id, time.time(), source_job_id)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (job_id, path, shard, offset, length, codec)"
+                    " SELECT ?, path, shard, offset, length, codec FROM files"
+                    f" WHERE job_id = ? AND path IN ({', '.join('?' for _ in RESULT_FILES)})",
+                    (job_id, source_job_id, *RESULT_FILES)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def _read(self, shard: str, offset: int, length: int, codec: str | None) -> bytes:
+        with open(os.path.join(self.root, shard), "rb") as f:
+            data = os.pread(f.fileno(), length, offset)
+        return zlib.decompress(data) if codec == "zlib" else data
+
+    def get(self, job_id: str, path: str) -> bytes | None:
+        """One file of one job (primary-key lookup + one read), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT shard, offset, length, codec FROM files WHERE job_id = ? AND path = ?",
+                (job_id, path)
+            ).fetchone()
+        return self._read(*row) if row else None
+
+    def get_text(self, job_id: str, path: str) -> str | None:
+        data = self.get(job_id, path)
+        return data.decode("utf-8") if data is not None else None
+
+    def find_result(self, fingerprint: str) -> tuple | None:
+        """(job_id, info) of a stored result with this fingerprint, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT j.job_id, j.info FROM jobs j JOIN files f"
+                " ON f.job_id = j.job_id AND f.path = 'output/docked.sdf'"
+                " WHERE j.fingerprint = ? LIMIT 1", (fingerprint,)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def job_ids(self, lig_ids: list | None = None) -> list:
+        """Stored job IDs (folder names), optionally only for these ligand IDs or job IDs."""
+        with self._lock:
+            rows = self._conn.execute("SELECT job_id, lig_id FROM jobs ORDER BY job_id").fetchall()
+        if lig_ids is None:
+            return [job_id for job_id, _ in rows]
+        wanted = set(lig_ids)
+        return [job_id for job_id, lig_id in rows if job_id in wanted or lig_id in wanted]
+
+    def iter_files(self, path: str):
+        """
+        (job_id, bytes) of one layout file for every job, read shard by
+        shard in offset order (sequential I/O for bulk scans).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, shard, offset, length, codec FROM files WHERE path = ?"
+                " ORDER BY shard, offset", (path,)
+            ).fetchall()
+        current, f = None, None
+        try:
+            for job_id, shard, offset, length, codec in rows:
+                if shard != current:
+                    if f is not None:
+                        f.close()
+                    current, f = shard, open(os.path.join(self.root, shard), "rb")
+                data = os.pread(f.fileno(), length, offset)
+                yield job_id, zlib.decompress(data) if codec == "zlib" else data
+        finally:
+            if f is not None:
+                f.close()
+
+    # -------------------------
+    # Export
+    # -------------------------
+    def export(self, job_id: str, lig_root: str) -> int:
+        """Rebuild the per-ligand folder layout of one job. Returns the number of files."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, shard, offset, length, codec FROM files WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        for path, *location in rows:
+            dst = os.path.join(lig_root, path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with open(dst, "wb") as f:
+                f.write(self._read(*location))
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            for f in self._appenders.values():
+                f.close()
+            self._appenders = {}
+            self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Rebuild per-ligand folders from a packed results tree"
+    )
+    parser.add_argument("results_dir", help="Docking results directory (contains packed/)")
+    parser.add_argument("ids", nargs="*",
+                        help="Ligand IDs (LIG_0001) or folder names; none = every ligand")
+    parser.add_argument("--ids-file", default=None, help="File with one ID per line")
+    parser.add_argument("--out", default=None,
+                        help="Output directory (default: <results_dir>/ligands)")
+    args = parser.parse_args(argv)
+
+    ids = list(args.ids)
+    if args.ids_file:
+        with open(args.ids_file) as f:
+            ids += [line.strip() for line in f if line.strip()]
+
+    store = PackedStore(os.path.join(args.results_dir, "packed"))
+    out = args.out or os.path.join(args.results_dir, "ligands")
+    job_ids = store.job_ids(ids or None)
+    n_files = sum(store.export(job_id, os.path.join(out, job_id)) for job_id in job_ids)
+    store.close()
+
+    missing = set(ids) - set(job_ids) - {j.split("__", 1)[0] for j in job_ids}
+    print(f"✔ Exported {len(job_ids)} ligands ({n_files} files) → {out}")
+    if missing:
+        print(f"⚠️ Not in the packed store: {', '.join(sorted(missing)[:10])}"
+              + (f"... and {len(missing) - 10} more" if len(missing) > 10 else ""))
+
+
+if __name__ == "__main__":
+    main()
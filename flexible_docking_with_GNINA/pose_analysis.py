@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+pose_analysis.py
+Pose-vs-receptor analysis of every docked pose in a results tree.
+
+The receptor (protein/receptor.pdb) is parsed once into NumPy arrays
+(heavy-atom coordinates, residue and polar-atom codes) behind a spatial
+index: SciPy's cKDTree when SciPy is installed, else a NumPy cell grid.
+Poses (ligands/*/output/docked.sdf, or the packed store of a --packed
+run) and the flexible residues of each pose (flex_residues.pdb, one
+MODEL per pose) are read a batch of ligands at a time, and every
+neighbour search, count and RMSD is an array operation over all poses
+of the batch:
+- contacts: ligand/receptor heavy-atom pairs within --contact-cutoff
+- H-bonds: N/O pairs within --hbond-cutoff (heavy-atom criterion)
+- flexible residues are taken from each pose's own flex model, not from
+  their position in the input receptor
+- ref_rmsd: in-place heavy-atom RMSD to reference/ref_ligand.sdf
+  (symmetry-corrected) when the pose is the same molecule; the centroid
+  distance to the reference is reported for every pose
+
+Writes (CSV when pyarrow is not installed, as results_aggregation.py):
+- summary/pose_contacts.parquet     one row per pose: contact / H-bond
+                                    counts (all and flexible residues),
+                                    contact fingerprint (residues in
+                                    contact), ref_rmsd, ref_centroid_dist
+- summary/residue_contacts.parquet  one row per pose and contacted
+                                    residue: n_contacts, n_hbonds, flex
+
+Usage:
+    python pose_analysis.py /kaggle/working/docking_results/8skl
+"""
+
+import argparse
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from rdkit import Chem
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # NumPy cell grid fallback
+    cKDTree = None
+
+from gnina_output import split_flex_text
+from packed_store import PackedStore
+from results_aggregation import write_table
+
+CONTACT_CUTOFF = 4.0  # Å, heavy atom to heavy atom
+HBOND_CUTOFF = 3.5    # Å, N/O donor to N/O acceptor
+BATCH_LIGANDS = 64    # ligands whose poses are analysed together
+POLAR_ELEMENTS = ("N", "O")
+WATERS = ("HOH", "WAT", "DOD")
+
+POSE_COLUMNS = ("lig_id", "dir_name", "name", "rank",
+                "n_contacts", "n_hbonds", "n_residues",
+                "contact_residues", "hbond_residues",
+                "flex_contacts", "flex_hbonds",
+                "ref_rmsd", "ref_centroid_dist")
+
+RESIDUE_COLUMNS = ("lig_id", "dir_name", "rank", "residue", "resname", "flex",
+                   "n_contacts", "n_hbonds")
+
+
+# -------------------------
+# Text-level parsing
+# -------------------------
+def _pdb_element(line: str) -> str:
+    element = line[76:78].strip()
+    if not element:
+        element = "".join(c for c in line[12:16] if c.isalpha())[:1]
+    return element.upper()
+
+
+def parse_pdb_atoms(lines) -> dict:
+    """
+    Heavy atoms of the ATOM/HETATM records (waters skipped).
+
+    Returns: {"coords": (N, 3) array, "polar": (N,) bool array,
+              "residues": [(chain, resSeq, iCode)], "resnames": [...],
+              "names": [atom names]}
+    """
+    coords, polar, residues, resnames, names = [], [], [], [], []
+    for line in lines:
+        if not line.startswith(("ATOM", "HETATM")):
+            continue
+        resname = line[17:20].strip()
+        element = _pdb_element(line)
+        if resname in WATERS or element in ("H", "D"):
+            continue
+        coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+        polar.append(element in POLAR_ELEMENTS)
+        residues.append((line[21], line[22:26].strip(), line[26].strip()))
+        resnames.append(resname)
+        names.append(line[12:16].strip())
+    return {
+        "coords": np.array(coords, dtype=float).reshape(-1, 3),
+        "polar": np.array(polar, dtype=bool),
+        "residues": residues,
+        "resnames": resnames,
+        "names": names,
+    }
+
+
+def parse_sdf_poses(text: str) -> list:
+    """
+    Records of an SDF text (V2000 or V3000 atom blocks), in file order.
+
+    Returns: list of (name, molblock, coords (N, 3) array, elements);
+    all atoms, in molblock order.
+    """
+    poses = []
+    for i, record in enumerate(text.split("$$$$")):
+        # Only the newline after '$$$$': an empty title line belongs to the record
+        if i and record.startswith("\r\n"):
+            record = record[2:]
+        elif i and record.startswith("\n"):
+            record = record[1:]
+        lines = record.splitlines()
+        if len(lines) < 4:
+            continue
+        coords, elements = [], []
+        if "V3000" in lines[3]:
+            in_atoms = False
+            for line in lines[4:]:
+                if "BEGIN ATOM" in line:
+                    in_atoms = True
+                elif "END ATOM" in line:
+                    break
+                elif in_atoms:
+                    parts = line.split()
+                    elements.append(parts[3].upper())
+                    coords.append((float(parts[4]), float(parts[5]), float(parts[6])))
+        else:
+            n_atoms = int(lines[3][:3])
+            for line in lines[4:4 + n_atoms]:
+                coords.append((float(line[0:10]), float(line[10:20]), float(line[20:30])))
+                elements.append(line[31:34].strip().upper())
+        block = "\n".join(itertools.takewhile(lambda l: l.strip() != "M  END", lines))
+        poses.append((lines[0].strip(), block + "\nM  END\n",
+                      np.array(coords, dtype=float).reshape(-1, 3), elements))
+    return poses
+
+
+# -------------------------
+# Spatial index
+# -------------------------
+class SpatialIndex:
+    """
+    Fixed-radius neighbour search over a fixed point set: SciPy's
+    cKDTree when available, else a uniform grid of radius-sized cells
+    (a point's neighbours are in its own and the 26 adjacent cells).
+    """
+
+    def __init__(self, coords: np.ndarray, radius: float):
+        self.coords = coords
+        self.radius = radius
+        if cKDTree is not None:
+            self._tree = cKDTree(coords)
+            return
+
+        self._origin = coords.min(axis=0) if len(coords) else np.zeros(3)
+        cells = self._cells(coords)
+        self._dims = cells.max(axis=0) + 1 if len(coords) else np.ones(3, dtype=np.int64)
+        keys = self._keys(cells)
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+
+    def _cells(self, xyz: np.ndarray) -> np.ndarray:
+        return np.floor((xyz - self._origin) / self.radius).astype(np.int64)
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[:, 0] * self._dims[1] + cells[:, 1]) * self._dims[2] + cells[:, 2]
+
+    def pairs(self, points: np.ndarray) -> tuple:
+        """
+        Every (point, indexed atom) pair closer than the radius.
+
+        Returns: (i, j, d) arrays: index into `points`, index into the
+        indexed coords, distance.
+        """
+        if not len(points) or not len(self.coords):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+        if cKDTree is not None:
+            found = cKDTree(points).sparse_distance_matrix(
+                self._tree, self.radius, output_type="ndarray"
+            )
+            return found["i"].astype(np.int64), found["j"].astype(np.int64), found["v"]
+
+        cells = self._cells(points)
+        found_i, found_j = [], []
+        for offset in itertools.product((-1, 0, 1), repeat=3):
+            neighbour = cells + offset
+            rows = np.nonzero(np.all((neighbour >= 0) & (neighbour < self._dims), axis=1))[0]
+            keys = self._keys(neighbour[rows])
+            lo = np.searchsorted(self._sorted_keys, keys, side="left")
+            counts = np.searchsorted(self._sorted_keys, keys, side="right") - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            # Expand each cell's [lo, lo + count) slice of the sorted atoms
+            starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+            found_i.append(np.repeat(rows, counts))
+            found_j.append(self._order[starts + np.arange(total)])
+        if not found_i:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+
+        i, j = np.concatenate(found_i), np.concatenate(found_j)
+        d = np.linalg.norm(points[i] - self.coords[j], axis=1)
+        keep = d <= self.radius
+        return i[keep], j[keep], d[keep]
+
+
+# -------------------------
+# Receptor and reference
+# -------------------------
+class Receptor:
+    """
+    Heavy atoms of the receptor as arrays plus their spatial index,
+    parsed once. Residues get integer IDs in file order; residues only
+    seen in flex models are appended.
+    """
+
+    def __init__(self, pdb_path: str, radius: float = CONTACT_CUTOFF):
+        with open(pdb_path, "r") as f:
+            atoms = parse_pdb_atoms(f)
+        self.residue_keys = []
+        self.resnames = []
+        self._residue_ids = {}
+        self.coords = atoms["coords"]
+        self.polar = atoms["polar"]
+        self.residue = np.array(
+            [self.residue_id(key, name) for key, name in zip(atoms["residues"], atoms["resnames"])],
+            dtype=np.int64
+        )
+        self.atom_ids = {
+            (res, name): i for i, (res, name) in enumerate(zip(self.residue, atoms["names"]))
+        }
+        self.index = SpatialIndex(self.coords, radius)
+
+    def residue_id(self, key: tuple, resname: str) -> int:
+        res = self._residue_ids.get(key)
+        if res is None:
+            res = self._residue_ids[key] = len(self.residue_keys)
+            self.residue_keys.append(key)
+            self.resnames.append(resname)
+        return res
+
+    def label(self, res: int) -> str:
+        """Residue as in --flexres: chain:resSeq[iCode]."""
+        chain, seq, icode = self.residue_keys[res]
+        return f"{chain}:{seq}{icode}"
+
+
+class Reference:
+    """Reference ligand: heavy-atom coordinates, centroid and a matching query."""
+
+    def __init__(self, sdf_path: str):
+        with open(sdf_path, "r") as f:
+            _, block, coords, elements = parse_sdf_poses(f.read())[0]
+        heavy = [i for i, element in enumerate(elements) if element != "H"]
+        self.coords = coords[heavy]
+        self.centroid = self.coords.mean(axis=0)
+        self.query = _heavy_query(block)
+
+    def matches(self, molblock: str) -> np.ndarray | None:
+        """
+        Every mapping of the reference heavy atoms onto a pose's atoms,
+        as a (K, n) array of pose atom indices; None when the pose is a
+        different molecule.
+        """
+        if self.query is None:
+            return None
+        mol = Chem.MolFromMolBlock(molblock, sanitize=False, removeHs=False)
+        if mol is None:
+            return None
+        mol.UpdatePropertyCache(strict=False)
+        if sum(1 for a in mol.GetAtoms() if a.GetAtomicNum() > 1) != len(self.coords):
+            return None
+        found = mol.GetSubstructMatches(self.query, uniquify=False, useChirality=False,
+                                        maxMatches=1000)
+        return np.array(found, dtype=np.int64) if found else None
+
+
+def _heavy_query(molblock: str):
+    """Heavy-atom graph with generic bonds and no charges (protonation-independent)."""
+    mol = Chem.MolFromMolBlock(molblock, sanitize=False, removeHs=False)
+    if mol is None:
+        return None
+    mol.UpdatePropertyCache(strict=False)
+    mol = Chem.RWMol(Chem.RemoveHs(mol, sanitize=False))
+    for atom in mol.GetAtoms():
+        atom.SetFormalCharge(0)
+    params = Chem.AdjustQueryParameters.NoAdjustments()
+    params.makeBondsGeneric = True
+    return Chem.AdjustQueryProperties(mol, params)
+
+
+# -------------------------
+# Batched analysis
+# -------------------------
+def analyze_batch(receptor: Receptor, ligands: list, reference: Reference | None = None,
+                  hbond_cutoff: float = HBOND_CUTOFF) -> tuple:
+    """
+    Contacts, H-bonds and reference RMSD of every pose of a batch of
+    ligands. `ligands`: list of (dir_name, docked_sdf_text, flex_pdb_text
+    or None). Returns (pose_columns, residue_columns) as dicts of lists.
+    """
+    poses = {c: [] for c in POSE_COLUMNS}
+    residues = {c: [] for c in RESIDUE_COLUMNS}
+
+    # Flatten the batch: heavy atoms of all poses, flex atoms of all poses
+    lig_xyz, lig_polar, lig_pose = [], [], []
+    flex_xyz, flex_polar, flex_res, flex_pose = [], [], [], []
+    replaced = []  # receptor atoms moved by a ligand's flex models: (batch ligand, atom)
+    pose_ligand, rmsd = [], []
+    for b, (dir_name, docked_text, flex_text) in enumerate(ligands):
+        records = parse_sdf_poses(docked_text)
+        models = split_flex_text(flex_text) if flex_text else []
+        matches = reference.matches(records[0][1]) if reference and records else None
+        moved = set()
+        for rank, (name, _, coords, elements) in enumerate(records, start=1):
+            g = len(pose_ligand)
+            pose_ligand.append(b)
+            poses["lig_id"].append(dir_name.split("__", 1)[0])
+            poses["dir_name"].append(dir_name)
+            poses["name"].append(name)
+            poses["rank"].append(rank)
+
+            heavy = np.array([e != "H" for e in elements], dtype=bool)
+            lig_xyz.append(coords[heavy])
+            lig_polar.append(np.isin(np.array(elements)[heavy], POLAR_ELEMENTS))
+            lig_pose.append(np.full(int(heavy.sum()), g, dtype=np.int64))
+
+            if rank <= len(models):
+                atoms = parse_pdb_atoms(models[rank - 1].splitlines())
+                res = [receptor.residue_id(key, resname)
+                       for key, resname in zip(atoms["residues"], atoms["resnames"])]
+                flex_xyz.append(atoms["coords"])
+                flex_polar.append(atoms["polar"])
+                flex_res.append(np.array(res, dtype=np.int64))
+                flex_pose.append(np.full(len(res), g, dtype=np.int64))
+                moved.update(receptor.atom_ids.get(key) for key in zip(res, atoms["names"]))
+        moved.discard(None)
+        replaced.extend(b * len(receptor.coords) + atom for atom in moved)
+
+        # RMSD over every symmetry mapping at once: (poses, mappings, atoms, 3)
+        if matches is not None and all(len(r[2]) == len(records[0][2]) for r in records):
+            stack = np.stack([r[2] for r in records])
+            diff = stack[:, matches, :] - reference.coords
+            rmsd.extend(np.sqrt((diff ** 2).sum(axis=3).mean(axis=2)).min(axis=1).tolist())
+        else:
+            rmsd.extend([None] * len(records))
+
+    n_poses = len(pose_ligand)
+    if not n_poses:
+        return poses, residues
+
+    def concat(chunks, dtype):
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+
+    lig_xyz = concat(lig_xyz, float).reshape(-1, 3)
+    lig_polar, lig_pose = concat(lig_polar, bool), concat(lig_pose, np.int64)
+    pose_ligand = np.array(pose_ligand, dtype=np.int64)
+
+    # Rigid receptor pairs, minus atoms a ligand's flex models moved
+    i, j, d = receptor.index.pairs(lig_xyz)
+    keep = ~np.isin(pose_ligand[lig_pose[i]] * len(receptor.coords) + j,
+                    np.array(replaced, dtype=np.int64))
+    i, j, d = i[keep], j[keep], d[keep]
+    pair_res, pair_polar = receptor.residue[j], receptor.polar[j]
+    pair_flex = np.zeros(len(i), dtype=bool)
+
+    # Flex residue pairs: one index over all flex models, same-pose pairs only
+    if flex_xyz:
+        flex_xyz = concat(flex_xyz, float).reshape(-1, 3)
+        flex_polar, flex_res = concat(flex_polar, bool), concat(flex_res, np.int64)
+        flex_pose = concat(flex_pose, np.int64)
+        fi, fj, fd = SpatialIndex(flex_xyz, receptor.index.radius).pairs(lig_xyz)
+        same = lig_pose[fi] == flex_pose[fj]
+        fi, fj, fd = fi[same], fj[same], fd[same]
+        i, d = np.concatenate([i, fi]), np.concatenate([d, fd])
+        pair_res = np.concatenate([pair_res, flex_res[fj]])
+        pair_polar = np.concatenate([pair_polar, flex_polar[fj]])
+        pair_flex = np.concatenate([pair_flex, np.ones(len(fi), dtype=bool)])
+
+    pair_pose = lig_pose[i]
+    hbond = lig_polar[i] & pair_polar & (d <= hbond_cutoff)
+
+    # Per pose
+    poses["n_contacts"] = np.bincount(pair_pose, minlength=n_poses).tolist()
+    poses["n_hbonds"] = np.bincount(pair_pose, weights=hbond, minlength=n_poses).astype(int).tolist()
+    poses["flex_contacts"] = np.bincount(pair_pose, weights=pair_flex,
+                                         minlength=n_poses).astype(int).tolist()
+    poses["flex_hbonds"] = np.bincount(pair_pose, weights=hbond & pair_flex,
+                                       minlength=n_poses).astype(int).tolist()
+
+    centroids = (np.stack([np.bincount(lig_pose, weights=lig_xyz[:, k], minlength=n_poses)
+                           for k in range(3)], axis=1)
+                 / np.maximum(np.bincount(lig_pose, minlength=n_poses), 1)[:, None])
+    poses["ref_rmsd"] = rmsd
+    poses["ref_centroid_dist"] = (
+        np.linalg.norm(centroids - reference.centroid, axis=1).tolist()
+        if reference is not None else [None] * n_poses
+    )
+
+    # Per (pose, residue), in pose then receptor file order
+    n_res = len(receptor.residue_keys)
+    keys, inverse = np.unique(pair_pose * n_res + pair_res, return_inverse=True)
+    res_contacts = np.bincount(inverse)
+    res_hbonds = np.bincount(inverse, weights=hbond).astype(int)
+    res_flex = np.bincount(inverse, weights=pair_flex) > 0
+    key_pose, key_res = keys // n_res, keys % n_res
+    poses["n_residues"] = np.bincount(key_pose, minlength=n_poses).tolist()
+
+    contacted = [[] for _ in range(n_poses)]
+    bonded = [[] for _ in range(n_poses)]
+    for g, res, n, n_hb, flex in zip(key_pose.tolist(), key_res.tolist(), res_contacts.tolist(),
+                                     res_hbonds.tolist(), res_flex.tolist()):
+        label = receptor.label(res)
+        contacted[g].append(label)
+        if n_hb:
+            bonded[g].append(label)
+        residues["lig_id"].append(poses["lig_id"][g])
+        residues["dir_name"].append(poses["dir_name"][g])
+        residues["rank"].append(poses["rank"][g])
+        residues["residue"].append(label)
+        residues["resname"].append(receptor.resnames[res])
+        residues["flex"].append(flex)
+        residues["n_contacts"].append(n)
+        residues["n_hbonds"].append(n_hb)
+    poses["contact_residues"] = [";".join(labels) for labels in contacted]
+    poses["hbond_residues"] = [";".join(labels) for labels in bonded]
+    return poses, residues
+
+
+def _iter_ligands(results_dir: str, n_threads: int = 16, window: int = BATCH_LIGANDS):
+    """
+    (dir_name, docked_sdf_text, flex_pdb_text or None) of every docked ligand, sorted.
+
+    At most `window` reads are in flight or waiting to be consumed, so
+    memory stays bounded by the batch, not the results tree.
+    """
+    ligands_root = os.path.join(results_dir, "ligands")
+    packed_root = os.path.join(results_dir, "packed")
+    store = (PackedStore(packed_root)
+             if os.path.exists(os.path.join(packed_root, "index.sqlite")) else None)
+    try:
+        packed = set(store.job_ids()) if store else set()
+        dir_names = sorted(packed | {
+            entry.name for entry in os.scandir(ligands_root)
+            if entry.is_dir() and entry.name not in packed
+        })
+
+        def read(dir_name):
+            if dir_name in packed:
+                return (dir_name, store.get_text(dir_name, "output/docked.sdf"),
+                        store.get_text(dir_name, "output/flex_residues.pdb"))
+            texts = []
+            for file_name in ("docked.sdf", "flex_residues.pdb"):
+                try:
+                    with open(os.path.join(ligands_root, dir_name, "output", file_name)) as f:
+                        texts.append(f.read())
+                except OSError:
+                    texts.append(None)
+            return (dir_name, *texts)
+
+        # File reads dominate: overlap them with a thread pool
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            in_flight = deque()
+            for dir_name in dir_names:
+                in_flight.append(pool.submit(read, dir_name))
+                if len(in_flight) >= window:
+                    ligand = in_flight.popleft().result()
+                    if ligand[1]:
+                        yield ligand
+            while in_flight:
+                ligand = in_flight.popleft().result()
+                if ligand[1]:
+                    yield ligand
+    finally:
+        if store is not None:
+            store.close()
+
+
+def analyze_poses(results_dir: str, summary_dir: str = None,
+                  contact_cutoff: float = CONTACT_CUTOFF, hbond_cutoff: float = HBOND_CUTOFF,
+                  batch_size: int = BATCH_LIGANDS) -> tuple:
+    """Analyse all poses of a results tree. Returns (pose_contacts_path, residue_contacts_path)."""
+    summary_dir = summary_dir or os.path.join(results_dir, "summary")
+    os.makedirs(summary_dir, exist_ok=True)
+
+    start = time.time()
+    receptor = Receptor(os.path.join(results_dir, "protein", "receptor.pdb"), contact_cutoff)
+    ref_path = os.path.join(results_dir, "reference", "ref_ligand.sdf")
+    reference = Reference(ref_path) if os.path.exists(ref_path) else None
+
+    poses = {c: [] for c in POSE_COLUMNS}
+    residues = {c: [] for c in RESIDUE_COLUMNS}
+    batch = []
+
+    def flush():
+        batch_poses, batch_residues = analyze_batch(receptor, batch, reference, hbond_cutoff)
+        for c in POSE_COLUMNS:
+            poses[c].extend(batch_poses[c])
+        for c in RESIDUE_COLUMNS:
+            residues[c].extend(batch_residues[c])
+        batch.clear()
+
+    for ligand in _iter_ligands(results_dir, window=batch_size):
+        batch.append(ligand)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    poses_path = write_table(poses, os.path.join(summary_dir, "pose_contacts"))
+    residues_path = write_table(residues, os.path.join(summary_dir, "residue_contacts"))
+    print(f"✔ Analysed {len(poses['rank'])} poses of {len(set(poses['dir_name']))} ligands "
+          f"in {time.time() - start:.1f} s → {poses_path}, {residues_path}")
+    return poses_path, residues_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Contacts, H-bonds and reference RMSD of GNINA poses, as columnar files"
+    )
+    parser.add_argument("results_dir", help="Docking results directory (contains ligands/)")
+    parser.add_argument("--summary-dir", default=None,
+                        help="Output directory (default: <results_dir>/summary)")
+    parser.add_argument("--contact-cutoff", type=float, default=CONTACT_CUTOFF,
+                        help="Heavy-atom contact distance in Å (default: %(default)s)")
+    parser.add_argument("--hbond-cutoff", type=float, default=HBOND_CUTOFF,
+                        help="N/O H-bond distance in Å (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_LIGANDS,
+                        help="Ligands analysed together (default: %(default)s)")
+    args = parser.parse_args(argv)
+    analyze_poses(args.results_dir, args.summary_dir, args.contact_cutoff,
+                  args.hbond_cutoff, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+receptor_crop.py
+Pocket-cropped receptor for GNINA (text level, stdlib only).
+
+GNINA only scores receptor atoms near the search box, but it parses the
+whole receptor and builds its grids from it on every call. Cropping to
+the pocket shrinks both:
+- the box is the --autobox_ligand bounding box grown by --autobox_add
+- whole residues with any atom within `margin` Å of the box are kept.
+  The Vina terms only see atoms within 8 Å of the pose, but GNINA's CNN
+  scores a ~24 Å grid centred on the pose, i.e. up to 12 Å beyond the
+  box edge; the default (DEFAULT_MARGIN = 12 Å) covers that grid for
+  poses centred inside the box. CNN scores can still shift slightly
+  (e.g. cut residues at the grid corners), so check a crop with
+  --validate-crop before using it for a screen
+- flexible residues are always kept
+- ATOM/HETATM records are copied verbatim, so chain IDs, residue numbers
+  and insertion codes stay exactly as in the input (flexres specs such
+  as A:182 still resolve)
+"""
+
+DEFAULT_MARGIN = 12.0  # Å beyond the autobox: half the CNN grid (~24 Å cube around the pose)
+
+
+def read_ligand_coords(sdf_path: str) -> list:
+    """Atom coordinates of every molecule in an SDF (V2000 and V3000)."""
+    coords = []
+    with open(sdf_path, "r") as f:
+        lines = f.read().splitlines()
+
+    i = 0
+    while i + 3 < len(lines):
+        counts = lines[i + 3]
+        if "V3000" in counts:
+            j = i + 4
+            in_atoms = False
+            while j < len(lines) and not lines[j].startswith("M  END"):
+                line = lines[j]
+                if line.startswith("M  V30 BEGIN ATOM"):
+                    in_atoms = True
+                elif line.startswith("M  V30 END ATOM"):
+                    in_atoms = False
+                elif in_atoms:
+                    parts = line.split()
+                    coords.append(tuple(float(v) for v in parts[4:7]))
+                j += 1
+        else:
+            n_atoms = int(counts[:3])
+            for line in lines[i + 4:i + 4 + n_atoms]:
+                coords.append((float(line[0:10]), float(line[10:20]), float(line[20:30])))
+            j = i + 4 + n_atoms
+
+        # Next record
+        while j < len(lines) and lines[j].strip() != "$$$$":
+            j += 1
+        i = j + 1
+
+    return coords
+
+
+def autobox(coords: list, autobox_add: float) -> tuple:
+    """GNINA --autobox_ligand box: (min_xyz, max_xyz) grown by autobox_add."""
+    lo = tuple(min(c[k] for c in coords) - autobox_add for k in range(3))
+    hi = tuple(max(c[k] for c in coords) + autobox_add for k in range(3))
+    return lo, hi
+
+
+def _box_distance2(xyz: tuple, box: tuple) -> float:
+    lo, hi = box
+    d2 = 0.0
+    for k in range(3):
+        if xyz[k] < lo[k]:
+            d2 += (lo[k] - xyz[k]) ** 2
+        elif xyz[k] > hi[k]:
+            d2 += (xyz[k] - hi[k]) ** 2
+    return d2
+
+
+def _residue_key(line: str) -> tuple:
+    """(chain, resSeq, iCode) of an ATOM/HETATM/ANISOU record."""
+    return line[21], line[22:26].strip(), line[26].strip()
+
+
+def parse_flex_residues(flex_residues: str) -> set:
+    """'A:182,A:181' (GNINA --flexres) → {(chain, resSeq, iCode)}."""
+    keys = set()
+    for spec in flex_residues.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        chain, _, resid = spec.partition(":")
+        icode = resid[-1] if resid and resid[-1].isalpha() else ""
+        keys.add((chain, resid[:-1] if icode else resid, icode))
+    return keys
+
+
+def crop_receptor(receptor_pdb: str, ref_ligand_sdf: str, output_pdb: str,
+                  autobox_add: float = 4.0, margin: float = DEFAULT_MARGIN,
+                  flex_residues: str = "") -> dict:
+    """
+    Write the pocket-cropped receptor.
+
+    Returns: {"residues_total", "residues_kept", "atoms_total", "atoms_kept"}
+    """
+    box = autobox(read_ligand_coords(ref_ligand_sdf), autobox_add)
+    cutoff2 = margin ** 2
+
+    with open(receptor_pdb, "r") as f:
+        lines = f.readlines()
+
+    residues = set()
+    keep = parse_flex_residues(flex_residues)
+    for line in lines:
+        if line.startswith(("ATOM", "HETATM")):
+            key = _residue_key(line)
+            residues.add(key)
+            if key in keep:
+                continue
+            xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+            if _box_distance2(xyz, box) <= cutoff2:
+                keep.add(key)
+
+    atoms_total = atoms_kept = 0
+    out = []
+    last_kept = False
+    for line in lines:
+        if line.startswith(("ATOM", "HETATM", "ANISOU")):
+            kept = _residue_key(line) in keep
+            if not line.startswith("ANISOU"):
+                atoms_total += 1
+                atoms_kept += kept
+            if kept:
+                out.append(line)
+            last_kept = kept
+        elif line.startswith("TER"):
+            # Keep chain breaks only where the chain is still present
+            if last_kept:
+                out.append("TER\n")
+            last_kept = False
+        elif line.startswith(("CONECT", "MASTER")) or line.rstrip() == "END":
+            # Serial numbers refer to dropped atoms; END is re-added
+            continue
+        else:
+            out.append(line)
+    out.append("END\n")
+
+    with open(output_pdb, "w") as f:
+        f.writelines(out)
+
+    return {
+        "residues_total": len(residues),
+        "residues_kept": len(keep & residues),
+        "atoms_total": atoms_total,
+        "atoms_kept": atoms_kept,
+    }
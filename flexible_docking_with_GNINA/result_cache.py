@@ -0,0 +1,109 @@
+"""
+result_cache.py
+Content-addressed store of GNINA docking results.
+
+A result is addressed by a fingerprint of everything that determines it:
+- the ligand's 3D content (mol block without the name line)
+- the receptor file and the reference (autobox) ligand file contents
+- FLEX_RESIDUES and every GNINA flag (paths and --device excluded)
+
+so reordering or growing the input SDF reuses finished results, while
+changing the receptor or any setting re-docks against the new settings.
+
+Layout: <cache_root>/<fp[:2]>/<fp>/{docked.sdf, flex_residues.pdb, gnina.log, RESULT.json}
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Files kept per result: cache name -> path relative to the ligand folder
+RESULT_FILES = {
+    "docked.sdf": os.path.join("output", "docked.sdf"),
+    "flex_residues.pdb": os.path.join("output", "flex_residues.pdb"),
+    "gnina.log": os.path.join("logs", "gnina.log"),
+}
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def settings_fingerprint(receptor: str, ref_ligand: str, gnina_args: list) -> str:
+    """Digest of receptor + autobox reference + GNINA flags, shared by all ligands."""
+    payload = json.dumps({
+        "receptor": file_sha256(receptor),
+        "ref_ligand": file_sha256(ref_ligand),
+        "gnina_args": [str(a) for a in gnina_args],
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def ligand_fingerprint(molblock: str, settings_fp: str) -> str:
+    """Result address for one ligand; the molecule name line is ignored."""
+    content = "\n".join(molblock.splitlines()[1:])
+    h = hashlib.sha256(settings_fp.encode("utf-8"))
+    h.update(content.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _entry_dir(cache_root: str, fp: str) -> str:
+    return os.path.join(cache_root, fp[:2], fp)
+
+
+def store_result(cache_root: str, fp: str, lig_root: str, info: dict):
+    """
+    Save a finished ligand's outputs under its fingerprint.
+
+    Files are copied, not hard-linked, so re-docking a ligand folder can
+    never truncate a cached result. The entry appears atomically (rename).
+    """
+    entry = _entry_dir(cache_root, fp)
+    if os.path.exists(os.path.join(entry, "RESULT.json")):
+        return
+
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f".{fp[:8]}.", dir=os.path.dirname(entry))
+    try:
+        for name, rel in RESULT_FILES.items():
+            src = os.path.join(lig_root, rel)
+            if os.path.exists(src):
+                shutil.copyfile(src, os.path.join(tmp, name))
+        with open(os.path.join(tmp, "RESULT.json"), "w") as f:
+            json.dump(info, f)
+        os.rename(tmp, entry)
+    except OSError:
+        # Lost a race with another writer for the same fingerprint
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def has_result(cache_root: str, fp: str) -> bool:
+    return os.path.exists(os.path.join(_entry_dir(cache_root, fp), "RESULT.json"))
+
+
+def restore_result(cache_root: str, fp: str, lig_root: str) -> dict | None:
+    """
+    Materialize a cached result into a ligand folder.
+
+    Returns: the stored RESULT.json info, or None on a cache miss
+    """
+    entry = _entry_dir(cache_root, fp)
+    info_file = os.path.join(entry, "RESULT.json")
+    if not os.path.exists(info_file):
+        return None
+
+    for name, rel in RESULT_FILES.items():
+        src = os.path.join(entry, name)
+        if os.path.exists(src):
+            dst = os.path.join(lig_root, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(src, dst)
+
+    with open(info_file) as f:
+        return json.load(f)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+results_aggregation.py
+Columnar aggregation of every docked pose in a results tree.
+
+Scans ligands/*/output/docked.sdf (and, for --packed runs, the packed
+store's pose shards) with the text-level SD parser (no RDKit molecules)
+and writes:
+- summary/poses.parquet    one row per pose: ligand, rank, affinity,
+                           CNNscore, CNNaffinity
+- summary/ligands.parquet  one row per ligand: best pose per scoring term
+                           (lowest affinity, highest CNNscore, highest
+                           CNNaffinity) and the rank it came from; plus
+                           one row per alias name of a deduplicated
+                           structure (ligand_mapping.csv ALIAS_OF), with
+                           its scores and alias_of = the docked name
+
+Only ligands listed in ligands/ligand_mapping.csv are aggregated (when
+it exists), so folders left by an earlier input SDF (e.g. hits no longer
+promoted by a --funnel rerun) do not reappear. Falls back to CSV when
+pyarrow is not installed. Independent of the docking loop's
+progress.csv, so it can run at any time.
+
+Usage:
+    python results_aggregation.py /kaggle/working/docking_results/8skl
+"""
+
+import argparse
+import csv
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # CSV fallback
+    pa = None
+
+from gnina_output import iter_sdf_properties, iter_sdf_text_properties
+from packed_store import PackedStore
+
+SCORE_PROPS = ("minimizedAffinity", "CNNscore", "CNNaffinity")
+
+POSE_COLUMNS = ("lig_id", "dir_name", "name", "rank",
+                "affinity", "cnn_score", "cnn_affinity")
+
+LIGAND_COLUMNS = ("lig_id", "dir_name", "name", "n_poses",
+                  "best_affinity", "best_affinity_rank",
+                  "best_cnn_score", "best_cnn_score_rank",
+                  "best_cnn_affinity", "best_cnn_affinity_rank",
+                  "alias_of")
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_pose_scores(sdf_path: str) -> list:
+    """
+    Scores of every pose in a GNINA output SDF, in file order.
+
+    Returns: list of (name, rank, affinity, cnn_score, cnn_affinity)
+    """
+    return _pose_scores(iter_sdf_properties(sdf_path, SCORE_PROPS))
+
+
+def text_pose_scores(sdf_text: str) -> list:
+    """read_pose_scores() of SDF text (a packed docked.sdf record)."""
+    return _pose_scores(iter_sdf_text_properties(sdf_text, SCORE_PROPS))
+
+
+def _pose_scores(records) -> list:
+    poses = []
+    for rank, (name, props) in enumerate(records, start=1):
+        poses.append((
+            name,
+            rank,
+            _float(props.get("minimizedAffinity")),
+            _float(props.get("CNNscore")),
+            _float(props.get("CNNaffinity")),
+        ))
+    return poses
+
+
+def best_pose_scores(poses: list) -> dict:
+    """
+    Best pose per scoring term.
+    Vina affinity: lower is better. CNNscore / CNNaffinity: higher is better.
+    """
+    def pick(col, better):
+        scored = [p for p in poses if p[col] is not None]
+        if not scored:
+            return None, None
+        best = better(scored, key=lambda p: p[col])
+        return best[col], best[1]
+
+    best_aff, best_aff_rank = pick(2, min)
+    best_cnn, best_cnn_rank = pick(3, max)
+    best_cnn_aff, best_cnn_aff_rank = pick(4, max)
+    return {
+        "best_affinity": best_aff,
+        "best_affinity_rank": best_aff_rank,
+        "best_cnn_score": best_cnn,
+        "best_cnn_score_rank": best_cnn_rank,
+        "best_cnn_affinity": best_cnn_aff,
+        "best_cnn_affinity_rank": best_cnn_aff_rank,
+    }
+
+
+def _scan_ligand(ligands_root: str, dir_name: str):
+    sdf_path = os.path.join(ligands_root, dir_name, "output", "docked.sdf")
+    try:
+        return dir_name, read_pose_scores(sdf_path)
+    except OSError:
+        return dir_name, None
+
+
+def read_mapped_dirs(ligands_root: str) -> set | None:
+    """Folder names of the ligands in ligand_mapping.csv (None for old trees)."""
+    mapping_file = os.path.join(ligands_root, "ligand_mapping.csv")
+    if not os.path.exists(mapping_file):
+        return None
+    with open(mapping_file, newline="", encoding="utf-8") as f:
+        return {row["DIR_NAME"] for row in csv.DictReader(f)}
+
+
+def read_aliases(ligands_root: str) -> dict:
+    """{dir_name: [alias names]} from ligand_mapping.csv (empty for old trees)."""
+    aliases = {}
+    mapping_file = os.path.join(ligands_root, "ligand_mapping.csv")
+    if not os.path.exists(mapping_file):
+        return aliases
+    with open(mapping_file, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("ALIAS_OF"):
+                aliases.setdefault(row["DIR_NAME"], []).append(row["ORIGINAL_NAME"])
+    return aliases
+
+
+def _scan_packed(results_dir: str) -> dict:
+    """{dir_name: poses} from the packed store of a --packed run (empty otherwise)."""
+    packed_root = os.path.join(results_dir, "packed")
+    if not os.path.exists(os.path.join(packed_root, "index.sqlite")):
+        return {}
+    store = PackedStore(packed_root)
+    try:
+        return {
+            job_id: text_pose_scores(data.decode("utf-8"))
+            for job_id, data in store.iter_files("output/docked.sdf")
+        }
+    finally:
+        store.close()
+
+
+def collect(results_dir: str, n_threads: int = 16, dir_names: set | None = None) -> tuple:
+    """
+    Scan the docked.sdf files of the ligands in `dir_names` (default: the
+    ligand mapping, else every folder). Returns (pose_columns,
+    ligand_columns) as dicts of lists.
+    """
+    ligands_root = os.path.join(results_dir, "ligands")
+    if dir_names is None:
+        dir_names = read_mapped_dirs(ligands_root)
+    packed = _scan_packed(results_dir)
+    if dir_names is not None:
+        packed = {d: poses for d, poses in packed.items() if d in dir_names}
+    dir_names = sorted(
+        entry.name for entry in os.scandir(ligands_root)
+        if entry.is_dir() and entry.name not in packed
+        and (dir_names is None or entry.name in dir_names)
+    )
+
+    aliases = read_aliases(ligands_root)
+
+    poses = {c: [] for c in POSE_COLUMNS}
+    ligands = {c: [] for c in LIGAND_COLUMNS}
+
+    # File reads dominate: overlap them with a thread pool
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        scanned = list(pool.map(lambda d: _scan_ligand(ligands_root, d), dir_names))
+        for dir_name, lig_poses in sorted(scanned + list(packed.items()), key=lambda x: x[0]):
+            if not lig_poses:
+                continue
+            lig_id = dir_name.split("__", 1)[0]
+            name = lig_poses[0][0]
+
+            for pose_name, rank, aff, cnn, cnn_aff in lig_poses:
+                poses["lig_id"].append(lig_id)
+                poses["dir_name"].append(dir_name)
+                poses["name"].append(pose_name)
+                poses["rank"].append(rank)
+                poses["affinity"].append(aff)
+                poses["cnn_score"].append(cnn)
+                poses["cnn_affinity"].append(cnn_aff)
+
+            best = best_pose_scores(lig_poses)
+            # Fan out: the docked name first, then every alias with its scores
+            for row_name, alias_of in [(name, None)] + [
+                (alias, name) for alias in aliases.get(dir_name, [])
+            ]:
+                ligands["lig_id"].append(lig_id)
+                ligands["dir_name"].append(dir_name)
+                ligands["name"].append(row_name)
+                ligands["n_poses"].append(len(lig_poses))
+                for key, value in best.items():
+                    ligands[key].append(value)
+                ligands["alias_of"].append(alias_of)
+
+    return poses, ligands
+
+
+def write_table(columns: dict, path_no_ext: str) -> str:
+    """
+    Write a dict of columns as Parquet (or CSV without pyarrow). Returns the path.
+    The file is replaced atomically, as sessions sharing a results tree
+    may aggregate at the same time.
+    """
+    if pa is not None:
+        path = path_no_ext + ".parquet"
+        tmp = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        pq.write_table(pa.table(columns), tmp)
+        os.replace(tmp, path)
+        return path
+
+    path = path_no_ext + ".csv"
+    tmp = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    names = list(columns)
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(columns[n] for n in names)))
+    os.replace(tmp, path)
+    return path
+
+
+def aggregate_results(results_dir: str, summary_dir: str = None) -> tuple:
+    """Aggregate all poses of a results tree. Returns (poses_path, ligands_path)."""
+    summary_dir = summary_dir or os.path.join(results_dir, "summary")
+    os.makedirs(summary_dir, exist_ok=True)
+
+    start = time.time()
+    poses, ligands = collect(results_dir)
+    poses_path = write_table(poses, os.path.join(summary_dir, "poses"))
+    ligands_path = write_table(ligands, os.path.join(summary_dir, "ligands"))
+
+    print(f"✔ Aggregated {len(poses['rank'])} poses of {len(set(ligands['dir_name']))} ligands "
+          f"in {time.time() - start:.1f} s → {poses_path}, {ligands_path}")
+    return poses_path, ligands_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate GNINA poses into columnar files")
+    parser.add_argument("results_dir", help="Docking results directory (contains ligands/)")
+    parser.add_argument("--summary-dir", default=None,
+                        help="Output directory (default: <results_dir>/summary)")
+    args = parser.parse_args(argv)
+    aggregate_results(args.results_dir, args.summary_dir)
+
+
+if __name__ == "__main__":
+    main()
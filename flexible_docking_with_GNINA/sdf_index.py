@@ -0,0 +1,234 @@
+"""
+sdf_index.py
+Byte-offset index over a multi-record SDF, read through mmap.
+
+Built once per input file (one scan) and stored next to it as
+<input>.index.sqlite, or in a fallback folder when the input folder is
+read-only (e.g. /kaggle/input). Per record it keeps the byte range and
+the fields a caller-supplied describe() derives at build time (name,
+SMILES, dedup key, aliases, folder name); result fingerprints are kept per docking
+settings digest and added on demand. The index is valid while the SDF's
+size and mtime are unchanged.
+
+Records are sliced out of a shared read-only mmap of the SDF, so
+docking workers read single ligands without a split step; the mapping
+follows the file at its path like the index does.
+"""
+
+import mmap
+import os
+import socket
+import sqlite3
+import threading
+
+INDEX_VERSION = "2"
+INDEX_SUFFIX = ".index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key    TEXT PRIMARY KEY,
+    value  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    sdf_index  INTEGER PRIMARY KEY,
+    offset     INTEGER NOT NULL,
+    length     INTEGER NOT NULL,
+    valid      INTEGER NOT NULL,
+    name       TEXT,
+    smiles     TEXT,
+    dedup_key  TEXT,
+    aliases    TEXT,
+    dir_name   TEXT
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    settings_fp  TEXT NOT NULL,
+    sdf_index    INTEGER NOT NULL,
+    fingerprint  TEXT NOT NULL,
+    PRIMARY KEY (settings_fp, sdf_index)
+);
+"""
+
+_MAPS = {}       # path -> (file identity, mmap)
+_MAPS_LOCK = threading.Lock()
+
+
+def _identity(st: os.stat_result) -> tuple:
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _mapped(path: str) -> mmap.mmap:
+    """
+    Shared read-only mmap of a file (one per path and process), remapped
+    when the file at `path` changes (replaced or rewritten in place), so
+    offsets of a rebuilt index never slice the old contents. A dropped map
+    is closed once its last reader lets go of it.
+    """
+    identity = _identity(os.stat(path))
+    entry = _MAPS.get(path)
+    if entry is None or entry[0] != identity:
+        with _MAPS_LOCK:
+            entry = _MAPS.get(path)
+            if entry is None or entry[0] != identity:
+                with open(path, "rb") as f:
+                    entry = _MAPS[path] = (
+                        _identity(os.fstat(f.fileno())),
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    )
+    return entry[1]
+
+
+def read_record(path: str, offset: int, length: int) -> str:
+    """One SDF record by byte range (text ends with '$$$$' line when complete)."""
+    return _mapped(path)[offset:offset + length].decode("utf-8")
+
+
+def scan_records(path: str):
+    """
+    Yield (offset, length) of every record: the same boundaries as
+    SDMolSupplier ('$$$$' lines; a trailing record without one counts).
+    """
+    offset = pos = 0
+    has_content = False
+    with open(path, "rb") as f:
+        for line in f:
+            pos += len(line)
+            if line.rstrip(b"\r\n") == b"$$$$":
+                yield offset, pos - offset
+                offset, has_content = pos, False
+            elif line.strip():
+                has_content = True
+    if has_content:
+        yield offset, pos - offset
+
+
+def _signature(sdf_path: str) -> dict:
+    st = os.stat(sdf_path)
+    return {"version": INDEX_VERSION, "sdf_size": str(st.st_size),
+            "sdf_mtime_ns": str(st.st_mtime_ns)}
+
+
+class SdfIndex:
+    """Offset index of one SDF file; see open()."""
+
+    def __init__(self, sdf_path: str, index_path: str):
+        self.sdf_path = sdf_path
+        self.index_path = index_path
+        self._conn = sqlite3.connect(index_path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    @classmethod
+    def open(cls, sdf_path: str, fallback_dir: str) -> "SdfIndex":
+        """
+        The current index of `sdf_path` (next to it or in fallback_dir),
+        or an empty one to build() at the first writable location.
+        """
+        candidates = [
+            sdf_path + INDEX_SUFFIX,
+            os.path.join(fallback_dir, os.path.basename(sdf_path) + INDEX_SUFFIX),
+        ]
+        for path in candidates:
+            if os.path.exists(path):
+                index = cls(sdf_path, path)
+                if index.is_current():
+                    return index
+                index.close()
+
+        writable = os.access(os.path.dirname(os.path.abspath(sdf_path)), os.W_OK)
+        target = candidates[0] if writable else candidates[1]
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        return cls(sdf_path, target)
+
+    def is_current(self) -> bool:
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        return all(meta.get(k) == v for k, v in _signature(self.sdf_path).items())
+
+    def build(self, describe, settings_fp: str | None = None) -> int:
+        """
+        Scan the SDF and index every record.
+
+        describe(record_text) -> None for an unreadable record, else a
+        dict with name, smiles, dedup_key, aliases, dir_name and (for settings_fp)
+        fingerprint. Built in a private file and renamed into place, so
+        sessions building concurrently never see a partial index.
+
+        Returns: number of records
+        """
+        tmp = f"{self.index_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        signature = _signature(self.sdf_path)
+
+        conn = sqlite3.connect(tmp, isolation_level=None)
+        conn.executescript(_SCHEMA)
+        conn.execute("BEGIN")
+        n = 0
+        for n, (offset, length) in enumerate(scan_records(self.sdf_path), start=1):
+            info = describe(read_record(self.sdf_path, offset, length))
+            if info is None:
+                conn.execute(
+                    "INSERT INTO records (sdf_index, offset, length, valid) VALUES (?, ?, ?, 0)",
+                    (n, offset, length)
+                )
+                continue
+            conn.execute(
+                "INSERT INTO records (sdf_index, offset, length, valid, name, smiles, dedup_key,"
+                " aliases, dir_name) VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)",
+                (n, offset, length, info["name"], info["smiles"], info["dedup_key"],
+                 info["aliases"], info["dir_name"])
+            )
+            if settings_fp:
+                conn.execute(
+                    "INSERT INTO fingerprints (settings_fp, sdf_index, fingerprint) VALUES (?, ?, ?)",
+                    (settings_fp, n, info["fingerprint"])
+                )
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", signature.items())
+        conn.execute("COMMIT")
+        conn.close()
+
+        self._conn.close()
+        os.replace(tmp, self.index_path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self.index_path + suffix):
+                os.remove(self.index_path + suffix)
+        self._conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        return n
+
+    def records(self) -> list:
+        """All records in file order: dicts of the index columns."""
+        cur = self._conn.execute(
+            "SELECT sdf_index, offset, length, valid, name, smiles, dedup_key, aliases,"
+            " dir_name FROM records ORDER BY sdf_index"
+        )
+        names = [c[0] for c in cur.description]
+        return [dict(zip(names, row)) for row in cur]
+
+    def fingerprints(self, settings_fp: str) -> dict:
+        """{sdf_index: fingerprint} stored for these settings (empty if none)."""
+        return dict(self._conn.execute(
+            "SELECT sdf_index, fingerprint FROM fingerprints WHERE settings_fp = ?",
+            (settings_fp,)
+        ))
+
+    def add_fingerprints(self, settings_fp: str, fingerprint) -> dict:
+        """
+        Compute fingerprint(record_text) for every valid record under new
+        settings and store them. Returns {sdf_index: fingerprint}.
+        """
+        fps = {}
+        for row in self.records():
+            if row["valid"]:
+                fps[row["sdf_index"]] = fingerprint(
+                    read_record(self.sdf_path, row["offset"], row["length"])
+                )
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO fingerprints (settings_fp, sdf_index, fingerprint)"
+            " VALUES (?, ?, ?)", [(settings_fp, i, fp) for i, fp in fps.items()]
+        )
+        self._conn.execute("COMMIT")
+        return fps
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+stub_gnina.py
+Stand-in GNINA executable for local testing of the docking pipeline
+(no GPU, no GNINA build needed). Stdlib only.
+
+Accepts the same command line as flexible_docking_execution.run_gnina and
+writes GNINA-shaped outputs:
+- -o          docked SDF: every input molecule x --num_modes poses, with
+              minimizedAffinity / CNNscore / CNNaffinity properties
+- --out_flex  flexible residue PDB, one MODEL per pose
+- --log       GNINA-style mode table
+- stdout      GNINA-style search progress bar (51 '*' per ligand)
+
+Environment knobs:
+- STUB_GNINA_SLEEP   seconds to sleep per ligand (default 0)
+- STUB_GNINA_FAIL    exit 1 if any input molecule name contains this string
+- STUB_GNINA_HANG    hang silently if any input molecule name contains this
+                     string and the seed is STUB_GNINA_HANG_SEED (default:
+                     any seed)
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-r", "--receptor")
+    parser.add_argument("-l", "--ligand")
+    parser.add_argument("-o", "--out")
+    parser.add_argument("--out_flex")
+    parser.add_argument("--log")
+    parser.add_argument("--flexres", default="")
+    parser.add_argument("--num_modes", type=int, default=9)
+    parser.add_argument("--seed", type=int, default=0)
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def read_sdf_records(path):
+    """Split an SDF into (name, molblock) records without any chemistry."""
+    with open(path) as f:
+        text = f.read()
+    records = []
+    for i, block in enumerate(text.split("$$$$")):
+        # Only the newline after '$$$$': an empty title line belongs to the record
+        if i and block.startswith("\r\n"):
+            block = block[2:]
+        elif i and block.startswith("\n"):
+            block = block[1:]
+        if not block.strip():
+            continue
+        molblock = block.split("M  END")[0] + "M  END"
+        name = block.splitlines()[0].strip()
+        records.append((name, molblock))
+    return records
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    records = read_sdf_records(args.ligand)
+
+    fail_tag = os.environ.get("STUB_GNINA_FAIL")
+    if fail_tag and any(fail_tag in name for name, _ in records):
+        print(f"stub_gnina: forced failure ({fail_tag})", file=sys.stderr)
+        return 1
+
+    hang_tag = os.environ.get("STUB_GNINA_HANG")
+    hang_seed = os.environ.get("STUB_GNINA_HANG_SEED")
+    if hang_tag and any(hang_tag in name for name, _ in records) \
+            and hang_seed in (None, str(args.seed)):
+        while True:
+            time.sleep(60)
+
+    sleep = float(os.environ.get("STUB_GNINA_SLEEP", "0"))
+    for _ in records:
+        print("0%   10   20   30   40   50   60   70   80   90   100%")
+        print("|----|----|----|----|----|----|----|----|----|----|")
+        for _ in range(51):
+            time.sleep(sleep / 51)
+            print("*", end="", flush=True)
+        print()
+
+    log_lines = [
+        "Commandline: " + " ".join(sys.argv),
+        f"Flexible residues: {args.flexres.replace(',', ' ')}",
+        f"Using random seed: {args.seed}",
+    ]
+    sdf_chunks = []
+
+    for name, molblock in records:
+        rng = random.Random(f"{name}:{args.seed}")
+        poses = []
+        for _ in range(args.num_modes):
+            poses.append((
+                round(rng.uniform(-10.0, -4.0), 2),   # affinity
+                round(rng.uniform(-7.0, -4.0), 2),    # intramol
+                round(rng.uniform(0.2, 0.95), 4),     # CNN pose score
+                round(rng.uniform(3.5, 7.0), 3),      # CNN affinity
+            ))
+        poses.sort(key=lambda p: -p[2])  # --pose_sort_order CNNscore
+
+        log_lines += [
+            "",
+            "mode |  affinity  |  intramol  |    CNN     |   CNN",
+            "     | (kcal/mol) | (kcal/mol) | pose score | affinity",
+            "-----+------------+------------+------------+----------",
+        ]
+        for mode, (aff, intra, cnn, cnn_aff) in enumerate(poses, start=1):
+            log_lines.append(
+                f"{mode:5d} {aff:11.2f} {intra:11.2f} {cnn:12.4f} {cnn_aff:10.3f}"
+            )
+            sdf_chunks.append(
+                f"{molblock}\n"
+                f">  <minimizedAffinity>\n{aff:.5f}\n\n"
+                f">  <CNNscore>\n{cnn:.6f}\n\n"
+                f">  <CNNaffinity>\n{cnn_aff:.5f}\n\n"
+                "$$$$\n"
+            )
+
+    with open(args.out, "w") as f:
+        f.write("".join(sdf_chunks))
+
+    if args.out_flex:
+        # One MODEL per pose, in the same order as the poses in -o
+        flexres = [r.split(":") for r in args.flexres.split(",") if r]
+        with open(args.out_flex, "w") as f:
+            for model in range(1, len(sdf_chunks) + 1):
+                f.write(f"MODEL {model:8d}\n")
+                for i, (chain, resid) in enumerate(flexres, start=1):
+                    f.write(
+                        f"ATOM  {i:5d}  CA  ALA {chain}{int(resid):4d}    "
+                        f"{0.0:8.3f}{0.0:8.3f}{0.0:8.3f}  1.00  0.00           C\n"
+                    )
+                f.write("ENDMDL\n")
+
+    if args.log:
+        with open(args.log, "w") as f:
+            f.write("\n".join(log_lines) + "\n")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
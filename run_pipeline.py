@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+run_pipeline.py
+Preparation and docking in one config-driven run, as overlapping stages:
+
+- the receptor (PDBFixer) and the ligands (OpenBabel/MolScrub + RDKit)
+  are prepared at the same time, each in its own thread; ligand chunks
+  go to a process pool when ligands.n_workers > 1
+- every prepared ligand is passed through a bounded queue
+  (pipeline.queue_size records) to the GNINA scheduler, which starts as
+  soon as the receptor is ready; when docking falls behind, the queue
+  fills up and ligand preparation waits (backpressure)
+- QC (qc section, utils/ligand_qc.py): every prepared record is checked
+  before it is queued; with qc.drop_failures, failing records are not
+  docked and are moved out of the ligand SDF at the end of preparation
+- resume end to end: a rerun gets prepared receptors and ligands back
+  from their disk caches and skips ligands the job ledger has DONE
+  with the same fingerprint
+
+Settings: the protein / ligands / embedding / metrics sections of the
+config as in main_pipeline.ipynb, and the docking section as in
+flexible_docking_execution.py, which then docks the prepared receptor
+and ligands. Other flags are passed on to the docking CLI. Relative
+paths resolve against the config file's folder.
+
+Usage:
+    python run_pipeline.py --config config.yaml --cpu-slots 4
+"""
+
+import argparse
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_ROOT, "flexible_docking_with_GNINA"))
+
+from utils import logger  # noqa: E402
+from utils.protein_logic import prepare_protein, prepare_proteins  # noqa: E402
+from utils.ligand_logic import prepare_ligands  # noqa: E402
+from utils.ligand_qc import CHECKS, QCReport, check_records, validate_checks  # noqa: E402
+import flexible_docking_execution as docking  # noqa: E402
+
+QUEUE_SIZE = 64  # prepared records waiting for a docking slot
+
+
+class FeedClosed(Exception):
+    """Raised to the producer when the docking side has stopped."""
+
+
+class LigandFeed:
+    """
+    Bounded hand-off of prepared SDF records to the docking scheduler.
+
+    put() blocks while `maxsize` records are waiting (backpressure);
+    iterating yields records until the producer close()s the feed.
+    cancel() (docking stopped or crashed) makes the producer's next
+    put() raise FeedClosed, which stops ligand preparation.
+    """
+
+    _END = object()
+
+    def __init__(self, maxsize: int):
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self._cancelled = threading.Event()
+        self.error = None
+
+    def put(self, record: str):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(record, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise FeedClosed()
+
+    def close(self, error: BaseException | None = None):
+        """End of the stream; with `error`, the consumer raises instead."""
+        self.error = error
+        try:
+            self.put(self._END)
+        except FeedClosed:
+            pass
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        while not self._cancelled.is_set():
+            try:
+                record = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if record is self._END:
+                if self.error is not None:
+                    raise RuntimeError("ligand preparation failed") from self.error
+                return
+            yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prepare receptor and ligands and dock them as they are prepared "
+                    "(other flags go to flexible_docking_execution.py)"
+    )
+    parser.add_argument("--config", default=os.path.join(REPO_ROOT, "config.yaml"),
+                        help="Pipeline config (default: %(default)s)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help=f"Prepared ligands waiting for docking before preparation "
+                             f"pauses (default: pipeline.queue_size or {QUEUE_SIZE})")
+    args, docking_argv = parser.parse_known_args(argv)
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f) or {}
+    base = os.path.dirname(os.path.abspath(args.config))
+
+    def path(value):
+        return os.path.join(base, value) if value and not os.path.isabs(value) else value
+
+    protein, ligands, embedding = cfg["protein"], cfg["ligands"], cfg["embedding"]
+    receptor_pdb = path(protein["output_pdb"])
+    ligands_sdf = path(ligands["output_sdf"])
+    qc = cfg.get("qc") or {}
+    qc_checks = validate_checks(qc.get("checks") or CHECKS)
+    queue_size = args.queue_size or (cfg.get("pipeline") or {}).get("queue_size", QUEUE_SIZE)
+
+    # Docking flags are checked before any preparation starts
+    docking_argv = ["--config", args.config, "--receptor", receptor_pdb,
+                    "--ligands", ligands_sdf] + docking_argv
+    docking_args = docking.parse_args(docking_argv)
+    if docking_args.validate_crop or docking_args.list_stale:
+        parser.error("--validate-crop / --list-stale need a finished ligand SDF: "
+                     "run flexible_docking_execution.py")
+    if ligands.get("ph_values"):
+        parser.error("ligands.ph_values (pH sweep) writes one SDF per pH: prepare them "
+                     "with main_pipeline.ipynb and dock each with flexible_docking_execution.py")
+
+    # Instrumentation (stage timings, failure reasons); the docking stage
+    # switches it to <results_dir>/summary once it starts
+    metrics_cfg = cfg.get("metrics", {})
+    logger.configure(
+        enabled=metrics_cfg.get("enabled", False),
+        jsonl_path=path(metrics_cfg.get("jsonl")),
+        prometheus_path=path(metrics_cfg.get("prometheus"))
+    )
+
+    for output in (receptor_pdb, ligands_sdf):
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    feed = LigandFeed(queue_size)
+    receptor_ready = threading.Event()
+
+    def prepare_receptors():
+        prepare_protein(
+            path(protein["input_pdb"]),
+            receptor_pdb,
+            protein["pH"],
+            cache_dir=path(protein.get("cache_dir"))
+        )
+        receptor_ready.set()
+
+        # Receptor ensemble (optional): not needed by docking, prepared meanwhile
+        if protein.get("ensemble_pdbs"):
+            prepare_proteins(
+                [path(p) for p in protein["ensemble_pdbs"]],
+                path(protein.get("ensemble_output_dir", "output/receptors")),
+                protein["pH"],
+                n_workers=protein.get("n_workers", 1),
+                cache_dir=path(protein.get("cache_dir"))
+            )
+
+    qc_report = None
+    n_queued = n_dropped = 0
+
+    def send(ligand_id, records):
+        nonlocal n_queued, n_dropped
+        if qc_report is not None:
+            # Inline, a few records per ligand: qc.n_workers only applies to
+            # qc_ligands() on a finished SDF
+            rows = check_records(records, protein["pH"], qc_checks,
+                                 start=qc_report.summary["total"] + 1)
+            qc_report.add(rows)
+            if qc.get("drop_failures", False):
+                kept = [r for r, row in zip(records, rows) if row["passed"]]
+                n_dropped += len(records) - len(kept)
+                records = kept
+        for record in records:
+            feed.put(record)
+            n_queued += 1
+
+    def produce_ligands():
+        nonlocal qc_report
+        if qc.get("enabled", False):
+            qc_report = QCReport(os.path.splitext(ligands_sdf)[0] + "_qc.csv")
+        try:
+            n = prepare_ligands(
+                excel_file=path(ligands["input_excel"]),
+                smiles_col=ligands["smiles_column"],
+                id_col=ligands["id_column"],
+                output_sdf=ligands_sdf,
+                ph=protein["pH"],
+                seed=embedding["random_seed"],
+                protonation=ligands.get("protonation", "openbabel"),
+                n_workers=ligands.get("n_workers", 1),
+                cache_dir=path(ligands.get("cache_dir")),
+                cache_max_mb=ligands.get("cache_max_mb", 2048),
+                conformers={
+                    key: embedding[key]
+                    for key in ("n_conformers", "top_k", "energy_window",
+                                "rmsd_threshold", "n_threads")
+                    if embedding.get(key) is not None
+                },
+                time_budget={
+                    "embed_s": embedding.get("embed_budget_s"),
+                    "minimize_s": embedding.get("minimize_budget_s"),
+                    "hard_s": embedding.get("hard_budget_s")
+                },
+                dedup=ligands.get("dedup", True),
+                on_ligand=send
+            )
+            if qc_report is not None:
+                # Before the feed ends: docking then indexes the final SDF
+                qc_report.finish(ligands_sdf, qc.get("drop_failures", False))
+        except BaseException as e:
+            if qc_report is not None:
+                qc_report.close()
+            feed.close(error=e)
+            raise
+        feed.close()
+        return n
+
+    print("🧪 Preparing receptor and ligands; docking starts with the receptor")
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="prep") as pool:
+        receptor_job = pool.submit(prepare_receptors)
+        ligand_job = pool.submit(produce_ligands)
+        try:
+            while not receptor_ready.wait(0.5):
+                if receptor_job.done():
+                    receptor_job.result()  # raises the preparation error
+            docking.main(docking_argv, records=feed)
+        finally:
+            # Docking is over (or failed): unblock and stop ligand preparation
+            feed.cancel()
+
+        try:
+            n = ligand_job.result()
+        except FeedClosed:
+            print("🛑 Ligand preparation stopped with docking — rerun to resume")
+            return
+        receptor_job.result()
+    print(f"{n} ligands prepared; {n_queued} records passed to docking, "
+          f"{n_dropped} dropped by QC.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""Shared setup: the repository's script folders on sys.path, docking run inputs."""
+
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("", "flexible_docking_with_GNINA", "benchmarks"):
+    path = os.path.join(REPO_ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from synthetic import write_3d_sdf  # noqa: E402
+from stub_run import N_LIGANDS, REF_SDF  # noqa: E402
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Inputs of a docking CLI run: placeholder receptor, one-atom reference, 8 ligands."""
+    pytest.importorskip("rdkit")
+    receptor = tmp_path / "receptor.pdb"
+    receptor.write_text("END\n")
+    ref = tmp_path / "ref.sdf"
+    ref.write_text(REF_SDF)
+    ligands = write_3d_sdf(str(tmp_path / "ligands.sdf"), N_LIGANDS, n_atoms=12)
+    return {"root": tmp_path, "results": str(tmp_path / "results"),
+            "receptor": str(receptor), "ref": str(ref), "ligands": ligands}
@@ -0,0 +1,60 @@
+"""
+Helpers for docking runs with stub_gnina.py (no GPU, no GNINA build):
+flexible_docking_execution.py as a subprocess, and its summary files.
+"""
+
+import csv
+import os
+import sqlite3
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCKING_DIR = os.path.join(REPO_ROOT, "flexible_docking_with_GNINA")
+EXECUTION = os.path.join(DOCKING_DIR, "flexible_docking_execution.py")
+STUB_GNINA = os.path.join(DOCKING_DIR, "stub_gnina.py")
+N_LIGANDS = 8
+
+REF_SDF = ("ref\n     RDKit          3D\n\n"
+           "  1  0  0  0  0  0  0  0  0  0999 V2000\n"
+           "    0.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0\n"
+           "M  END\n$$$$\n")
+
+
+def dock_cmd(tree, *extra):
+    return [sys.executable, EXECUTION,
+            "--config", str(tree["root"] / "absent.yaml"),
+            "--gnina", STUB_GNINA, "--results-dir", tree["results"],
+            "--receptor", tree["receptor"], "--ref-ligand", tree["ref"],
+            "--ligands", tree["ligands"], "--cpu-slots", "2", *extra]
+
+
+def dock(tree, *extra, **stub_env):
+    """Run the docking CLI to completion; returns its stdout."""
+    result = subprocess.run(dock_cmd(tree, *extra), env={**os.environ, **stub_env},
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def statuses(results_dir):
+    """{ID: STATUS} from summary/progress.csv."""
+    rows = read_csv(os.path.join(results_dir, "summary", "progress.csv"))
+    return {row["ID"]: row["STATUS"] for row in rows}
+
+
+def ledger_counts(results_dir):
+    """{status: n} of a (possibly still running) docking run's ledger."""
+    path = os.path.join(results_dir, "summary", "ledger.sqlite")
+    if not os.path.exists(path):
+        return {}
+    try:
+        with sqlite3.connect(path, timeout=5) as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+    except sqlite3.OperationalError:
+        return {}  # schema not created yet
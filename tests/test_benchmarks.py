@@ -0,0 +1,27 @@
+"""Synthetic benchmark inputs and the docking benchmark."""
+
+import pytest
+
+from gnina_output import iter_sdf_properties
+from synthetic import chain_elements, write_3d_sdf
+
+
+def test_synthetic_ligands_are_distinct(tmp_path):
+    assert len({tuple(chain_elements(i, 12)) for i in range(81)}) == 81
+    with pytest.raises(ValueError):
+        chain_elements(81, 12)
+
+    # Distinct structures, so ligand dedup keeps every record
+    sdf = write_3d_sdf(str(tmp_path / "ligands.sdf"), 50, n_atoms=12)
+    smiles = [props["SMILES_raw"] for _, props in iter_sdf_properties(sdf, ("SMILES_raw",))]
+    assert len(smiles) == 50 and len(set(smiles)) == 50
+
+
+def test_benchmark_docks_every_synthetic_ligand(tmp_path):
+    import run_benchmarks
+
+    size = 20
+    results = []
+    run_benchmarks.bench_docking(results, size, run_limit=2, workdir=str(tmp_path))
+    sized = [r for r in results if not r.get("skipped") and r["stage"] != "run_gnina"]
+    assert sized and all(r["n"] == size for r in sized), sized
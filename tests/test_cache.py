@@ -0,0 +1,94 @@
+"""utils.cache.DiskCache: LRU eviction, invalidation, persistence (stdlib only)."""
+
+import itertools
+
+import pytest
+
+from utils import cache as cache_module
+from utils.cache import DiskCache, hash_key
+
+ENTRY = 100     # bytes per test value
+LIMIT = 1000    # cache capacity: 10 entries
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Strictly increasing time.time(), so access order is unambiguous."""
+    ticks = itertools.count(1_000_000)
+    monkeypatch.setattr(cache_module.time, "time", lambda: float(next(ticks)))
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=LIMIT)
+    yield cache
+    cache.close()
+
+
+def value(i: int) -> str:
+    return str(i % 10) * ENTRY
+
+
+def test_hash_key_is_stable_and_order_sensitive():
+    assert hash_key("a", {"x": 1, "y": 2}) == hash_key("a", {"y": 2, "x": 1})
+    assert hash_key("a", "b") != hash_key("b", "a")
+    assert len(hash_key("a")) == 64
+
+
+def test_least_recently_read_entries_are_evicted_first(cache):
+    for i in range(10):
+        cache.put(f"k{i}", value(i))
+    assert len(cache) == 10           # exactly at capacity: nothing evicted
+
+    # Reads refresh k0..k2, so k3, k4 are now the least recently used
+    for i in range(3):
+        assert cache.get(f"k{i}") == value(i)
+    cache.put("k10", value(10))
+
+    # 1100 bytes > 1000: evicted down to <= 90% (900 bytes = 9 entries)
+    kept = {key for key in (f"k{i}" for i in range(11)) if cache.get(key) is not None}
+    assert kept == {"k0", "k1", "k2", "k5", "k6", "k7", "k8", "k9", "k10"}
+    assert cache._total == 9 * ENTRY
+
+
+def test_replacing_a_value_counts_only_the_new_size(cache):
+    for i in range(9):
+        cache.put(f"k{i}", value(i))
+    cache.put("k0", "x" * ENTRY)
+    cache.put("k0", "y" * (2 * ENTRY))    # 1000 bytes: still fits
+    assert len(cache) == 9 and cache.get("k0") == "y" * (2 * ENTRY)
+
+    cache.put("big", "é" * (LIMIT // 4))    # 500 bytes in UTF-8
+    assert cache._total == 9 * ENTRY
+    assert {key for key in ("big", "k0", "k6", "k7", "k8") if cache.get(key)} \
+        == {"big", "k0", "k7", "k8"}
+
+
+def test_invalidate_and_clear(cache):
+    for i in range(5):
+        cache.put(f"k{i}", value(i))
+    cache.invalidate("k1")
+    cache.invalidate("missing")
+    assert cache.get("k1") is None and len(cache) == 4
+    assert cache._total == 4 * ENTRY
+
+    cache.clear()
+    assert len(cache) == 0 and cache._total == 0
+    assert cache.get("k0") is None
+    cache.put("k0", value(0))
+    assert cache.get("k0") == value(0)
+
+
+def test_entries_and_size_survive_reopening(cache, tmp_path):
+    for i in range(9):
+        cache.put(f"k{i}", value(i))
+    cache.close()
+
+    reopened = DiskCache(str(tmp_path / "cache"), max_bytes=LIMIT)
+    try:
+        assert len(reopened) == 9 and reopened._total == 9 * ENTRY
+        reopened.put("k9", value(9))
+        reopened.put("k10", value(10))
+        assert reopened.get("k0") is None and reopened.get("k10") == value(10)
+    finally:
+        reopened.close()
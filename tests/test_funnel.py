@@ -0,0 +1,26 @@
+"""Two-stage funnel (rigid screen -> flexible docking of the top hits) with stub_gnina.py."""
+
+import os
+
+from stub_run import dock, read_csv
+
+
+def test_funnel_keeps_screen_ids_and_aggregates_promoted_only(tree):
+    dock(tree, "--funnel", "--promote-top", "4")
+    out = dock(tree, "--funnel", "--promote-top", "2")
+    assert "Promoted 2/" in out
+
+    results = tree["results"]
+    screen = {row["ID"]: row["DIR_NAME"]
+              for row in read_csv(os.path.join(results, "screen", "ligands",
+                                               "ligand_mapping.csv"))}
+    promoted = read_csv(os.path.join(results, "screen", "summary", "promotion.csv"))
+    top = {row["ID"]: row["DIR_NAME"] for row in promoted if row["PROMOTED"] == "1"}
+    assert len(top) == 2 and all(screen[lig_id] == d for lig_id, d in top.items())
+
+    # Flexible stage: the screen's IDs and folders, and only this run's
+    # promoted ligands in the aggregate (not the 4 from the first launch)
+    mapping = read_csv(os.path.join(results, "ligands", "ligand_mapping.csv"))
+    assert {row["ID"]: row["DIR_NAME"] for row in mapping} == top
+    aggregate = read_csv(os.path.join(results, "summary", "ligands.csv"))
+    assert {row["lig_id"]: row["dir_name"] for row in aggregate} == top
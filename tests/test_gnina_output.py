@@ -0,0 +1,88 @@
+"""Splitting a multi-ligand GNINA run (stub_gnina.py output) back per ligand."""
+
+import pytest
+
+import stub_gnina
+from gnina_output import (
+    iter_sdf_properties, iter_sdf_text_properties, read_sdf_records, retitle_record,
+    set_record_property, split_flex_models, split_flex_text, split_log_tables
+)
+
+NAMES = ("LIG_0001", "LIG_0002", "LIG_0003")
+N_MODES = 2
+
+
+def molblock(name: str, x: float) -> str:
+    return (f"{name}\n     stub          3D\n\n"
+            "  1  0  0  0  0  0  0  0  0  0999 V2000\n"
+            f"{x:10.4f}    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0\n"
+            "M  END\n")
+
+
+@pytest.fixture
+def batch_run(tmp_path, capsys):
+    """One stub GNINA run over three ligands: {"sdf", "flex", "log"} paths."""
+    ligands = tmp_path / "ligands.sdf"
+    ligands.write_text("".join(molblock(name, i) + "$$$$\n" for i, name in enumerate(NAMES)))
+    paths = {key: str(tmp_path / name) for key, name in
+             (("sdf", "docked.sdf"), ("flex", "flex.pdb"), ("log", "gnina.log"))}
+    assert stub_gnina.main([
+        "-r", "receptor.pdb", "-l", str(ligands), "-o", paths["sdf"],
+        "--out_flex", paths["flex"], "--log", paths["log"],
+        "--flexres", "A:10,A:20", "--num_modes", str(N_MODES), "--seed", "7"
+    ]) == 0
+    capsys.readouterr()  # progress bars
+    return paths
+
+
+def test_poses_split_per_ligand_in_order(batch_run):
+    records = read_sdf_records(batch_run["sdf"])
+    assert [title for title, _ in records] == [n for n in NAMES for _ in range(N_MODES)]
+    assert all(text.endswith("$$$$\n") for _, text in records)
+
+    props = [p for _, p in iter_sdf_properties(batch_run["sdf"], ("CNNscore",))]
+    assert len(props) == len(records) and all(set(p) == {"CNNscore"} for p in props)
+    assert [t for t, _ in iter_sdf_text_properties(records[0][1])] == [NAMES[0]]
+
+
+def test_flex_models_match_poses(batch_run):
+    models = split_flex_models(batch_run["flex"])
+    assert len(models) == len(NAMES) * N_MODES
+    assert all(m.startswith("MODEL") and m.endswith("ENDMDL\n") for m in models)
+    assert all(m.count("ATOM") == 2 for m in models)
+    with open(batch_run["flex"]) as f:
+        assert split_flex_text(f.read()) == models
+
+
+def test_log_split_into_one_table_per_ligand(batch_run):
+    preamble, blocks = split_log_tables(batch_run["log"])
+    assert preamble.startswith("Commandline:")
+    assert len(blocks) == len(NAMES)
+    for block in blocks:
+        assert block.startswith("mode |")
+        rows = [line for line in block.splitlines() if line[:5].strip().isdigit()]
+        assert len(rows) == N_MODES
+
+
+def test_record_title_and_properties_are_rewritten(batch_run):
+    _, record = read_sdf_records(batch_run["sdf"])[0]
+    renamed = retitle_record(record, "BENCH_000001")
+    assert renamed.splitlines()[0] == "BENCH_000001"
+    assert renamed.splitlines()[1:] == record.splitlines()[1:]
+
+    tagged = set_record_property(set_record_property(renamed, "Tag", "a"), "Tag", "b")
+    assert tagged.endswith("$$$$\n")
+    assert list(iter_sdf_text_properties(tagged, ("Tag",))) == [("BENCH_000001", {"Tag": "b"})]
+
+
+def test_stub_keeps_the_header_of_unnamed_records(tmp_path, capsys):
+    ligands = tmp_path / "ligands.sdf"
+    ligands.write_text(molblock("", 0.0) + "$$$$\n" + molblock("", 1.0) + "$$$$\n")
+    docked = str(tmp_path / "docked.sdf")
+    assert stub_gnina.main(["-l", str(ligands), "-o", docked, "--num_modes", "1"]) == 0
+    capsys.readouterr()
+
+    for title, record in read_sdf_records(docked):
+        lines = record.splitlines()
+        assert title == "" and lines[1].strip() == "stub          3D"
+        assert lines[3].endswith("V2000")
@@ -0,0 +1,84 @@
+"""gnina_runner: wall and stall timeouts, SIGTERM -> SIGKILL escalation (stdlib, Linux)."""
+
+import signal
+import sys
+import time
+
+import pytest
+
+import gnina_runner
+
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(gnina_runner, "POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(gnina_runner, "KILL_GRACE", 1.0)
+
+
+def run_python(tmp_path, code, **kwargs):
+    return gnina_runner.run([sys.executable, "-c", code], str(tmp_path / "stderr.log"),
+                            **kwargs)
+
+
+def pid_alive(pid: int) -> bool:
+    """Running (a killed orphan may linger as a zombie until init reaps it)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rpartition(")")[2].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_finished_run_reports_progress(tmp_path):
+    result = run_python(tmp_path, "print('*' * 51)", wall_timeout=30, stall_timeout=30)
+    assert result["returncode"] == 0 and result["timeout"] is None
+    assert result["progress"] == 100
+
+
+def test_wall_timeout_terminates_a_busy_process(tmp_path):
+    # Output keeps flowing, so only the wall clock can stop it
+    code = "import time\nwhile True:\n    print('*', flush=True)\n    time.sleep(0.05)"
+    result = run_python(tmp_path, code, wall_timeout=1.0, stall_timeout=30)
+    assert result["timeout"] == gnina_runner.TIMEOUT_WALL
+    assert result["returncode"] == -signal.SIGTERM
+    assert 1.0 < result["elapsed_s"] < 10
+
+
+def test_stall_timeout_uses_the_log_file_as_progress(tmp_path):
+    log_file = str(tmp_path / "gnina.log")
+    # Silent on stdout but appending to --log for 1.5 s, then silent
+    code = ("import time\n"
+            f"with open({log_file!r}, 'a') as f:\n"
+            "    for _ in range(15):\n"
+            "        f.write('*')\n"
+            "        f.flush()\n"
+            "        time.sleep(0.1)\n"
+            "time.sleep(60)")
+    result = run_python(tmp_path, code, log_file=log_file, stall_timeout=0.8)
+    assert result["timeout"] == gnina_runner.TIMEOUT_STALL
+    assert result["returncode"] == -signal.SIGTERM
+    assert result["elapsed_s"] > 1.5
+    assert result["progress"] == round(100 * 15 / gnina_runner.PROGRESS_STARS)
+
+
+def test_sigterm_is_escalated_to_sigkill_for_the_whole_group(tmp_path):
+    child_pid = tmp_path / "child.pid"
+    # Ignores SIGTERM, like a GPU job stuck in the driver, and has a child
+    code = ("import signal, subprocess, sys, time\n"
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+            "child = subprocess.Popen([sys.executable, '-c', "
+            "'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(60)'])\n"
+            f"open({str(child_pid)!r}, 'w').write(str(child.pid))\n"
+            "time.sleep(60)")
+    handles = []
+    result = run_python(tmp_path, code, stall_timeout=0.5, on_start=handles.append)
+    assert result["timeout"] == gnina_runner.TIMEOUT_STALL
+    assert result["returncode"] == -signal.SIGKILL
+    assert result["elapsed_s"] >= 0.5 + gnina_runner.KILL_GRACE
+    assert len(handles) == 1 and not pid_alive(handles[0].pid)
+
+    # SIGKILL reached the grandchild too (delivery is asynchronous)
+    pid, deadline = int(child_pid.read_text()), time.monotonic() + 5
+    while pid_alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not pid_alive(pid)
@@ -0,0 +1,190 @@
+"""Job ledger: statuses, resume decisions, leases and shards (stdlib + SQLite only)."""
+
+import argparse
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from job_ledger import JobLedger, lease_alive, parse_shard, shard_of
+
+TTL = 600.0
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = JobLedger(str(tmp_path / "summary" / "ledger.sqlite"))
+    yield ledger
+    ledger.close()
+
+
+def local_owner(token: str) -> str:
+    """Lease owner of a session in this (live) process."""
+    return f"{socket.gethostname()}:{os.getpid()}:{token}"
+
+
+def test_status_changes_keep_details_and_history(ledger):
+    ledger.write_status("LIG_0001__a", "RUNNING")
+    assert ledger.read_status("LIG_0001__a") == "RUNNING"
+    ledger.write_status("LIG_0001__a", "DONE", elapsed_min="0.50",
+                        best_cnn_score="0.91", fingerprint="fp1")
+
+    details = ledger.get_status_details("LIG_0001__a")
+    assert details["STATUS"] == "DONE"
+    assert details["BEST_CNN_SCORE"] == "0.91"
+    assert details["FINGERPRINT"] == "fp1"
+    assert details["HOST"] == socket.gethostname()
+    assert "START_TIME" in details and "END_TIME" in details
+    assert ledger.read_status("LIG_0002__b") == "PENDING"
+    assert ledger.count_by_status() == {"DONE": 1}
+
+    with sqlite3.connect(ledger.db_path) as conn:
+        events = [row[0] for row in conn.execute(
+            "SELECT status FROM events WHERE job_id = ? ORDER BY rowid", ("LIG_0001__a",))]
+    assert events == ["RUNNING", "DONE"]
+
+
+def test_new_attempt_clears_the_previous_result(ledger):
+    ledger.write_status("job", "RUNNING")
+    ledger.write_status("job", "FAILED", error="boom", elapsed_min="1.00")
+    ledger.write_status("job", "RUNNING")
+
+    details = ledger.get_status_details("job")
+    assert details["STATUS"] == "RUNNING"
+    assert details["ATTEMPTS"] == 2
+    assert "ERROR" not in details and "ELAPSED_MIN" not in details
+
+
+def test_resume_only_claims_unfinished_jobs(ledger):
+    owner = local_owner("resume")
+    ledger.write_status("done", "RUNNING")
+    ledger.write_status("done", "DONE", fingerprint="fp1")
+    ledger.write_status("legacy", "RUNNING")
+    ledger.write_status("legacy", "DONE")
+    ledger.write_status("failed", "RUNNING")
+    ledger.write_status("failed", "FAILED", error="boom")
+
+    # DONE for the same settings (or a legacy DONE without fingerprint) is kept
+    assert not ledger.claim("done", owner, TTL, fingerprint="fp1")
+    assert not ledger.claim("legacy", owner, TTL, fingerprint="fp1")
+    # Other settings, failed jobs and new jobs are docked
+    assert ledger.claim("done", owner, TTL, fingerprint="fp2")
+    assert ledger.claim("failed", owner, TTL, fingerprint="fp1")
+    assert ledger.claim("new", owner, TTL, fingerprint="fp1")
+    assert ledger.read_status("new") == "PENDING"
+
+
+def test_interrupted_job_is_released_and_resumed(ledger, tmp_path):
+    first, second = local_owner("first"), local_owner("second")
+    assert ledger.claim("job", first, TTL)
+    ledger.write_status("job", "RUNNING")
+    ledger.write_status("job", "INTERRUPTED", error="Interrupted by signal")
+
+    details = ledger.get_status_details("job")
+    assert details["STATUS"] == "INTERRUPTED"
+    assert "LEASE_OWNER" not in details
+    assert ledger.stale_jobs() == []
+
+    # A later session (reopening the same file) picks it up again
+    ledger.close()
+    reopened = JobLedger(str(tmp_path / "summary" / "ledger.sqlite"))
+    try:
+        assert reopened.claim("job", second, TTL)
+        reopened.write_status("job", "RUNNING")
+        reopened.write_status("job", "DONE", fingerprint="fp")
+        details = reopened.get_status_details("job")
+        assert details["STATUS"] == "DONE" and details["ATTEMPTS"] == 2
+        assert "ERROR" not in details
+    finally:
+        reopened.close()
+
+
+def test_running_job_without_live_lease_is_stale(ledger):
+    ledger.write_status("orphan", "RUNNING")          # predates leases
+    assert ledger.claim("alive", local_owner("me"), TTL)
+    ledger.write_status("alive", "RUNNING")
+
+    assert [row["job_id"] for row in ledger.stale_jobs()] == ["orphan"]
+
+
+def test_concurrent_sessions_claim_disjoint_jobs(tmp_path):
+    jobs = ["LIG_%04d__x" % i for i in range(200)]
+    db_path = str(tmp_path / "summary" / "ledger.sqlite")
+    claimed = {}
+
+    def session(token):
+        # One connection per session, as with separate launches
+        ledger = JobLedger(db_path)
+        try:
+            claimed[token] = {job for job in jobs if ledger.claim(job, local_owner(token), TTL)}
+        finally:
+            ledger.close()
+
+    threads = [threading.Thread(target=session, args=(token,)) for token in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not claimed["a"] & claimed["b"]
+    assert claimed["a"] | claimed["b"] == set(jobs)
+
+
+def test_live_lease_blocks_other_sessions_until_released(ledger):
+    me, other = local_owner("me"), local_owner("other")
+    assert ledger.claim("job", me, TTL)
+    assert ledger.claim("job", me, TTL)              # re-claiming our own lease
+    assert not ledger.claim("job", other, TTL)
+    assert ledger.renew_leases(me, TTL) == 1
+    assert ledger.renew_leases(other, TTL) == 0
+
+    ledger.release("job", other)                     # not the holder: no effect
+    assert not ledger.claim("job", other, TTL)
+    ledger.release("job", me)
+    assert ledger.claim("job", other, TTL)
+
+
+def test_expired_lease_is_reclaimed(ledger):
+    remote = "elsewhere.example:1:token"             # pid can't be checked
+    assert ledger.claim("job", remote, -1.0)
+    ledger.write_status("job", "RUNNING")
+    assert [row["job_id"] for row in ledger.stale_jobs()] == ["job"]
+    assert ledger.claim("job", local_owner("me"), TTL)
+
+    # Before expiry a lease of another host holds, whatever its pid
+    assert ledger.claim("other", remote, TTL)
+    assert not ledger.claim("other", local_owner("me"), TTL)
+
+
+def test_lease_of_dead_local_process_is_reclaimed(ledger):
+    proc = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                          capture_output=True, text=True, check=True)
+    dead = f"{socket.gethostname()}:{proc.stdout.strip()}:token"
+    assert not lease_alive(dead, float("inf"))
+
+    assert ledger.claim("job", dead, TTL)
+    ledger.write_status("job", "RUNNING")
+    assert [row["job_id"] for row in ledger.stale_jobs()] == ["job"]
+    assert ledger.claim("job", local_owner("me"), TTL)
+
+
+def test_parse_shard():
+    assert parse_shard("0/1") == (0, 1)
+    assert parse_shard("2/3") == (2, 3)
+    for value in ("3/3", "-1/2", "1/0", "1", "a/b", "1/2/3"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(value)
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 7])
+def test_shards_cover_every_job_exactly_once(count):
+    jobs = ["LIG_%04d__%x" % (i, i * 7919) for i in range(500)]
+    shards = [[job for job in jobs if shard_of(job, count) == index] for index in range(count)]
+    assert sorted(job for shard in shards for job in shard) == sorted(jobs)
+    assert all(shard for shard in shards)
+    # Stable across calls (and so across hosts)
+    assert [shard_of(job, count) for job in jobs] == [shard_of(job, count) for job in jobs]
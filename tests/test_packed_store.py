@@ -0,0 +1,134 @@
+"""Packed per-ligand store (--packed): round trips, shared results, export (stdlib only)."""
+
+import os
+
+import pytest
+
+import packed_store
+from packed_store import FILES, RESULT_FILES, PackedStore
+
+# Bytes a text-mode round trip would break: CRLF, non-ASCII, NUL
+LAYOUT = {
+    "input/ligand.sdf": b"LIG\r\n  input\r\n\r\nM  END\r\n$$$$\r\n",
+    "output/docked.sdf": "pose é\nM  END\n$$$$\n".encode("utf-8"),
+    "output/flex_residues.pdb": b"MODEL 1\nATOM\nENDMDL\n",
+    "logs/gnina.log": b"mode |  affinity\n" * 50,
+    "logs/gnina_stderr.log": b"\x00\xff warning\n",
+    "logs/command.txt": b"gnina \\\n    -r receptor.pdb",
+}
+
+
+def write_folder(root, files):
+    for path, data in files.items():
+        os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(root, path), "wb") as f:
+            f.write(data)
+
+
+def read_folder(root):
+    files = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            full = os.path.join(folder, name)
+            with open(full, "rb") as f:
+                files[os.path.relpath(full, root).replace(os.sep, "/")] = f.read()
+    return files
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PackedStore(str(tmp_path / "packed"), writer="hostA.1")
+    yield store
+    store.close()
+
+
+def test_folder_round_trip_is_byte_identical(store, tmp_path):
+    folder = str(tmp_path / "ligands" / "LIG_0001__a")
+    write_folder(folder, LAYOUT)
+    os.makedirs(os.path.join(folder, "scratch"))
+    open(os.path.join(folder, "scratch", "tmp.txt"), "w").close()   # not a layout file
+
+    store.put_folder("LIG_0001__a", folder, files={"META.txt": "ID=LIG_0001\n"},
+                     lig_id="LIG_0001", fingerprint="fp1", info={"best_cnn_score": 0.9})
+
+    for path, data in LAYOUT.items():
+        assert store.get("LIG_0001__a", path) == data
+    assert store.get_text("LIG_0001__a", "META.txt") == "ID=LIG_0001\n"
+    assert store.get_text("LIG_0001__a", "output/docked.sdf") == "pose é\nM  END\n$$$$\n"
+    assert store.get("LIG_0001__a", "scratch/tmp.txt") is None
+    assert store.get("LIG_0002__b", "output/docked.sdf") is None
+
+    # Shards per writer; logs are compressed, poses stay plain SDF
+    shards = {name for name in os.listdir(store.root) if not name.startswith("index.sqlite")}
+    assert shards == {f"hostA.1.{suffix}" for suffix, _ in FILES.values()}
+    with open(os.path.join(store.root, "hostA.1.poses.sdf"), "rb") as f:
+        assert f.read() == LAYOUT["output/docked.sdf"]
+    assert os.path.getsize(os.path.join(store.root, "hostA.1.logs.z")) < len(LAYOUT["logs/gnina.log"])
+
+    out = str(tmp_path / "export" / "LIG_0001__a")
+    assert store.export("LIG_0001__a", out) == len(LAYOUT) + 1
+    assert read_folder(out) == {**LAYOUT, "META.txt": b"ID=LIG_0001\n"}
+
+
+def test_redocked_files_replace_the_indexed_version(store):
+    store.put("job", {"output/docked.sdf": "old\n$$$$\n", "logs/gnina.log": "old log"},
+              fingerprint="fp1", info={"n": 1})
+    store.put("job", {"output/docked.sdf": "new\n$$$$\n"})
+
+    assert store.get_text("job", "output/docked.sdf") == "new\n$$$$\n"
+    assert store.get_text("job", "logs/gnina.log") == "old log"
+    # Omitted fingerprint/info keep the stored ones
+    assert store.find_result("fp1") == ("job", {"n": 1})
+    assert store.find_result("fp2") is None
+
+
+def test_linked_result_shares_bytes_not_inputs(store):
+    store.put("LIG_0001__a", {path: LAYOUT[path] for path in LAYOUT},
+              lig_id="LIG_0001", fingerprint="fp", info={"best_cnn_score": 0.8})
+    size = {name: os.path.getsize(os.path.join(store.root, name))
+            for name in os.listdir(store.root) if name.startswith("hostA.1.")}
+
+    store.link_result("LIG_0009__b", "LIG_0001__a", lig_id="LIG_0009")
+    for path in RESULT_FILES:
+        assert store.get("LIG_0009__b", path) == LAYOUT[path]
+    assert store.get("LIG_0009__b", "input/ligand.sdf") is None
+    assert store.job_ids(["LIG_0009"]) == ["LIG_0009__b"]
+    assert size == {name: os.path.getsize(os.path.join(store.root, name)) for name in size}
+
+
+def test_second_writer_session_shares_the_index(store, tmp_path):
+    store.put("LIG_0001__a", {"output/docked.sdf": "A\n$$$$\n"}, lig_id="LIG_0001")
+    other = PackedStore(store.root, writer="hostB.2")
+    try:
+        other.put("LIG_0002__b", {"output/docked.sdf": "B\n$$$$\n"}, lig_id="LIG_0002")
+        assert other.get_text("LIG_0001__a", "output/docked.sdf") == "A\n$$$$\n"
+    finally:
+        other.close()
+    assert os.path.exists(os.path.join(store.root, "hostB.2.poses.sdf"))
+
+    # Visible to a session that was already open, and to a later reader
+    assert store.get_text("LIG_0002__b", "output/docked.sdf") == "B\n$$$$\n"
+    reader = PackedStore(store.root, writer="reader")
+    try:
+        assert reader.job_ids() == ["LIG_0001__a", "LIG_0002__b"]
+        assert list(reader.iter_files("output/docked.sdf")) == [
+            ("LIG_0001__a", b"A\n$$$$\n"), ("LIG_0002__b", b"B\n$$$$\n")]
+    finally:
+        reader.close()
+
+
+def test_exporter_cli_rebuilds_selected_ligands(store, tmp_path, capsys):
+    for n in (1, 2, 3):
+        store.put(f"LIG_000{n}__x", {"output/docked.sdf": f"{n}\n$$$$\n", "META.txt": f"{n}"},
+                  lig_id=f"LIG_000{n}")
+    store.close()
+    results = os.path.dirname(store.root)
+    out = str(tmp_path / "export")
+
+    packed_store.main([results, "LIG_0001", "LIG_0003__x", "LIG_0042", "--out", out])
+    assert sorted(os.listdir(out)) == ["LIG_0001__x", "LIG_0003__x"]
+    assert read_folder(os.path.join(out, "LIG_0003__x")) == {
+        "output/docked.sdf": b"3\n$$$$\n", "META.txt": b"3"}
+    printed = capsys.readouterr().out
+    assert "Exported 2 ligands (4 files)" in printed
+    assert "Not in the packed store: LIG_0042" in printed
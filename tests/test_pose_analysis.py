@@ -0,0 +1,16 @@
+"""Pose parsing of pose_analysis."""
+
+import pytest
+
+pose_analysis = pytest.importorskip("pose_analysis", exc_type=ImportError)
+
+
+def test_unnamed_poses_keep_their_header():
+    block = ("\n     stub          3D\n\n"
+             "  1  0  0  0  0  0  0  0  0  0999 V2000\n"
+             "{x:10.4f}    0.0000    0.0000 O   0  0  0  0  0  0  0  0  0  0  0  0\n"
+             "M  END\n$$$$\n")
+    poses = pose_analysis.parse_sdf_poses(block.format(x=1.0) + block.format(x=2.0))
+    assert [name for name, *_ in poses] == ["", ""]
+    assert [coords[0][0] for *_, coords, _ in poses] == [1.0, 2.0]
+    assert all(elements == ["O"] for *_, elements in poses)
@@ -0,0 +1,48 @@
+"""Receptor ensemble file naming in utils.protein_logic (PDBFixer replaced by a passthrough)."""
+
+import os
+
+import pytest
+
+protein_logic = pytest.importorskip("utils.protein_logic", exc_type=ImportError)
+
+ATOM = "ATOM      1  CA  ALA A   1      {x:6.3f}   0.000   0.000  1.00  0.00           C\n"
+
+
+@pytest.fixture(autouse=True)
+def passthrough(monkeypatch):
+    monkeypatch.setattr(protein_logic, "_fix_pdb_text", lambda text, pH, name=None: text)
+
+
+def write_pdb(path, n_models=1):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        if n_models == 1:
+            f.write(ATOM.format(x=0.0) + "END\n")
+        else:
+            for i in range(1, n_models + 1):
+                f.write(f"MODEL {i}\n" + ATOM.format(x=float(i)) + "ENDMDL\n")
+    return str(path)
+
+
+def test_models_and_colliding_stems_get_distinct_outputs(tmp_path):
+    inputs = [write_pdb(tmp_path / "a" / "rec.pdb"), write_pdb(tmp_path / "b" / "rec.pdb"),
+              write_pdb(tmp_path / "nmr.pdb", n_models=2)]
+    outputs = protein_logic.prepare_proteins(inputs, str(tmp_path / "out"))
+    assert [os.path.basename(p) for p in outputs] == [
+        "rec_prepared.pdb", "rec_2_prepared.pdb",
+        "nmr_model1_prepared.pdb", "nmr_model2_prepared.pdb"]
+    assert len({open(p).read() for p in outputs}) == 3   # a/ and b/ hold the same text
+
+
+def test_output_names_must_match_the_receptor_count(tmp_path):
+    nmr = write_pdb(tmp_path / "nmr.pdb", n_models=2)
+    with pytest.raises(ValueError, match="1 output names for 2 receptors"):
+        protein_logic.prepare_protein(nmr, str(tmp_path / "out" / "receptor.pdb"))
+    with pytest.raises(ValueError, match="Duplicate"):
+        protein_logic.prepare_proteins([nmr], str(tmp_path / "out"), output_names=["r.pdb"] * 2)
+    assert not os.path.exists(tmp_path / "out" / "receptor.pdb")
+
+    single = write_pdb(tmp_path / "rec.pdb")
+    out = protein_logic.prepare_protein(single, str(tmp_path / "out" / "receptor.pdb"))
+    assert open(out).read() == open(single).read()
@@ -0,0 +1,64 @@
+"""SDF offset index and mmap record reads (stdlib only)."""
+
+import os
+
+from gnina_output import read_sdf_records
+from sdf_index import SdfIndex, read_record
+
+
+def write_sdf(path, names):
+    with open(path, "w") as f:
+        for name in names:
+            f.write(f"{name}\n     test          3D\n\n"
+                    "  0  0  0  0  0  0  0  0  0  0999 V2000\nM  END\n$$$$\n")
+
+
+def describe(record):
+    name = record.partition("\n")[0]
+    return {"name": name, "smiles": None, "dedup_key": name, "aliases": "", "dir_name": None}
+
+
+def indexed_names(sdf, fallback_dir):
+    index = SdfIndex.open(sdf, fallback_dir)
+    try:
+        if not index.is_current():
+            index.build(describe)
+        return [read_record(sdf, row["offset"], row["length"]).partition("\n")[0]
+                for row in index.records()]
+    finally:
+        index.close()
+
+
+def test_records_are_read_by_byte_range(tmp_path):
+    sdf = str(tmp_path / "ligands.sdf")
+    write_sdf(sdf, ["A", "BB", "CCC"])
+    assert indexed_names(sdf, str(tmp_path)) == ["A", "BB", "CCC"]
+
+    index = SdfIndex.open(sdf, str(tmp_path))
+    try:
+        assert index.is_current()
+        texts = [read_record(sdf, row["offset"], row["length"]) for row in index.records()]
+    finally:
+        index.close()
+    assert texts == [text for _, text in read_sdf_records(sdf)]
+
+
+def test_replaced_file_is_remapped(tmp_path):
+    # e.g. summary/promoted.sdf swapped in with os.replace by a later launch
+    sdf = str(tmp_path / "promoted.sdf")
+    write_sdf(sdf, ["LIG_A", "LIG_B", "LIG_C"])
+    assert indexed_names(sdf, str(tmp_path)) == ["LIG_A", "LIG_B", "LIG_C"]
+
+    write_sdf(str(tmp_path / "next.sdf"), ["X", "LONGER_NAME_Y"])
+    os.replace(str(tmp_path / "next.sdf"), sdf)
+    assert indexed_names(sdf, str(tmp_path)) == ["X", "LONGER_NAME_Y"]
+
+
+def test_file_rewritten_in_place_is_remapped(tmp_path):
+    sdf = str(tmp_path / "ligands.sdf")
+    write_sdf(sdf, ["LIG_%d" % i for i in range(50)])
+    assert len(indexed_names(sdf, str(tmp_path))) == 50
+
+    # Truncated and rewritten shorter: reads must not touch the old length
+    write_sdf(sdf, ["Z1", "Z2"])
+    assert indexed_names(sdf, str(tmp_path)) == ["Z1", "Z2"]
@@ -0,0 +1,93 @@
+"""
+End-to-end checks of the docking scheduler with stub_gnina.py: resume,
+sharding, Ctrl-C, timeout retries and batch bisection. Needs RDKit
+(ligand loading); skipped without it.
+"""
+
+import json
+import os
+import re
+import signal
+import sqlite3
+import subprocess
+import time
+
+from stub_run import N_LIGANDS, dock, dock_cmd, ledger_counts, statuses
+
+
+def test_resume_skips_finished_ligands(tree):
+    dock(tree)
+    assert set(statuses(tree["results"]).values()) == {"DONE"}
+
+    # Any GNINA call would fail now: a resume must not make one
+    out = dock(tree, STUB_GNINA_FAIL="BENCH_")
+    assert "Completed (new): 0" in out
+    assert f"Skipped (cached): {N_LIGANDS}" in out
+    assert set(statuses(tree["results"]).values()) == {"DONE"}
+
+
+def test_shards_dock_every_ligand_exactly_once(tree):
+    # Sequential launches sharing one results dir, as on one host per shard
+    for shard in ("0/3", "1/3", "2/3"):
+        out = dock(tree, "--shard", shard)
+        assert re.search(rf"Shard {shard}: \d+ of {N_LIGANDS} ligands", out), out
+    assert ledger_counts(tree["results"]) == {"DONE": N_LIGANDS}
+    with sqlite3.connect(os.path.join(tree["results"], "summary", "ledger.sqlite")) as conn:
+        assert {row[0] for row in conn.execute("SELECT attempts FROM jobs")} == {1}
+
+    out = dock(tree)
+    assert "Completed (new): 0" in out
+
+
+def test_sigint_marks_running_jobs_interrupted(tree):
+    proc = subprocess.Popen(dock_cmd(tree), env={**os.environ, "STUB_GNINA_SLEEP": "60"},
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        deadline = time.monotonic() + 120
+        while ledger_counts(tree["results"]).get("RUNNING", 0) < 2:
+            assert proc.poll() is None and time.monotonic() < deadline
+            time.sleep(0.2)
+        proc.send_signal(signal.SIGINT)
+        out, _ = proc.communicate(timeout=60)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+    assert "Interrupted: 2" in out
+    after_stop = statuses(tree["results"])
+    assert list(after_stop.values()).count("INTERRUPTED") == 2
+    assert set(after_stop.values()) == {"INTERRUPTED", "PENDING"}
+
+    dock(tree)
+    assert set(statuses(tree["results"]).values()) == {"DONE"}
+
+
+def test_failed_batch_is_bisected_down_to_the_bad_ligand(tree):
+    # Batch inputs are retitled with LIG IDs, single runs keep the original
+    # name: the stub fails every batch holding LIG_0003, never a single run
+    out = dock(tree, "--batch-size", "4", "--no-retry", STUB_GNINA_FAIL="LIG_0003")
+    assert "Docking batch of 2 (LIG_0001..LIG_0002)" in out
+    assert sorted(re.findall(r"Docking (LIG_\d+) on", out)) == ["LIG_0003", "LIG_0004"]
+    assert set(statuses(tree["results"]).values()) == {"DONE"}
+
+
+def test_stalled_job_is_killed_and_retried_with_the_next_seed(tree):
+    # BENCH_000002 hangs silently, but only with the first seed (SEED 42)
+    out = dock(tree, "--stall-timeout", "1", "--job-timeout", "120",
+               STUB_GNINA_HANG="BENCH_000002", STUB_GNINA_HANG_SEED="42")
+    assert re.search(r"retry 1/2 \(seed=43\)", out), out
+    assert set(statuses(tree["results"]).values()) == {"DONE"}
+
+    with sqlite3.connect(os.path.join(tree["results"], "summary", "ledger.sqlite")) as conn:
+        retried = [(job_id, attempts, json.loads(extra)) for job_id, attempts, extra in
+                   conn.execute("SELECT job_id, attempts, extra FROM jobs")
+                   if "retry" in json.loads(extra)]
+        (job_id, attempts, extra), = retried
+        events = [row[0] for row in conn.execute(
+            "SELECT status FROM events WHERE job_id = ? ORDER BY rowid", (job_id,))]
+    assert attempts == 2 and events == ["RUNNING", "RUNNING", "DONE"]
+    assert extra["retry"] == "1" and extra["retry_args"] == "seed=43"
+    assert extra["previous_error"].startswith("GNINA stalled (no output for 1 s")
+    with open(os.path.join(tree["results"], "ligands", job_id, "logs", "command.txt")) as f:
+        assert "--seed \\\n    43" in f.read()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+def hash_key(*parts) -> str:
+    """Stable SHA-256 key for a tuple of JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Persistent content-addressed key/value store (SQLite).
+
+    - Values are text (mol blocks, PDB files, JSON)
+    - Total size is bounded by `max_bytes`; least recently used
+      entries are evicted first
+    - clear() drops everything (explicit invalidation)
+
+    One writer per cache directory; readers in other processes are
+    fine (WAL mode).
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024**3):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "cache.sqlite")
+        self.max_bytes = max_bytes
+
+        self._conn = sqlite3.connect(self.path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)"
+        )
+        self._total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def get(self, key: str) -> str | None:
+        row = self._conn.execute(
+            "SELECT value FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "UPDATE entries SET last_access = ? WHERE key = ?",
+            (time.time(), key)
+        )
+        return row[0]
+
+    def put(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        old = self._conn.execute(
+            "SELECT size FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, last_access)"
+            " VALUES (?, ?, ?, ?)",
+            (key, value, size, time.time())
+        )
+        self._total += size - (old[0] if old else 0)
+        if self._total > self.max_bytes:
+            self._evict()
+
+    def invalidate(self, key: str):
+        row = self._conn.execute(
+            "SELECT size FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._total -= row[0]
+
+    def clear(self):
+        self._conn.execute("DELETE FROM entries")
+        self._conn.execute("VACUUM")
+        self._total = 0
+
+    def _evict(self):
+        """Drop LRU entries until the cache is back under 90% of the limit."""
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_access"
+        )
+        doomed = []
+        for key, size in rows:
+            if self._total <= target:
+                break
+            doomed.append((key,))
+            self._total -= size
+        rows.close()
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
@@ -1,6 +1,92 @@
+import math
+import shutil
 import subprocess
-from rdkit import Chem
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from importlib import metadata
+from rdkit import Chem, rdBase
 from rdkit.Chem import AllChem
+from rdkit.Chem.rdchem import KekulizeException, AtomValenceException
+
+from . import logger
+
+try:
+    from molscrub import Scrub
+except ImportError:  # OpenBabel-only environments
+    Scrub = None
+
+
+# ------------------------------------------------------------------
+# Protonation backends
+# ------------------------------------------------------------------
+PROTONATION_OPENBABEL = "openbabel"
+PROTONATION_MOLSCRUB = "molscrub"
+
+_OBABEL_BIN = "obabel"
+
+# MolScrub instances (pKa rules loaded once per pH range and options),
+# least recently used first; sized for a multi-pH sweep
+SCRUBBER_CACHE_SIZE = 8
+_SCRUBBERS = OrderedDict()
+_SCRUBBERS_LOCK = threading.Lock()
+
+_SCRUBBER_OPTIONS = {
+    "skip_acidbase": False,
+    "skip_tautomers": False,
+    "skip_ringfix": False,
+    "skip_gen3d": True,       # geometry handled by RDKit
+    "keep_all_frags": False,  # drop salts / counterions
+}
+
+
+def init_protonation_backend(method: str, ph=7.4):
+    """
+    Set up the protonation backend once per process.
+
+    Called directly for serial runs and as the pool initializer
+    for parallel runs, so every worker pays the setup cost once:
+    - MolScrub: loads the pKa rule set for `ph` (one value or the
+      values of a multi-pH sweep) into the scrubber cache
+    - OpenBabel: resolves the obabel executable on PATH
+    """
+    global _OBABEL_BIN
+
+    if method == PROTONATION_MOLSCRUB:
+        for value in (ph if isinstance(ph, (list, tuple)) else [ph]):
+            _get_scrubber(value)
+    elif method == PROTONATION_OPENBABEL:
+        _OBABEL_BIN = shutil.which("obabel") or "obabel"
+    else:
+        raise ValueError(f"Unknown protonation method: {method}")
+
+
+@lru_cache(maxsize=None)
+def tool_versions(method: str) -> tuple:
+    """
+    Versions of the tools that determine a prepared ligand.
+
+    Used as part of the ligand cache key, so upgrading RDKit,
+    OpenBabel or MolScrub invalidates previously cached geometry.
+    """
+    versions = [("rdkit", rdBase.rdkitVersion)]
+
+    if method == PROTONATION_MOLSCRUB:
+        try:
+            versions.append(("molscrub", metadata.version("molscrub")))
+        except metadata.PackageNotFoundError:
+            versions.append(("molscrub", "unknown"))
+    else:
+        try:
+            proc = subprocess.run(
+                [_OBABEL_BIN, "-V"], capture_output=True, text=True
+            )
+            versions.append(("openbabel", proc.stdout.strip()))
+        except OSError:
+            versions.append(("openbabel", "unknown"))
+
+    return tuple(versions)
 
 
 def ph_correct_smiles_openbabel(smiles: str, ph: float = 7.4) -> str | None:
@@ -15,12 +101,13 @@ def ph_correct_smiles_openbabel(smiles: str, ph: float = 7.4) -> str | None:
         pH-corrected canonical SMILES or None if failed
     """
     try:
-        proc = subprocess.run(
-            ["obabel", f"-:{smiles}", "-ismi", "-osmi", "-p", str(ph)],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        with logger.stage("protonate"):
+            proc = subprocess.run(
+                [_OBABEL_BIN, f"-:{smiles}", "-ismi", "-osmi", "-p", str(ph)],
+                capture_output=True,
+                text=True,
+                check=True
+            )
         # OpenBabel may append molecule name → take first token
         return proc.stdout.strip().split()[0]
     except Exception as e:
@@ -28,16 +115,324 @@ def ph_correct_smiles_openbabel(smiles: str, ph: float = 7.4) -> str | None:
         return None
 
 
-def smiles_to_3d_mol(smiles: str, seed: int = 42) -> Chem.Mol | None:
+def ph_correct_smiles_openbabel_batch(
+    smiles_list: list,
+    ph: float = 7.4
+) -> list:
+    """
+    Batch version of ph_correct_smiles_openbabel: one obabel process
+    for the whole list instead of one per SMILES.
+
+    Each input line is tagged with its list index as the molecule
+    title, so outputs map back to inputs even when OpenBabel drops
+    molecules it cannot parse.
+
+    Returns:
+        List aligned with `smiles_list`: pH-corrected SMILES or None
+    """
+    results = [None] * len(smiles_list)
+
+    lines = [
+        f"{smi} {i}"
+        for i, smi in enumerate(smiles_list)
+        if smi and not any(c.isspace() for c in smi)
+    ]
+    if not lines:
+        return results
+
+    try:
+        with logger.stage("protonate_batch", size=len(lines)):
+            proc = subprocess.run(
+                [_OBABEL_BIN, "-ismi", "-osmi", "-p", str(ph)],
+                input="\n".join(lines) + "\n",
+                capture_output=True,
+                text=True
+            )
+    except OSError as e:
+        print(f"[OpenBabel batch pH correction failed] {e}")
+        return results
+
+    for line in proc.stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            idx = int(parts[1])
+            if idx < len(results):
+                results[idx] = parts[0]
+
+    # A crash mid-batch loses everything after the offending molecule:
+    # fall back to one process per SMILES for whatever is unresolved
+    if proc.returncode != 0:
+        for i, smi in enumerate(smiles_list):
+            if results[i] is None and smi:
+                results[i] = ph_correct_smiles_openbabel(smi, ph)
+        return results
+
+    for i, smi in enumerate(smiles_list):
+        if results[i] is None:
+            print(f"[OpenBabel pH correction failed] {smi}")
+
+    return results
+
+
+def _get_scrubber(ph_low: float, ph_high: float | None = None, **options) -> "Scrub":
+    """
+    MolScrub instance for a pH range and options (default: one pH,
+    _SCRUBBER_OPTIONS), cached per (ph_low, ph_high, options); beyond
+    SCRUBBER_CACHE_SIZE the least recently used one is dropped.
+    """
+    if Scrub is None:
+        raise ImportError("MolScrub protonation requires the 'molscrub' package")
+    options = {**_SCRUBBER_OPTIONS, **options}
+    ph_high = ph_low if ph_high is None else ph_high
+    key = (float(ph_low), float(ph_high), tuple(sorted(options.items())))
+
+    with _SCRUBBERS_LOCK:
+        scrubber = _SCRUBBERS.get(key)
+        if scrubber is not None:
+            _SCRUBBERS.move_to_end(key)
+            return scrubber
+
+    scrubber = Scrub(ph_low=ph_low, ph_high=ph_high, **options)
+    with _SCRUBBERS_LOCK:
+        _SCRUBBERS[key] = scrubber
+        while len(_SCRUBBERS) > SCRUBBER_CACHE_SIZE:
+            _SCRUBBERS.popitem(last=False)
+    return scrubber
+
+
+def molscrub_input_mol(smiles: str) -> Chem.Mol | None:
+    """Parse and lightly sanitize a SMILES for MolScrub (once per ligand, reused for every pH)."""
+    try:
+        mol = Chem.MolFromSmiles(smiles, sanitize=False)
+        if mol is None:
+            return None
+
+        # sanitize input nhẹ nhàng
+        Chem.SanitizeMol(
+            mol,
+            sanitizeOps=Chem.SANITIZE_ALL ^ Chem.SANITIZE_KEKULIZE
+        )
+        return mol
+
+    except Exception:
+        return None
+
+
+def ph_correct_smiles_molscrub(smiles: str, ph: float = 7.4) -> Chem.Mol | None:
+    """
+    Enforce dominant protonation state at target pH using MolScrub
+    (rule-based pKa reactions on top of RDKit).
+
+    Returns:
+        First chemically sane protonation state or None if failed
+    """
+    mol = molscrub_input_mol(smiles)
+    if mol is None:
+        return None
+    return ph_correct_mol_molscrub(mol, ph)
+
+
+def ph_correct_mol_molscrub(mol: Chem.Mol, ph: float = 7.4) -> Chem.Mol | None:
+    """ph_correct_smiles_molscrub() of a molscrub_input_mol() (not modified)."""
+    try:
+        scrubber = _get_scrubber(ph)
+        with logger.stage("protonate"):
+            states = scrubber(Chem.Mol(mol))
+
+        if not states:
+            return None
+
+        for state in states:
+            try:
+                # 🚨 CỰC KỲ QUAN TRỌNG
+                Chem.SanitizeMol(
+                    state,
+                    sanitizeOps=Chem.SANITIZE_ALL ^ Chem.SANITIZE_KEKULIZE
+                )
+
+                # Valence sanity check (optional but recommended)
+                for atom in state.GetAtoms():
+                    if atom.GetAtomicNum() == 8:  # Oxygen
+                        if atom.GetTotalValence() > 2 and atom.GetFormalCharge() == 0:
+                            raise AtomValenceException()
+
+                return state  # first chemically sane state
+
+            except (KekulizeException, AtomValenceException, ValueError):
+                continue
+
+        # No valid state survived
+        return None
+
+    except Exception:
+        return None
+
+
+# ------------------------------------------------------------------
+# 3D geometry
+# ------------------------------------------------------------------
+class EmbeddingFailure(RuntimeError):
+    """
+    A ligand abandoned during 3D generation, with its failure `reason`.
+    Raised inside the logger stage it interrupts, which counts it once.
+    """
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class TimeBudgetExceeded(EmbeddingFailure):
+    """A ligand used up its wall-clock budget for embedding or minimization."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} time budget exceeded", f"time_budget_{stage}")
+        self.stage = stage
+
+
+class StereoLost(EmbeddingFailure):
+    """The relaxed embedding step produced another stereoisomer than the input."""
+
+    def __init__(self):
+        super().__init__("embedded stereochemistry differs from the input", "stereo_lost")
+
+
+def _stereo_labels(mol: Chem.Mol) -> dict:
+    """CIP labels of the defined stereocentres and E/Z double bonds."""
+    mol = Chem.Mol(mol)
+    Chem.AssignStereochemistry(mol, cleanIt=True, force=True)
+    # Bonds first: FindMolChiralCenters rewrites E/Z as CIS/TRANS
+    labels = {
+        ("bond", bond.GetIdx()): bond.GetStereo()
+        for bond in mol.GetBonds()
+        if bond.GetStereo() in (Chem.BondStereo.STEREOE, Chem.BondStereo.STEREOZ)
+    }
+    for idx, label in Chem.FindMolChiralCenters(mol, includeUnassigned=False,
+                                                useLegacyImplementation=False):
+        labels[("atom", idx)] = label
+    return labels
+
+
+def _check_stereo(mol: Chem.Mol, expected: dict):
+    """Raise StereoLost if the embedded conformer breaks a defined stereo element."""
+    embedded = Chem.Mol(mol)
+    Chem.AssignStereochemistryFrom3D(embedded)
+    found = _stereo_labels(embedded)
+    if any(found.get(key) != label for key, label in expected.items()):
+        raise StereoLost()
+
+
+def _deadline(timeout: float | None) -> float | None:
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def _check_deadline(deadline: float | None, stage: str):
+    if deadline is not None and time.monotonic() > deadline:
+        raise TimeBudgetExceeded(stage)
+
+
+def _embed_ladder(mol: Chem.Mol, params, timeout: float | None = None) -> int:
+    """
+    EmbedMolecule with an escalation ladder, all within `timeout` seconds:
+    1. ETKDG with the caller's parameters
+    2. random starting coordinates
+    3. relaxed: plain distance geometry (no torsion preferences or
+       basic knowledge terms), chirality not enforced, smoothing
+       failures ignored; its conformer must keep the input's defined
+       stereocentres and double bonds
+
+    The remaining budget is also handed to RDKit (EmbedParameters.timeout)
+    on versions that support it, so a single attempt cannot overrun it.
+
+    Returns: 0 on success, -1 if every step failed
+    Raises: TimeBudgetExceeded when the budget ran out first,
+            StereoLost when only the relaxed step embedded, as another
+            stereoisomer
+    """
+    deadline = _deadline(timeout)
+
+    for step in ("etkdg", "random_coords", "relaxed"):
+        if step == "random_coords":
+            params.useRandomCoords = True
+        elif step == "relaxed":
+            expected = _stereo_labels(mol)
+            params.useExpTorsionAnglePrefs = False
+            params.useBasicKnowledge = False
+            params.enforceChirality = False
+            params.ignoreSmoothingFailures = True
+
+        with logger.stage("embed", step=step):
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeBudgetExceeded("embed")
+                if hasattr(params, "timeout"):
+                    params.timeout = max(1, math.ceil(remaining))
+
+            status = AllChem.EmbedMolecule(mol, params)
+            if status != 0:
+                _check_deadline(deadline, "embed")
+            elif step == "relaxed" and expected:
+                _check_stereo(mol, expected)
+        if status == 0:
+            return 0
+
+    return -1
+
+
+def _minimize_in_slices(mol: Chem.Mol, timeout: float, max_iters: int = 200,
+                        mmff_variant: str = "MMFF94", slice_iters: int = 50):
+    """
+    MMFF (UFF fallback) minimization that checks the budget every
+    `slice_iters` iterations.
+
+    Raises: TimeBudgetExceeded, or ValueError if no force field applies
+    """
+    deadline = _deadline(timeout)
+
+    if AllChem.MMFFHasAllMoleculeParams(mol):
+        props = AllChem.MMFFGetMoleculeProperties(mol, mmffVariant=mmff_variant)
+        ff = AllChem.MMFFGetMoleculeForceField(mol, props)
+    else:
+        ff = AllChem.UFFGetMoleculeForceField(mol)
+    if ff is None:
+        raise ValueError("no force field for molecule")
+
+    ff.Initialize()
+    done = 0
+    while done < max_iters:
+        _check_deadline(deadline, "minimize")
+        if ff.Minimize(maxIts=min(slice_iters, max_iters - done)) == 0:
+            break  # converged
+        done += slice_iters
+
+
+def smiles_to_3d_mol(
+    smiles: str,
+    seed: int = 42,
+    n_conformers: int = 1,
+    embed_timeout: float | None = None,
+    minimize_timeout: float | None = None,
+    **ensemble
+) -> Chem.Mol | None:
     """
     Generate a low-energy 3D conformer from a chemically correct SMILES.
 
     GNINA constraint:
     - Bond lengths/angles are frozen during docking
     - Geometry must be minimized beforehand
+
+    n_conformers > 1 switches to ensemble mode (see embed_conformer_ensemble;
+    extra keyword arguments are passed through).
+
+    embed_timeout / minimize_timeout: per-ligand wall-clock budgets in
+    seconds (None = unlimited); TimeBudgetExceeded is raised when one
+    runs out. StereoLost is raised when only the relaxed embedding step
+    succeeds, with another stereoisomer (see _embed_ladder).
     """
     mol = Chem.MolFromSmiles(smiles)
     if mol is None:
+        logger.failure("sanitize", "invalid_smiles")
         return None
 
     # Explicit H AFTER protonation correction
@@ -46,12 +441,237 @@ def smiles_to_3d_mol(smiles: str, seed: int = 42) -> Chem.Mol | None:
     params = AllChem.ETKDGv3()
     params.randomSeed = seed
 
-    if AllChem.EmbedMolecule(mol, params) != 0:
+    if n_conformers > 1:
+        return embed_conformer_ensemble(
+            mol, params, n_conformers,
+            embed_timeout=embed_timeout, minimize_timeout=minimize_timeout,
+            **ensemble
+        )
+
+    if _embed_ladder(mol, params, embed_timeout) != 0:
+        logger.failure("embed", "no_conformer")
         return None
 
-    try:
-        AllChem.MMFFOptimizeMolecule(mol)
-    except ValueError:
-        AllChem.UFFOptimizeMolecule(mol)
+    with logger.stage("minimize"):
+        if minimize_timeout is not None:
+            _minimize_in_slices(mol, minimize_timeout)
+        else:
+            try:
+                AllChem.MMFFOptimizeMolecule(mol)
+            except ValueError:
+                AllChem.UFFOptimizeMolecule(mol)
 
     return mol
+
+
+def mol_to_3d_mol(
+    mol: Chem.Mol,
+    seed: int = 42,
+    n_conformers: int = 1,
+    embed_timeout: float | None = None,
+    minimize_timeout: float | None = None,
+    **ensemble
+) -> Chem.Mol | None:
+    """
+    Generate GNINA-compatible 3D conformer.
+
+    n_conformers > 1 switches to ensemble mode (see embed_conformer_ensemble;
+    extra keyword arguments are passed through). Budgets as in
+    smiles_to_3d_mol.
+    """
+
+    try:
+        # Clone mol to avoid mutating original (good practice)
+        mol_3d = Chem.Mol(mol)
+
+        # Ensure explicit hydrogens (safe even if already present)
+        mol_3d = Chem.AddHs(mol_3d, addCoords=True)
+
+        # ETKDGv3 embedding
+        params = AllChem.ETKDGv3()
+        params.randomSeed = seed
+        params.useSmallRingTorsions = True
+
+        if n_conformers > 1:
+            return embed_conformer_ensemble(
+                mol_3d, params, n_conformers,
+                mmff_variant="MMFF94s",
+                embed_timeout=embed_timeout, minimize_timeout=minimize_timeout,
+                **ensemble
+            )
+
+        if _embed_ladder(mol_3d, params, embed_timeout) != 0:
+            logger.failure("embed", "no_conformer")
+            return None
+
+        # Energy minimization
+        with logger.stage("minimize"):
+            try:
+                if minimize_timeout is not None:
+                    _minimize_in_slices(mol_3d, minimize_timeout,
+                                        mmff_variant="MMFF94s")
+                elif AllChem.MMFFHasAllMoleculeParams(mol_3d):
+                    AllChem.MMFFOptimizeMolecule(
+                        mol_3d,
+                        maxIters=200,
+                        mmffVariant="MMFF94s"
+                    )
+                else:
+                    AllChem.UFFOptimizeMolecule(mol_3d, maxIters=200)
+            except TimeBudgetExceeded:
+                raise
+            except Exception:
+                # Fallback: keep embedded geometry
+                pass
+
+        return mol_3d
+
+    except EmbeddingFailure:
+        raise
+    except Exception as e:
+        print(f"[3D generation failed] {e}")
+        logger.failure("embed", type(e).__name__)
+        return None
+
+
+# ------------------------------------------------------------------
+# Conformer ensembles
+# ------------------------------------------------------------------
+CONFORMER_ENERGIES_PROP = "Conformer_Energies"
+
+
+def embed_conformer_ensemble(
+    mol: Chem.Mol,
+    params,
+    n_conformers: int = 30,
+    n_threads: int = 0,
+    energy_window: float = 10.0,
+    rmsd_threshold: float = 0.5,
+    top_k: int = 1,
+    max_iters: int = 200,
+    mmff_variant: str = "MMFF94",
+    embed_timeout: float | None = None,
+    minimize_timeout: float | None = None
+) -> Chem.Mol | None:
+    """
+    Embed and minimize a conformer ensemble, keep the best few.
+
+    - EmbedMultipleConfs + MMFFOptimizeMoleculeConfs (UFF fallback),
+      both on `n_threads` threads (0 = all cores)
+    - Energy window: drop conformers more than `energy_window` kcal/mol
+      above the minimum
+    - RMSD dedup: greedy in energy order; a conformer within
+      `rmsd_threshold` Å (heavy atoms, aligned) of a kept one is dropped
+    - Keep at most `top_k`
+
+    `mol` must already carry explicit hydrogens; `params` is the caller's
+    ETKDG setup (seed, ring torsions).
+
+    Budgets are checked between the embedding attempts and after the
+    multi-threaded minimization (which runs in one RDKit call); the
+    embedding budget is also passed to RDKit where supported.
+
+    Returns:
+        Copy of `mol` holding only the kept conformers, ids 0..k-1 in
+        ascending energy order. Their energies (kcal/mol) are stored as a
+        space-separated string in the CONFORMER_ENERGIES_PROP property.
+        None if nothing could be embedded.
+    """
+    mol = Chem.Mol(mol)
+    params.numThreads = n_threads
+    deadline = _deadline(embed_timeout)
+    if deadline is not None and hasattr(params, "timeout"):
+        params.timeout = max(1, math.ceil(embed_timeout))
+
+    with logger.stage("embed", n_conformers=n_conformers):
+        conf_ids = list(AllChem.EmbedMultipleConfs(mol, n_conformers, params))
+        if not conf_ids:
+            _check_deadline(deadline, "embed")
+            params.useRandomCoords = True
+            conf_ids = list(AllChem.EmbedMultipleConfs(mol, n_conformers, params))
+        _check_deadline(deadline, "embed")
+    if not conf_ids:
+        logger.failure("embed", "no_conformer")
+        return None
+
+    # Parallel minimization; returns (not_converged, energy) per conformer
+    minimize_deadline = _deadline(minimize_timeout)
+    with logger.stage("minimize", n_conformers=len(conf_ids)):
+        try:
+            if AllChem.MMFFHasAllMoleculeParams(mol):
+                results = AllChem.MMFFOptimizeMoleculeConfs(
+                    mol, numThreads=n_threads, maxIters=max_iters,
+                    mmffVariant=mmff_variant
+                )
+            else:
+                results = AllChem.UFFOptimizeMoleculeConfs(
+                    mol, numThreads=n_threads, maxIters=max_iters
+                )
+            energies = [energy for _, energy in results]
+        except Exception:
+            # Fallback: keep embedded geometries, in embedding order
+            energies = [0.0] * len(conf_ids)
+        _check_deadline(minimize_deadline, "minimize")
+
+    ranked = sorted(zip(conf_ids, energies), key=lambda item: item[1])
+    e_min = ranked[0][1]
+
+    # RMSD on a heavy-atom copy, so alignment never moves the output
+    heavy = Chem.RemoveHs(mol)
+    kept = []
+    for conf_id, energy in ranked:
+        if energy - e_min > energy_window or len(kept) >= top_k:
+            break
+        if all(
+            AllChem.GetConformerRMS(heavy, kept_id, conf_id) >= rmsd_threshold
+            for kept_id, _ in kept
+        ):
+            kept.append((conf_id, energy))
+
+    out = Chem.Mol(mol)
+    out.RemoveAllConformers()
+    for conf_id, _ in kept:
+        out.AddConformer(Chem.Conformer(mol.GetConformer(conf_id)), assignId=True)
+
+    out.SetProp(
+        CONFORMER_ENERGIES_PROP,
+        " ".join(f"{energy:.4f}" for _, energy in kept)
+    )
+    return out
+
+
+# ------------------------------------------------------------------
+# Structure identity (deduplication)
+# ------------------------------------------------------------------
+# SDF property listing the IDs merged into a record by deduplication
+ALIAS_PROP = "Alias_IDs"
+ALIAS_SEP = ";"
+
+
+def compound_key(mol: Chem.Mol | None) -> str | None:
+    """
+    Compound identity for ingest dedup: standard InChIKey, so different
+    SMILES writings and tautomers of one compound collide. Falls back
+    to canonical SMILES where InChI is unavailable.
+    """
+    if mol is None:
+        return None
+    try:
+        key = Chem.MolToInchiKey(mol)
+    except Exception:
+        key = ""
+    return key or Chem.MolToSmiles(mol)
+
+
+def microspecies_key(mol: Chem.Mol | None) -> str | None:
+    """
+    Exact microspecies identity after pH correction: canonical SMILES
+    without hydrogens, so charges and protonation sites still count
+    (InChIKey would merge protomers that dock differently).
+    """
+    if mol is None:
+        return None
+    try:
+        return Chem.MolToSmiles(Chem.RemoveHs(mol, sanitize=False))
+    except Exception:
+        return None
@@ -0,0 +1,144 @@
+import csv
+import os
+
+
+SUPPORTED_FORMATS = (".xlsx", ".csv", ".tsv", ".smi", ".parquet")
+
+
+def clean_smiles(value) -> str:
+    """Strip Excel carriage-return artifacts from a SMILES cell."""
+    if value is None:
+        return ""
+    smiles = str(value).strip().replace("_x000d_", "")
+    return smiles.replace("\n", "").replace("\r", "")
+
+
+def _clean_id(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _column_index(header: list, name: str, path: str) -> int:
+    try:
+        return header.index(name)
+    except ValueError:
+        raise KeyError(
+            f"Column '{name}' not found in {path} (columns: {header})"
+        ) from None
+
+
+# ------------------------------------------------------------------
+# Per-format row iterators (constant memory)
+# ------------------------------------------------------------------
+def _iter_xlsx(path: str, smiles_col: str, id_col: str):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(c).strip() if c is not None else "" for c in next(rows, ())]
+        i_smi = _column_index(header, smiles_col, path)
+        i_id = _column_index(header, id_col, path)
+
+        for row in rows:
+            smiles = row[i_smi] if i_smi < len(row) else None
+            lig_id = row[i_id] if i_id < len(row) else None
+            if smiles is None and lig_id is None:
+                continue  # blank row
+            yield _clean_id(lig_id), clean_smiles(smiles)
+    finally:
+        wb.close()
+
+
+def _iter_delimited(path: str, smiles_col: str, id_col: str, delimiter: str):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = [c.strip() for c in next(reader, [])]
+        i_smi = _column_index(header, smiles_col, path)
+        i_id = _column_index(header, id_col, path)
+
+        for row in reader:
+            if not row:
+                continue
+            smiles = row[i_smi] if i_smi < len(row) else None
+            lig_id = row[i_id] if i_id < len(row) else None
+            yield _clean_id(lig_id), clean_smiles(smiles)
+
+
+def _iter_smi(path: str, smiles_col: str, id_col: str):
+    """
+    SMILES file: one 'SMILES [ID]' per line. A header line whose first
+    token is the configured SMILES column name is skipped. Lines without
+    an ID fall back to the 1-based line number.
+    """
+    with open(path, encoding="utf-8-sig") as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            if lineno == 1 and parts[0] == smiles_col:
+                continue
+            lig_id = parts[1] if len(parts) > 1 else str(lineno)
+            yield _clean_id(lig_id), clean_smiles(parts[0])
+
+
+def _iter_parquet(path: str, smiles_col: str, id_col: str, batch_size: int):
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=batch_size, columns=[smiles_col, id_col]):
+        smiles_values = batch.column(smiles_col).to_pylist()
+        id_values = batch.column(id_col).to_pylist()
+        for lig_id, smiles in zip(id_values, smiles_values):
+            yield _clean_id(lig_id), clean_smiles(smiles)
+
+
+# ------------------------------------------------------------------
+# Public API
+# ------------------------------------------------------------------
+def iter_ligands(path: str, smiles_col: str, id_col: str, batch_size: int = 1000):
+    """
+    Stream (ligand_id, smiles) pairs from a ligand library.
+
+    Formats (by extension): .xlsx (read-only row iterator), .csv/.tsv,
+    .smi and .parquet (record batches). Nothing is materialized beyond
+    the current row/batch, so the first ligand is available immediately
+    and memory stays flat regardless of library size.
+    """
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == ".xlsx":
+        return _iter_xlsx(path, smiles_col, id_col)
+    if ext == ".csv":
+        return _iter_delimited(path, smiles_col, id_col, ",")
+    if ext == ".tsv":
+        return _iter_delimited(path, smiles_col, id_col, "\t")
+    if ext == ".smi":
+        return _iter_smi(path, smiles_col, id_col)
+    if ext == ".parquet":
+        return _iter_parquet(path, smiles_col, id_col, batch_size)
+
+    raise ValueError(
+        f"Unsupported ligand input '{path}' (expected one of {SUPPORTED_FORMATS})"
+    )
+
+
+def chunked(items, size: int):
+    """Group any iterable into lists of at most `size` items, lazily."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ligand_chunks(path: str, smiles_col: str, id_col: str,
+                       chunk_size: int = 1000):
+    """Stream (ligand_id, smiles) pairs from a ligand library in lists of `chunk_size`."""
+    return chunked(
+        iter_ligands(path, smiles_col, id_col, batch_size=chunk_size),
+        chunk_size
+    )
@@ -1,6 +1,616 @@
-import pandas as pd
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from rdkit import Chem
-from .chemistry import ph_correct_smiles_openbabel, smiles_to_3d_mol
+from . import logger
+from .cache import DiskCache, hash_key
+from .chemistry import (
+    ALIAS_PROP,
+    ALIAS_SEP,
+    CONFORMER_ENERGIES_PROP,
+    PROTONATION_MOLSCRUB,
+    PROTONATION_OPENBABEL,
+    EmbeddingFailure,
+    compound_key,
+    init_protonation_backend,
+    microspecies_key,
+    tool_versions,
+    molscrub_input_mol,
+    ph_correct_smiles_openbabel_batch,
+    ph_correct_mol_molscrub,
+    smiles_to_3d_mol,
+    mol_to_3d_mol
+)
+from .ligand_io import chunked, iter_ligands
+
+
+# Bump when the preparation recipe changes, to invalidate cached ligands
+LIGAND_CACHE_VERSION = 2
+
+# Failure reason of ligands killed by the worker watchdog (hard budget)
+HARD_BUDGET_REASON = "time_budget_hard"
+
+# Worker-process state for the hard per-ligand budget (see _watchdog)
+_CURRENT = None          # (raw_smiles, start) of the ligand being prepared
+_STRAGGLER_DIR = None
+
+
+def _take_energies(mol: Chem.Mol, props: dict) -> dict:
+    """Move ensemble energies from the mol into props (they must survive pickling)."""
+    if mol.HasProp(CONFORMER_ENERGIES_PROP):
+        props[CONFORMER_ENERGIES_PROP] = mol.GetProp(CONFORMER_ENERGIES_PROP)
+        mol.ClearProp(CONFORMER_ENERGIES_PROP)
+    return props
+
+
+def _prepare_one(raw_smiles: str, phs: tuple, seed: int, protonation: str,
+                 ph_smiles: dict | None = None, conformers: dict | None = None,
+                 ligand_id: str | None = None, time_budget: dict | None = None) -> dict:
+    """
+    Protonate a single ligand at each pH in `phs` and embed it.
+
+    For OpenBabel, `ph_smiles` maps each pH to the already pH-corrected
+    SMILES from the batched calls in _prepare_chunk. `conformers` holds
+    the ensemble options of smiles_to_3d_mol / mol_to_3d_mol (None =
+    one conformer); `time_budget` the soft embed_s / minimize_s budgets.
+
+    The input is parsed once for all pH values, and a microstate reached
+    at several of them (same protonated structure) is embedded once:
+    embedding is deterministic for a given input, so the shared mol is
+    what each pH would have produced on its own.
+
+    Returns:
+        {ph: (mol, props)} on success, {ph: (None, reason)} on failure.
+        Props are returned separately because RDKit does not pickle
+        them across processes.
+    """
+    global _CURRENT
+    logger.set_item(ligand_id)
+    options = dict(conformers or {})
+    if time_budget:
+        options["embed_timeout"] = time_budget.get("embed_s")
+        options["minimize_timeout"] = time_budget.get("minimize_s")
+
+    ph_smiles = ph_smiles or {}
+    parsed = molscrub_input_mol(raw_smiles) if protonation == PROTONATION_MOLSCRUB else None
+
+    results, embedded = {}, {}
+    for ph in phs:
+        with logger.stage("prepare") as prepare:
+            state, reason = _protonate(ph, protonation, ph_smiles.get(ph), parsed)
+            if state is None:
+                results[ph] = (None, reason)
+                prepare.fail(reason)
+                continue
+
+            key = _microstate_key(state)
+            if key in embedded:
+                logger.count("microstates_shared")
+            else:
+                if embedded:
+                    _CURRENT = (raw_smiles, time.monotonic())  # hard budget per embedding
+                embedded[key] = _embed(state, seed, protonation, options)
+
+            mol, extra = embedded[key]
+            if mol is None:
+                results[ph] = (None, extra)
+                prepare.fail(extra)
+            else:
+                results[ph] = (mol, {**_state_props(state, ph, protonation), **extra})
+    return results
+
+
+def _protonate(ph: float, protonation: str, ph_smiles: str | None, parsed: Chem.Mol | None):
+    """
+    Step 1: pH correction (THERMODYNAMIC FIX).
+
+    Returns: (state, None), state being a Mol (MolScrub) or the
+    pH-corrected SMILES (OpenBabel, done per chunk); (None, reason)
+    on failure
+    """
+    if protonation == PROTONATION_MOLSCRUB:
+        state = ph_correct_mol_molscrub(parsed, ph) if parsed is not None else None
+        if state is None:
+            logger.failure("protonate", "no_valid_state")
+            return None, "no_valid_state"
+        return state, None
+
+    if not ph_smiles:
+        logger.failure("protonate", "obabel_failed")
+        return None, "obabel_failed"
+    return ph_smiles, None
+
+
+def _microstate_key(state) -> str:
+    """Identity of a protonated state, in atom order (= same embedding input)."""
+    return state if isinstance(state, str) else Chem.MolToSmiles(state, canonical=False)
+
+
+def _embed(state, seed: int, protonation: str, options: dict) -> tuple:
+    """
+    Step 2: 3D generation (GEOMETRIC FIX).
+
+    Returns: (mol, ensemble energy props) or (None, reason)
+    """
+    try:
+        if protonation == PROTONATION_MOLSCRUB:
+            mol = mol_to_3d_mol(state, seed, **options)
+        else:
+            mol = smiles_to_3d_mol(state, seed, **options)
+    except EmbeddingFailure as e:
+        return None, e.reason  # counted by the embed / minimize stage it interrupted
+
+    if mol is None:
+        return None, "embedding_failed"
+    return mol, _take_energies(mol, {})
+
+
+def _state_props(state, ph: float, protonation: str) -> dict:
+    """Protonation annotation of one pH."""
+    if protonation == PROTONATION_MOLSCRUB:
+        return {"Protonation_Method": "MolScrub", "Target_pH": str(ph)}
+    return {f"SMILES_pH{ph}": state}
+
+
+def _prepare_chunk(chunk: list, seed: int, protonation: str,
+                   conformers: dict | None = None, ids: list | None = None,
+                   time_budget: dict | None = None) -> list:
+    """
+    Prepare a chunk of (SMILES, pH values), preserving order.
+
+    OpenBabel protonates the whole chunk in one obabel process per pH.
+    `ids` (ligand IDs aligned with `chunk`) only label the metrics.
+
+    Returns: list of {ph: result} (see _prepare_one)
+    """
+    global _CURRENT
+    ids = ids or [None] * len(chunk)
+
+    ph_smiles_list = [{} for _ in chunk]
+    if protonation != PROTONATION_MOLSCRUB:
+        logger.set_item(None)
+        for ph in dict.fromkeys(ph for _, phs in chunk for ph in phs):
+            rows = [k for k, (_, phs) in enumerate(chunk) if ph in phs]
+            corrected = ph_correct_smiles_openbabel_batch([chunk[k][0] for k in rows], ph)
+            for k, ph_smiles in zip(rows, corrected):
+                ph_smiles_list[k][ph] = ph_smiles
+
+    results = []
+    for (smiles, phs), ph_smiles, ligand_id in zip(chunk, ph_smiles_list, ids):
+        _CURRENT = (smiles, time.monotonic())
+        results.append(_prepare_one(smiles, phs, seed, protonation, ph_smiles,
+                                    conformers, ligand_id, time_budget))
+    _CURRENT = None
+    return results
+
+
+def _watchdog(hard_s: float):
+    """
+    Hard per-ligand budget for pool workers.
+
+    RDKit embedding/minimization cannot be interrupted from Python, so a
+    daemon thread watches the ligand in progress; once it exceeds
+    `hard_s` it records the SMILES in _STRAGGLER_DIR and kills the worker.
+    The parent (_prepare_stream) then restarts the pool without it.
+    """
+    while True:
+        time.sleep(min(1.0, hard_s / 4))
+        current = _CURRENT
+        if current is not None and time.monotonic() - current[1] > hard_s:
+            path = os.path.join(_STRAGGLER_DIR, f"{os.getpid()}.txt")
+            with open(path, "a") as f:
+                f.write(current[0] + "\n")
+            os._exit(1)
+
+
+def _read_stragglers(straggler_dir: str) -> set:
+    smiles = set()
+    for name in os.listdir(straggler_dir):
+        with open(os.path.join(straggler_dir, name)) as f:
+            smiles.update(line.strip() for line in f if line.strip())
+    return smiles
+
+
+def _init_worker(protonation: str, phs: tuple, metrics_enabled: bool,
+                 hard_s: float | None = None, straggler_dir: str | None = None):
+    """Pool initializer: protonation backend, in-memory metrics, watchdog."""
+    global _STRAGGLER_DIR
+    init_protonation_backend(protonation, list(phs))
+    logger.configure(enabled=metrics_enabled)
+    if hard_s:
+        _STRAGGLER_DIR = straggler_dir
+        threading.Thread(target=_watchdog, args=(hard_s,), daemon=True).start()
+
+
+def _prepare_chunk_worker(*args) -> tuple:
+    """Worker entry point: results plus this chunk's metrics for the parent."""
+    return _prepare_chunk(*args), logger.drain()
+
+
+def _canonical_smiles(raw_smiles: str) -> str:
+    mol = Chem.MolFromSmiles(raw_smiles)
+    return Chem.MolToSmiles(mol) if mol is not None else raw_smiles
+
+
+def _ligand_cache_key(canonical: str, ph: float, seed: int,
+                      protonation: str, conformers: dict | None = None,
+                      time_budget: dict | None = None) -> str:
+    """Cache key: canonical input SMILES + everything that shapes the output."""
+    # Thread count changes speed, not the result
+    ensemble = {k: v for k, v in (conformers or {}).items() if k != "n_threads"}
+    # A minimization budget switches to sliced minimization (other geometry)
+    if time_budget and time_budget.get("minimize_s") is not None:
+        ensemble["sliced_minimize"] = True
+    return hash_key(
+        LIGAND_CACHE_VERSION,
+        canonical,
+        float(ph),
+        int(seed),
+        protonation,
+        tool_versions(protonation),
+        ensemble
+    )
+
+
+def _to_cache(result) -> str:
+    mol, props = result
+    molblocks = [
+        Chem.MolToMolBlock(mol, confId=conf.GetId())
+        for conf in mol.GetConformers()
+    ]
+    return json.dumps({"molblocks": molblocks, "props": props})
+
+
+def _from_cache(value: str):
+    """Rebuild (mol, props) from stored 3D mol blocks, without recomputation."""
+    entry = json.loads(value)
+    mol = None
+    for molblock in entry["molblocks"]:
+        conf_mol = Chem.MolFromMolBlock(molblock, sanitize=False, removeHs=False)
+        if conf_mol is None:
+            return None
+        if mol is None:
+            mol = conf_mol
+        else:
+            mol.AddConformer(conf_mol.GetConformer(), assignId=True)
+    if mol is None:
+        return None
+    mol.UpdatePropertyCache(strict=False)
+    return mol, entry["props"]
+
+
+def _dedup_ingest(records, alias_rows: list):
+    """
+    Pass through the first record of every compound (compound_key of
+    the input SMILES); later ones become aliases of it. Unparsable
+    SMILES pass through and fail in preparation as before.
+    """
+    first = {}
+    for ligand_id, raw_smiles in records:
+        key = compound_key(Chem.MolFromSmiles(raw_smiles)) if raw_smiles else None
+        if key is not None and key in first:
+            alias_rows.append((ligand_id, raw_smiles, first[key], "ingest"))
+            continue
+        if key is not None:
+            first[key] = ligand_id
+        yield ligand_id, raw_smiles
+
+
+def _annotate_aliases(sdf_path: str, aliases: dict):
+    """
+    Add ALIAS_PROP to the records that absorbed duplicates (text level,
+    streamed; records are only known complete after the run).
+    """
+    tmp = f"{sdf_path}.tmp"
+    with open(sdf_path, "r") as src, open(tmp, "w") as dst:
+        title = None
+        for line in src:
+            if title is None:
+                title = line.strip()
+            if line.strip() == "$$$$":
+                if title in aliases:
+                    dst.write(f">  <{ALIAS_PROP}>\n{ALIAS_SEP.join(aliases[title])}\n\n")
+                title = None
+            dst.write(line)
+    os.replace(tmp, sdf_path)
+
+
+def _alias_target(ligand_id: str, targets: dict) -> str:
+    """Follow alias chains (ingest alias of a ligand merged after pH correction)."""
+    seen = set()
+    while ligand_id in targets and ligand_id not in seen:
+        seen.add(ligand_id)
+        ligand_id = targets[ligand_id]
+    return ligand_id
+
+
+class _LigandOutput:
+    """
+    One output SDF of a preparation run, with its _failures.csv and
+    _aliases.csv.
+
+    Ingest aliases (`ingest_rows`, filled by _dedup_ingest) are shared
+    by every output of a pH sweep; microspecies merges are per output,
+    as ligands can collapse at one pH and not at another.
+    """
+
+    def __init__(self, output_sdf: str, dedup: bool, ingest_rows: list,
+                 label: str = "", on_ligand=None):
+        self.output_sdf = output_sdf
+        self.dedup = dedup
+        self.ingest_rows = ingest_rows
+        self.label = label
+        self.on_ligand = on_ligand
+        self.success, self.failed = 0, 0
+        self.written = {}  # microspecies key -> ligand ID
+        self.ph_rows = []  # (ingest rows seen so far, alias row)
+
+        self.writer = Chem.SDWriter(output_sdf)
+        self.failures_csv = os.path.splitext(output_sdf)[0] + "_failures.csv"
+        self.failures_file = open(self.failures_csv, "w", newline="")
+        self.failures = csv.writer(self.failures_file)
+        self.failures.writerow(["ligand_id", "smiles", "reason"])
+
+        # Streamed copies of the written records (same writer, in memory)
+        self.stream_buffer = io.StringIO() if on_ligand is not None else None
+        self.stream_writer = Chem.SDWriter(self.stream_buffer) if on_ligand is not None else None
+
+    def _write(self, mol, conf_id=-1, streamed=None):
+        self.writer.write(mol, confId=conf_id)
+        if self.stream_writer is not None:
+            self.stream_writer.write(mol, confId=conf_id)
+            self.stream_writer.flush()
+            streamed.append(self.stream_buffer.getvalue())
+            self.stream_buffer.seek(0)
+            self.stream_buffer.truncate()
+
+    def add(self, ligand_id: str, raw_smiles: str, result: tuple):
+        mol, props = result
+        if mol is None:
+            self.failed += 1
+            self.failures.writerow([ligand_id, raw_smiles, props])
+            logger.count("ligands_failed")
+            return
+
+        if self.dedup:
+            key = microspecies_key(mol)
+            if key is not None and key in self.written:
+                # Same protonated microspecies as an earlier ligand
+                row = (ligand_id, raw_smiles, self.written[key], "ph")
+                self.ph_rows.append((len(self.ingest_rows), row))
+                return
+            if key is not None:
+                self.written[key] = ligand_id
+
+        props = dict(props)
+        energies = props.pop(CONFORMER_ENERGIES_PROP, None)
+
+        # --- Step 3: Annotation (on a copy: a mol can be shared by pH values) ---
+        mol = Chem.Mol(mol)
+        mol.SetProp("_Name", ligand_id)
+        mol.SetProp("SMILES_raw", raw_smiles)
+        for key, value in props.items():
+            mol.SetProp(key, value)
+
+        streamed = []
+        with logger.stage("write", ligand_id):
+            if energies is None:
+                self._write(mol, streamed=streamed)
+            else:
+                # Ensemble: one record per kept conformer, lowest energy first
+                for rank, (conf, energy) in enumerate(
+                    zip(mol.GetConformers(), energies.split()), start=1
+                ):
+                    mol.SetProp("Conformer_Rank", str(rank))
+                    mol.SetProp("Conformer_Energy", energy)
+                    self._write(mol, conf.GetId(), streamed)
+        self.success += 1
+        logger.count("ligands_prepared")
+
+        if self.on_ligand is not None:
+            self.on_ligand(ligand_id, streamed)
+
+    def close(self):
+        self.writer.close()
+        self.failures_file.close()
+        if self.stream_writer is not None:
+            self.stream_writer.close()
+
+    def finish(self):
+        """Alias annotation and report, once the run is complete."""
+        if self.dedup:
+            # Ingest and microspecies aliases in the order they occurred
+            rows = sorted(
+                [(k, row) for k, row in enumerate(self.ingest_rows)]
+                + [(n - 0.5, row) for n, row in self.ph_rows],
+                key=lambda entry: entry[0]
+            )
+            aliases = {}
+            for _, (alias, _, first_id, stage) in rows:
+                aliases.setdefault(first_id, []).append(alias)
+                if stage == "ph":
+                    aliases[first_id].extend(aliases.pop(alias, []))
+
+            # Ingest aliases of a ligand merged after pH correction point at its record
+            targets = {alias: first_id for _, (alias, _, first_id, _) in rows}
+            alias_rows = [
+                (alias, smiles, _alias_target(first_id, targets), stage)
+                for _, (alias, smiles, first_id, stage) in rows
+            ]
+            if aliases:
+                _annotate_aliases(self.output_sdf, aliases)
+            aliases_csv = os.path.splitext(self.output_sdf)[0] + "_aliases.csv"
+            with open(aliases_csv, "w", newline="") as f:
+                aliases_writer = csv.writer(f)
+                aliases_writer.writerow(["alias_id", "smiles", "ligand_id", "stage"])
+                aliases_writer.writerows(alias_rows)
+            logger.count("ligands_deduplicated", len(alias_rows))
+            print(f"Merged   {len(alias_rows)} duplicates{self.label} (see {aliases_csv})")
+
+        print(f"Prepared {self.success} ligands{self.label}")
+        print(f"Failed   {self.failed} ligands{self.label}"
+              + (f" (see {self.failures_csv})" if self.failed else ""))
+        return self.success
+
+
+def _lost_to_broken_pool(future) -> bool:
+    """True if `future` failed because its process pool broke."""
+    return (future is not None and future.done() and not future.cancelled()
+            and isinstance(future.exception(), BrokenProcessPool))
+
+
+def _prepare_stream(records, phs, seed, protonation, n_workers, chunk_size,
+                    cache=None, conformers=None, time_budget=None):
+    """
+    Yield (ligand_id, raw_smiles, {ph: result}) for every record, in
+    input order, with a result per pH in `phs`.
+
+    Cache hits are resolved in the parent, per ligand and pH; only the
+    missing pH values of a ligand are prepared,
+    in-process (n_workers=1) or in a process pool. At most a few chunks
+    per worker are in flight, so results stream back to the caller as
+    soon as the head-of-line chunk completes.
+
+    With time_budget["hard_s"], pool workers run a watchdog (_watchdog);
+    when one kills its worker the pool is rebuilt and the chunks lost with
+    the broken pool are resubmitted without the straggler, which is reported as
+    (None, HARD_BUDGET_REASON) at its missing pH values.
+    """
+
+    def lookup(chunk):
+        keys, hits, misses, miss_ids = [], [], [], []
+        for ligand_id, raw_smiles in chunk:
+            ligand_keys, ligand_hits = {}, {}
+            if cache is not None:
+                with logger.stage("cache_lookup", ligand_id):
+                    canonical = _canonical_smiles(raw_smiles)
+                    for ph in phs:
+                        key = ligand_keys[ph] = _ligand_cache_key(
+                            canonical, ph, seed, protonation, conformers, time_budget
+                        )
+                        value = cache.get(key)
+                        hit = _from_cache(value) if value is not None else None
+                        if hit is not None:
+                            ligand_hits[ph] = hit
+                        logger.count("ligand_cache_hit" if value is not None
+                                     else "ligand_cache_miss")
+            keys.append(ligand_keys)
+            hits.append(ligand_hits)
+            missing = tuple(ph for ph in phs if ph not in ligand_hits)
+            if missing:
+                misses.append((raw_smiles, missing))
+                miss_ids.append(ligand_id)
+        return keys, hits, misses, miss_ids
+
+    def merge(chunk, keys, hits, computed):
+        computed = iter(computed)
+        for (ligand_id, raw_smiles), ligand_keys, ligand_hits in zip(chunk, keys, hits):
+            results = dict(ligand_hits)
+            if len(results) < len(phs):
+                for ph, result in next(computed).items():
+                    if cache is not None and result[0] is not None:
+                        cache.put(ligand_keys[ph], _to_cache(result))
+                    results[ph] = result
+            yield ligand_id, raw_smiles, {ph: results[ph] for ph in phs}
+
+    if n_workers <= 1:
+        init_protonation_backend(protonation, list(phs))
+        for chunk in chunked(records, chunk_size):
+            keys, hits, misses, miss_ids = lookup(chunk)
+            computed = _prepare_chunk(misses, seed, protonation, conformers,
+                                      miss_ids, time_budget)
+            yield from merge(chunk, keys, hits, computed)
+        return
+
+    max_pending = n_workers * 4
+    hard_s = (time_budget or {}).get("hard_s")
+    straggler_dir = tempfile.mkdtemp(prefix="ligand_stragglers_") if hard_s else None
+    stragglers = set()
+
+    def new_pool():
+        return ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(protonation, phs, logger.is_enabled(), hard_s, straggler_dir)
+        )
+
+    def submit(entry):
+        # Known stragglers are never sent to a worker again
+        entry["todo"] = [k for k, (s, _) in enumerate(entry["misses"]) if s not in stragglers]
+        entry["future"] = None
+        if entry["todo"]:
+            try:
+                entry["future"] = pool.submit(
+                    _prepare_chunk_worker,
+                    [entry["misses"][k] for k in entry["todo"]], seed, protonation,
+                    conformers, [entry["miss_ids"][k] for k in entry["todo"]],
+                    time_budget
+                )
+            except BrokenProcessPool as e:
+                # A worker died since the last drain; drain() recovers
+                entry["future"] = Future()
+                entry["future"].set_exception(e)
+
+    def drain():
+        nonlocal pool
+        entry = pending[0]
+        while True:
+            try:
+                done, metrics = ([], None)
+                if entry["future"] is not None:
+                    done, metrics = entry["future"].result()
+                break
+            except BrokenProcessPool:
+                new = _read_stragglers(straggler_dir) - stragglers if hard_s else set()
+                if not new:
+                    raise  # a real crash, not the watchdog
+                stragglers.update(new)
+                pool.shutdown(wait=True)
+                pool = new_pool()
+                # Chunks that finished before the kill keep their results
+                for waiting in pending:
+                    if _lost_to_broken_pool(waiting["future"]):
+                        submit(waiting)
+        pending.popleft()
+        logger.merge(metrics)
+
+        computed = [
+            {ph: (None, HARD_BUDGET_REASON) for ph in missing}
+            for _, missing in entry["misses"]
+        ]
+        for k, result in zip(entry["todo"], done):
+            computed[k] = result
+        skipped = set(range(len(computed))) - set(entry["todo"])
+        for k in sorted(skipped):
+            logger.failure("prepare", HARD_BUDGET_REASON, entry["miss_ids"][k])
+        yield from merge(entry["chunk"], entry["keys"], entry["hits"], computed)
+
+    pool = new_pool()
+    pending = deque()
+    try:
+        for chunk in chunked(records, chunk_size):
+            keys, hits, misses, miss_ids = lookup(chunk)
+            entry = {"chunk": chunk, "keys": keys, "hits": hits,
+                     "misses": misses, "miss_ids": miss_ids}
+            submit(entry)
+            pending.append(entry)
+            if len(pending) >= max_pending:
+                yield from drain()
+        while pending:
+            yield from drain()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if straggler_dir:
+            shutil.rmtree(straggler_dir, ignore_errors=True)
 
 
 def prepare_ligands(
@@ -9,49 +619,137 @@ def prepare_ligands(
     id_col: str,
     output_sdf: str,
     ph: float = 7.4,
-    seed: int = 42
+    seed: int = 42,
+    protonation: str = PROTONATION_OPENBABEL,
+    n_workers: int | None = 1,
+    chunk_size: int = 64,
+    cache_dir: str | None = None,
+    cache_max_mb: float = 2048,
+    clear_cache: bool = False,
+    conformers: dict | None = None,
+    time_budget: dict | None = None,
+    dedup: bool = True,
+    on_ligand=None
 ):
     """
-    Tier-3 ligand preparation with enforced physiological charge.
+    Tier-3 ligand preparation with enforced physiological charge: one
+    ligand → one dominant charged state at `ph` → one 3D conformer (or
+    its top-K conformers), written in input order to a GNINA-compatible
+    SDF. Details of every option: README.md, "Ligand preparation options".
+
+    - excel_file: library (.xlsx, .csv, .tsv, .smi, .parquet), streamed
+    - protonation: PROTONATION_OPENBABEL or PROTONATION_MOLSCRUB
+    - n_workers / chunk_size: process pool size (None = all cores) and
+      ligands per task; output is identical for a given seed
+    - cache_dir / cache_max_mb / clear_cache: on-disk LRU cache of
+      prepared mol blocks
+    - conformers: chemistry.embed_conformer_ensemble settings; None =
+      single conformer
+    - time_budget: {"embed_s", "minimize_s", "hard_s"} seconds per ligand
+    - dedup: prepare duplicates once (Alias_IDs, <stem>_aliases.csv)
+    - on_ligand(ligand_id, records): called as each ligand is written
+
+    Failed ligands are listed in <output_sdf stem>_failures.csv.
+    Returns: number of ligands written
+    """
+    return _run_preparation(
+        excel_file, smiles_col, id_col, {ph: output_sdf}, seed, protonation,
+        n_workers, chunk_size, cache_dir, cache_max_mb, clear_cache,
+        conformers, time_budget, dedup, on_ligand
+    )[ph]
+
 
-    Guarantees:
-    - Correct dominant protonation state at pH 7.4
-    - GNINA-compatible SDF
-    - One ligand → one charged state → one 3D conformer
+def prepare_ligands_ph_sweep(
+    excel_file: str,
+    smiles_col: str,
+    id_col: str,
+    output_sdf: str,
+    phs: list,
+    seed: int = 42,
+    protonation: str = PROTONATION_OPENBABEL,
+    n_workers: int | None = 1,
+    chunk_size: int = 64,
+    cache_dir: str | None = None,
+    cache_max_mb: float = 2048,
+    clear_cache: bool = False,
+    conformers: dict | None = None,
+    time_budget: dict | None = None,
+    dedup: bool = True
+) -> dict:
     """
+    prepare_ligands() at several pH values in one pass over the library.
 
-    df = pd.read_excel(excel_file)
-    writer = Chem.SDWriter(output_sdf)
+    Writes one SDF per pH, <output_sdf stem>_pH<ph><ext> (e.g.
+    ligands_pH7.4.sdf), each with its own _failures.csv and
+    _aliases.csv. The library is read, deduplicated and parsed once;
+    a protonation state reached at several pH values is embedded once.
+    Each output is what prepare_ligands() gives at that pH, and the
+    cache entries are shared with it.
 
-    success, failed = 0, 0
+    Returns: {ph: number of ligands written}
+    """
+    phs = list(dict.fromkeys(float(ph) for ph in phs))
+    if not phs:
+        raise ValueError("prepare_ligands_ph_sweep needs at least one pH value")
 
-    for _, row in df.iterrows():
-        ligand_id = str(row[id_col])
-        raw_smiles = row[smiles_col]
+    stem, ext = os.path.splitext(output_sdf)
+    outputs = {ph: f"{stem}_pH{ph:g}{ext}" for ph in phs}
+    return _run_preparation(
+        excel_file, smiles_col, id_col, outputs, seed, protonation,
+        n_workers, chunk_size, cache_dir, cache_max_mb, clear_cache,
+        conformers, time_budget, dedup
+    )
 
-        # --- Step 1: pH correction (THERMODYNAMIC FIX) ---
-        ph_smiles = ph_correct_smiles_openbabel(raw_smiles, ph)
-        if not ph_smiles:
-            failed += 1
-            continue
 
-        # --- Step 2: 3D generation (GEOMETRIC FIX) ---
-        mol = smiles_to_3d_mol(ph_smiles, seed)
-        if mol is None:
-            failed += 1
-            continue
+def _run_preparation(excel_file, smiles_col, id_col, outputs, seed, protonation,
+                     n_workers, chunk_size, cache_dir, cache_max_mb, clear_cache,
+                     conformers, time_budget, dedup, on_ligand=None) -> dict:
+    """Shared run of prepare_ligands / prepare_ligands_ph_sweep; outputs = {ph: SDF path}."""
+    if protonation not in (PROTONATION_OPENBABEL, PROTONATION_MOLSCRUB):
+        raise ValueError(f"Unknown protonation method: {protonation}")
 
-        # --- Step 3: Annotation ---
-        mol.SetProp("_Name", ligand_id)
-        mol.SetProp("SMILES_raw", raw_smiles)
-        mol.SetProp("SMILES_pH7.4", ph_smiles)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    if conformers and conformers.get("n_conformers", 1) > 1:
+        conformers = dict(conformers)
+        conformers.setdefault("n_threads", max(1, (os.cpu_count() or 1) // n_workers))
+
+    records = iter_ligands(excel_file, smiles_col, id_col)
+    ingest_rows = []
+    if dedup:
+        records = _dedup_ingest(records, ingest_rows)
+
+    cache = None
+    if cache_dir:
+        cache = DiskCache(cache_dir, max_bytes=int(cache_max_mb * 1024**2))
+        if clear_cache:
+            cache.clear()
+
+    phs = tuple(outputs)
+    sweep = len(phs) > 1
+    writers = {
+        ph: _LigandOutput(path, dedup, ingest_rows,
+                          label=f" at pH {ph:g}" if sweep else "", on_ligand=on_ligand)
+        for ph, path in outputs.items()
+    }
 
-        writer.write(mol)
-        success += 1
+    results = _prepare_stream(
+        records, phs, seed, protonation, n_workers, chunk_size, cache,
+        conformers, time_budget
+    )
 
-    writer.close()
+    try:
+        for ligand_id, raw_smiles, ph_results in results:
+            for ph, result in ph_results.items():
+                writers[ph].add(ligand_id, raw_smiles, result)
+    finally:
+        results.close()
+        for writer in writers.values():
+            writer.close()
+        if cache is not None:
+            cache.close()
 
-    print(f"Prepared {success} ligands")
-    print(f"Failed   {failed} ligands")
+    counts = {ph: writer.finish() for ph, writer in writers.items()}
+    logger.flush()
 
-    return success
+    return counts
@@ -0,0 +1,394 @@
+"""
+Bulk QC of prepared ligands before docking.
+
+Every SDF record (one per kept conformer) is checked on its coordinates
+as a NumPy array (conformer positions, adjacency and topological
+distance matrices), no per-atom Python loops:
+- span       flat 2D depictions: smallest principal extent below
+             FLAT_SPAN while the molecule has a tetrahedral atom
+- clash      atoms three or more bonds apart closer than CLASH_FACTOR
+             x the sum of their van der Waals radii
+- bonds      bond lengths outside BOND_RATIO_RANGE x the sum of
+             covalent radii
+- stereo     stereocentres specified in the input SMILES (SMILES_raw)
+             with another CIP label in 3D
+- charge     net charge different from the pH-corrected state
+             (SMILES_pH<ph>, OpenBabel) and ionizable groups in the
+             wrong state for the target pH (Target_pH or `ph`)
+- elements   elements GNINA has no atom type for
+
+qc_ligands() checks a whole SDF (process pool for n_workers > 1),
+writes <stem>_qc.csv and can move failing records out of the SDF.
+"""
+
+import csv
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from rdkit import Chem
+
+from . import logger
+from .ligand_io import chunked
+
+
+CHECKS = ("span", "clash", "bonds", "stereo", "charge", "elements")
+
+FLAT_SPAN = 0.1                 # Å, smallest principal extent of a 3D structure
+CLASH_FACTOR = 0.5              # x sum of vdW radii, atoms >= 3 bonds apart
+BOND_RATIO_RANGE = (0.7, 1.35)  # x sum of covalent radii
+PKA_MARGIN = 2.0                # pH units from the pKa before a state is wrong
+
+# Elements with a GNINA (smina) atom type
+GNINA_ELEMENTS = frozenset((1, 5, 6, 7, 8, 9, 12, 15, 16, 17, 20, 25, 26, 30, 35, 53))
+
+_ALKYLAMINE = ("!$(N~[!#6;!#1]);!$(N-[#6;!X4]);"
+               "!$(N-[#6]~[!#6;!#1]);!$(N-[#6]-[#6]~[!#6;!#1])")
+
+# Ionizable groups: (name, SMARTS of one state, pKa, that state is wrong
+# when the pH is "above" pKa + PKA_MARGIN or "below" pKa - PKA_MARGIN)
+IONIZABLE_GROUPS = (
+    ("neutral_carboxylic_acid", "[CX3](=O)[OX2H1]", 4.5, "above"),
+    ("charged_carboxylate", "[CX3](=O)[OX1-]", 4.5, "below"),
+    # Amines with only sp3 carbon neighbours (no amides, anilines, ...) and
+    # no heteroatom within two bonds (piperazines, morpholines, ...: lower pKa)
+    ("neutral_alkylamine", f"[NX3;+0;{_ALKYLAMINE}]", 10.0, "below"),
+    ("charged_alkylammonium", f"[NX4+;!H0;{_ALKYLAMINE}]", 10.0, "above"),
+)
+
+REPORT_COLUMNS = ("record", "ligand_id", "conformer_rank", "passed", "issues",
+                  "ph", "n_atoms", "span", "flatness", "min_contact",
+                  "bond_ratio_min", "bond_ratio_max", "net_charge", "expected_charge")
+
+_TABLE = Chem.GetPeriodicTable()
+_RCOV = np.array([_TABLE.GetRcovalent(z) for z in range(119)])
+_RVDW = np.array([_TABLE.GetRvdw(z) for z in range(119)])
+_PATTERNS = {}
+
+
+def _pattern(smarts: str) -> Chem.Mol:
+    pattern = _PATTERNS.get(smarts)
+    if pattern is None:
+        pattern = _PATTERNS[smarts] = Chem.MolFromSmarts(smarts)
+    return pattern
+
+
+def record_ph(mol: Chem.Mol, default: float | None = None) -> float | None:
+    """Target pH of a prepared record (MolScrub Target_pH or OpenBabel SMILES_pH<ph>)."""
+    if mol.HasProp("Target_pH"):
+        return float(mol.GetProp("Target_pH"))
+    for name in mol.GetPropNames():
+        if name.startswith("SMILES_pH"):
+            return float(name[len("SMILES_pH"):])
+    return default
+
+
+def _geometry(mol: Chem.Mol, xyz: np.ndarray, atomic_nums: np.ndarray,
+              checks: tuple, issues: list, metrics: dict):
+    """span / clash / bonds on one conformer's coordinates."""
+    if "span" in checks and len(xyz) >= 3:
+        centered = xyz - xyz.mean(axis=0)
+        # Extents along the principal axes, largest first
+        axes = np.linalg.svd(centered, full_matrices=False)[2]
+        extents = np.ptp(centered @ axes.T, axis=0)
+        metrics["span"] = round(float(extents[0]), 3)
+        metrics["flatness"] = round(float(extents[-1]), 3)
+        tetrahedral = any(a.GetDegree() == 4 for a in mol.GetAtoms())
+        if extents[-1] < FLAT_SPAN and (tetrahedral or extents[0] < FLAT_SPAN):
+            issues.append(f"span:{extents[-1]:.3f}")
+
+    if "clash" in checks or "bonds" in checks:
+        dist = np.linalg.norm(xyz[:, None, :] - xyz[None, :, :], axis=-1)
+
+    if "clash" in checks and len(xyz) > 1:
+        topo = Chem.GetDistanceMatrix(mol)
+        i, j = np.nonzero(np.triu(topo >= 3, k=1))
+        if len(i):
+            ratio = dist[i, j] / (_RVDW[atomic_nums[i]] + _RVDW[atomic_nums[j]])
+            metrics["min_contact"] = round(float(ratio.min()), 3)
+            n_clashes = int((ratio < CLASH_FACTOR).sum())
+            if n_clashes:
+                issues.append(f"clash:{n_clashes}")
+
+    if "bonds" in checks and mol.GetNumBonds():
+        i, j = np.nonzero(np.triu(Chem.GetAdjacencyMatrix(mol), k=1))
+        ratio = dist[i, j] / (_RCOV[atomic_nums[i]] + _RCOV[atomic_nums[j]])
+        metrics["bond_ratio_min"] = round(float(ratio.min()), 3)
+        metrics["bond_ratio_max"] = round(float(ratio.max()), 3)
+        low, high = BOND_RATIO_RANGE
+        n_outliers = int(((ratio < low) | (ratio > high)).sum())
+        if n_outliers:
+            issues.append(f"bonds:{n_outliers}")
+
+
+def _stereo_mismatches(mol: Chem.Mol, raw_smiles: str) -> int | None:
+    """
+    Stereocentres of the input SMILES with another CIP label in `mol`
+    (stereo from its 3D coordinates). None when the input cannot be
+    mapped onto the prepared structure.
+
+    Atoms are matched on element and connectivity only (charges zeroed,
+    generic bonds), so protonation and tautomer changes still map; salts
+    and counterions are matched through the largest input fragment.
+    """
+    raw = Chem.MolFromSmiles(raw_smiles) if raw_smiles else None
+    if raw is None:
+        return None
+    raw = max(Chem.GetMolFrags(raw, asMols=True), key=lambda m: m.GetNumAtoms())
+    expected = dict(Chem.FindMolChiralCenters(raw))
+    if not expected:
+        return 0
+
+    query = Chem.RWMol(raw)
+    for atom in query.GetAtoms():
+        atom.SetFormalCharge(0)
+    params = Chem.AdjustQueryParameters.NoAdjustments()
+    params.makeBondsGeneric = True
+    query = Chem.AdjustQueryProperties(query, params)
+
+    match = mol.GetSubstructMatch(query)
+    if not match:
+        return None
+    Chem.AssignStereochemistryFrom3D(mol)
+    found = dict(Chem.FindMolChiralCenters(mol, includeUnassigned=True))
+    return sum(found.get(match[idx]) != label for idx, label in expected.items())
+
+
+def _charge(mol: Chem.Mol, ph: float | None, issues: list, metrics: dict):
+    net = Chem.GetFormalCharge(mol)
+    metrics["net_charge"] = net
+
+    state = next((mol.GetProp(n) for n in mol.GetPropNames() if n.startswith("SMILES_pH")), None)
+    state_mol = Chem.MolFromSmiles(state, sanitize=False) if state else None
+    if state_mol is not None:
+        expected = Chem.GetFormalCharge(state_mol)
+        metrics["expected_charge"] = expected
+        if net != expected:
+            issues.append(f"charge:net({net:+d}!={expected:+d})")
+
+    if ph is None:
+        return
+    for name, smarts, pka, side in IONIZABLE_GROUPS:
+        wrong = ph > pka + PKA_MARGIN if side == "above" else ph < pka - PKA_MARGIN
+        if wrong and mol.HasSubstructMatch(_pattern(smarts)):
+            issues.append(f"charge:{name}")
+
+
+def validate_checks(checks) -> tuple:
+    """Tuple of check names; ValueError on an unknown one."""
+    checks = tuple(checks)
+    unknown = set(checks) - set(CHECKS)
+    if unknown:
+        raise ValueError(f"Unknown QC checks: {sorted(unknown)} (expected some of {CHECKS})")
+    return checks
+
+
+def check_mol(mol: Chem.Mol, ph: float | None = None, checks: tuple = CHECKS) -> tuple:
+    """
+    QC of one prepared record (mol with explicit Hs and a 3D conformer).
+
+    `ph` is used when the record does not carry its target pH.
+
+    Returns: (issues, metrics); issues is a list of "check:detail"
+    strings, empty when the record passes
+    """
+    issues, metrics = [], {}
+    ph = record_ph(mol, ph)
+    metrics["ph"] = ph
+    metrics["n_atoms"] = mol.GetNumAtoms()
+
+    atomic_nums = np.array([atom.GetAtomicNum() for atom in mol.GetAtoms()], dtype=int)
+    if "elements" in checks:
+        for z in sorted(set(atomic_nums.tolist()) - GNINA_ELEMENTS):
+            issues.append(f"elements:{_TABLE.GetElementSymbol(z)}")
+
+    if mol.GetNumConformers() == 0:
+        issues.append("no_conformer")
+    else:
+        xyz = mol.GetConformer().GetPositions()
+        _geometry(mol, xyz, atomic_nums, checks, issues, metrics)
+
+    if "stereo" in checks and mol.HasProp("SMILES_raw"):
+        mismatches = _stereo_mismatches(Chem.Mol(mol), mol.GetProp("SMILES_raw"))
+        if mismatches:
+            issues.append(f"stereo:{mismatches}")
+
+    if "charge" in checks:
+        _charge(mol, ph, issues, metrics)
+
+    return issues, metrics
+
+
+def iter_sdf_records(sdf_path: str):
+    """Yield the text of every SDF record ('$$$$' line included), streamed."""
+    lines = []
+    with open(sdf_path, "r") as f:
+        for line in f:
+            lines.append(line)
+            if line.rstrip("\r\n") == "$$$$":
+                yield "".join(lines)
+                lines = []
+    if any(line.strip() for line in lines):
+        yield "".join(lines)
+
+
+def check_records(records: list, ph: float | None = None, checks: tuple = CHECKS,
+                  start: int = 1) -> list:
+    """
+    QC of SDF record texts, numbered from `start`.
+
+    Returns: one report row (dict of REPORT_COLUMNS) per record
+    """
+    supplier = Chem.SDMolSupplier()
+    supplier.SetData("".join(records), sanitize=True, removeHs=False)
+
+    rows = []
+    for number, mol in enumerate(supplier, start=start):
+        row = dict.fromkeys(REPORT_COLUMNS)
+        row["record"] = number
+        if mol is None:
+            issues, metrics = ["unreadable"], {}
+        else:
+            row["ligand_id"] = mol.GetProp("_Name")
+            if mol.HasProp("Conformer_Rank"):
+                row["conformer_rank"] = mol.GetProp("Conformer_Rank")
+            with logger.stage("qc", row["ligand_id"]):
+                issues, metrics = check_mol(mol, ph, checks)
+        row.update(metrics)
+        row["passed"] = not issues
+        row["issues"] = ";".join(issues)
+        for issue in issues:
+            logger.failure("qc", issue.split(":", 1)[0], row["ligand_id"])
+        rows.append(row)
+    return rows
+
+
+def _check_worker(records: list, ph: float | None, checks: tuple, start: int,
+                  metrics_enabled: bool) -> tuple:
+    """Pool entry point: report rows plus this chunk's metrics for the parent."""
+    logger.configure(enabled=metrics_enabled)
+    return check_records(records, ph, checks, start), logger.drain()
+
+
+def _checked_chunks(sdf_path: str, ph, checks, n_workers: int, chunk_size: int):
+    """Yield the report rows of every chunk of records, in file order."""
+    chunks = chunked(iter_sdf_records(sdf_path), chunk_size)
+    if n_workers <= 1:
+        start = 1
+        for records in chunks:
+            yield check_records(records, ph, checks, start)
+            start += len(records)
+        return
+
+    # A few chunks per worker in flight: constant memory on large libraries
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        pending = deque()
+        start = 1
+        for records in chunks:
+            pending.append(pool.submit(
+                _check_worker, records, ph, checks, start, logger.is_enabled()
+            ))
+            start += len(records)
+            if len(pending) >= n_workers * 4:
+                rows, metrics = pending.popleft().result()
+                logger.merge(metrics)
+                yield rows
+        while pending:
+            rows, metrics = pending.popleft().result()
+            logger.merge(metrics)
+            yield rows
+
+
+def drop_records(sdf_path: str, numbers: set, dropped_sdf: str):
+    """Move the records numbered `numbers` (from 1) to `dropped_sdf`; the SDF is rewritten."""
+    tmp = f"{sdf_path}.tmp"
+    with open(tmp, "w") as kept, open(dropped_sdf, "w") as dropped:
+        for number, record in enumerate(iter_sdf_records(sdf_path), start=1):
+            (dropped if number in numbers else kept).write(record)
+    os.replace(tmp, sdf_path)
+
+
+class QCReport:
+    """
+    Report of a QC run: rows streamed to a CSV (REPORT_COLUMNS) and the
+    pass/fail tally. Used by qc_ligands() and, record by record, by
+    run_pipeline.py.
+    """
+
+    def __init__(self, report_csv: str):
+        self.report_csv = report_csv
+        self.summary = {"total": 0, "passed": 0, "failed": 0, "by_check": {}}
+        self.failed_records = set()
+        self._file = open(report_csv, "w", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=REPORT_COLUMNS)
+        self._writer.writeheader()
+
+    def add(self, rows: list):
+        self._writer.writerows(rows)
+        for row in rows:
+            self.summary["total"] += 1
+            if row["passed"]:
+                self.summary["passed"] += 1
+                continue
+            self.summary["failed"] += 1
+            self.failed_records.add(row["record"])
+            for issue in row["issues"].split(";"):
+                check = issue.split(":", 1)[0]
+                self.summary["by_check"][check] = self.summary["by_check"].get(check, 0) + 1
+
+    def close(self):
+        self._file.close()
+
+    def finish(self, sdf_path: str, drop_failures: bool = False) -> dict:
+        """Close the report and, with drop_failures, move failing records out of `sdf_path`."""
+        self.close()
+        summary = self.summary
+        logger.count("qc_passed", summary["passed"])
+        logger.count("qc_failed", summary["failed"])
+        by_check = ", ".join(f"{k} {v}" for k, v in sorted(summary["by_check"].items()))
+        print(f"QC       {summary['passed']}/{summary['total']} records passed"
+              + (f" (issues: {by_check})" if by_check else "") + f" → {self.report_csv}")
+
+        if drop_failures and self.failed_records:
+            failed_sdf = os.path.splitext(sdf_path)[0] + "_qc_failed.sdf"
+            drop_records(sdf_path, self.failed_records, failed_sdf)
+            print(f"Dropped  {summary['failed']} failing records → {failed_sdf}")
+        return summary
+
+
+def qc_ligands(
+    sdf_path: str,
+    ph: float | None = 7.4,
+    n_workers: int | None = 1,
+    chunk_size: int = 256,
+    checks: tuple = CHECKS,
+    report_csv: str | None = None,
+    drop_failures: bool = False
+) -> dict:
+    """
+    QC every record of a prepared ligand SDF (see module docstring).
+
+    - `ph`: target pH of records that do not carry their own
+    - n_workers > 1 (or None for all cores) checks chunks of
+      `chunk_size` records in a process pool
+    - Report: one row per record in `report_csv`
+      (default <sdf stem>_qc.csv): passed, issues, and the measured
+      span, contact, bond and charge values
+    - drop_failures=True rewrites the SDF with the passing records only;
+      the failing ones go to <sdf stem>_qc_failed.sdf
+
+    Returns: {"total": ..., "passed": ..., "failed": ..., "by_check": {check: n}}
+    """
+    checks = validate_checks(checks)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    report = QCReport(report_csv or os.path.splitext(sdf_path)[0] + "_qc.csv")
+    try:
+        for rows in _checked_chunks(sdf_path, ph, checks, n_workers, chunk_size):
+            report.add(rows)
+    finally:
+        report.close()
+    summary = report.finish(sdf_path, drop_failures)
+    logger.flush()
+    return summary
@@ -0,0 +1,281 @@
+"""
+Lightweight pipeline instrumentation (stdlib only).
+
+- stage(name, item): context manager timing one stage of one item
+  (ligand ID, receptor, batch); durations go into per-stage histograms
+  and, for identified items, into a JSON-lines event log. A stage that
+  raises is logged not ok and its failure counted once, with the
+  exception's `reason` attribute (else its class name); fail() marks a
+  stage not ok whose failure was already counted where it occurred
+- failure(stage, reason, item): categorized failure counter + event
+- count(name, n): plain counters (cache hits, prepared ligands, ...)
+- flush(): append buffered events to the JSON-lines file and rewrite
+  the Prometheus textfile snapshot (atomic rename, node_exporter-ready)
+
+Off by default: until configure(enabled=True) every call returns
+immediately (stage() hands back a shared no-op context), so the hooks
+can stay in tight loops.
+
+Process pools: workers configure(enabled=...) without output paths,
+return drain() with their results, and the parent merge()s it, so there
+is a single writer per output file.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds (seconds): RDKit stages sit in the ms
+# range, GNINA runs in minutes
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0,
+           60.0, 300.0, 900.0, 3600.0, float("inf"))
+
+PREFIX = "gnina_pipeline"
+
+_LOCK = threading.Lock()
+
+_enabled = False
+_jsonl_path = None
+_prom_path = None
+_buffer_size = 1000
+_current_item = None
+
+_events = []
+_hist = {}       # stage -> [bucket counts..., sum, count]
+_failures = {}   # (stage, reason) -> n
+_counters = {}   # name -> n
+
+
+def configure(enabled: bool = True, jsonl_path: str | None = None,
+              prometheus_path: str | None = None, buffer_size: int = 1000):
+    """Switch instrumentation on/off and set the output files (None = in memory only)."""
+    global _enabled, _jsonl_path, _prom_path, _buffer_size
+    _enabled = bool(enabled)
+    _jsonl_path = jsonl_path
+    _prom_path = prometheus_path
+    _buffer_size = buffer_size
+    for path in (jsonl_path, prometheus_path):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_item(item: str | None):
+    """Default item for stages that do not know their ligand (e.g. chemistry helpers)."""
+    global _current_item
+    _current_item = item
+
+
+# ------------------------------------------------------------------
+# Recording
+# ------------------------------------------------------------------
+class _Stage:
+    __slots__ = ("name", "item", "fields", "start", "reason")
+
+    def __init__(self, name, item, fields):
+        self.name = name
+        self.item = item
+        self.fields = fields
+        self.reason = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def fail(self, reason: str):
+        """Log this stage as not ok, without counting another failure."""
+        self.reason = reason
+
+    def __exit__(self, exc_type, exc, tb):
+        fields = self.fields
+        if exc_type is None and self.reason is not None:
+            fields = {**fields, "reason": self.reason}
+        observe(self.name, time.perf_counter() - self.start, self.item,
+                ok=exc_type is None and self.reason is None, **fields)
+        if exc_type is not None:
+            failure(self.name, getattr(exc, "reason", None) or exc_type.__name__, self.item)
+        return False
+
+
+class _NullStage:
+    """stage() while disabled: a shared no-op context."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def fail(self, reason: str):
+        pass
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL = _NullStage()
+
+
+def stage(name: str, item: str | None = None, **fields):
+    """Time a block: `with stage("embed"): ...`. No-op when disabled."""
+    if not _enabled:
+        return _NULL
+    return _Stage(name, item, fields)
+
+
+def observe(name: str, seconds: float, item: str | None = None, **fields):
+    """Record a measured duration (for stages timed by the caller)."""
+    if not _enabled:
+        return
+    item = item if item is not None else _current_item
+    with _LOCK:
+        h = _hist.get(name)
+        if h is None:
+            h = _hist[name] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+                break
+        h[-2] += seconds
+        h[-1] += 1
+        if item is not None:
+            _events.append({"time": round(time.time(), 3), "item": item, "stage": name,
+                            "seconds": round(seconds, 6), **fields})
+    if _jsonl_path and len(_events) >= _buffer_size:
+        flush_events()
+
+
+def failure(name: str, reason: str, item: str | None = None, **fields):
+    """Count a categorized failure of a stage."""
+    if not _enabled:
+        return
+    item = item if item is not None else _current_item
+    with _LOCK:
+        key = (name, reason)
+        _failures[key] = _failures.get(key, 0) + 1
+        _events.append({"time": round(time.time(), 3), "item": item, "stage": name,
+                        "failure": reason, **fields})
+
+
+def count(name: str, n: int = 1):
+    if not _enabled:
+        return
+    with _LOCK:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+# ------------------------------------------------------------------
+# Process pools
+# ------------------------------------------------------------------
+def drain() -> dict | None:
+    """Take (and reset) everything recorded in this process; picklable."""
+    global _events, _hist, _failures, _counters
+    if not _enabled:
+        return None
+    with _LOCK:
+        delta = {
+            "events": _events,
+            "hist": _hist,
+            "failures": list(_failures.items()),
+            "counters": _counters,
+        }
+        _events, _hist, _failures, _counters = [], {}, {}, {}
+    return delta
+
+
+def merge(delta: dict | None):
+    """Fold a worker's drain() into this process."""
+    if not delta or not _enabled:
+        return
+    with _LOCK:
+        _events.extend(delta["events"])
+        for name, h in delta["hist"].items():
+            mine = _hist.setdefault(name, [0] * len(h))
+            for i, v in enumerate(h):
+                mine[i] += v
+        for key, n in delta["failures"]:
+            key = tuple(key)
+            _failures[key] = _failures.get(key, 0) + n
+        for name, n in delta["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+    if _jsonl_path and len(_events) >= _buffer_size:
+        flush_events()
+
+
+# ------------------------------------------------------------------
+# Output
+# ------------------------------------------------------------------
+def flush_events():
+    global _events
+    with _LOCK:
+        events, _events = _events, []
+    if not events or not _jsonl_path:
+        return
+    with open(_jsonl_path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(e) + "\n" for e in events))
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text() -> str:
+    """Prometheus exposition format snapshot of all histograms and counters."""
+    with _LOCK:
+        hist = {k: list(v) for k, v in _hist.items()}
+        failures = dict(_failures)
+        counters = dict(_counters)
+
+    lines = [
+        f"# HELP {PREFIX}_stage_seconds Duration of pipeline stages.",
+        f"# TYPE {PREFIX}_stage_seconds histogram",
+    ]
+    for name in sorted(hist):
+        h = hist[name]
+        cumulative = 0
+        for bound, n in zip(BUCKETS, h):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{_label(name)}",le="{le}"}} {cumulative}')
+        lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{_label(name)}"}} {h[-2]:.6f}')
+        lines.append(f'{PREFIX}_stage_seconds_count{{stage="{_label(name)}"}} {h[-1]}')
+
+    lines += [
+        f"# HELP {PREFIX}_failures_total Failures by stage and reason.",
+        f"# TYPE {PREFIX}_failures_total counter",
+    ]
+    for (name, reason), n in sorted(failures.items()):
+        lines.append(f'{PREFIX}_failures_total{{stage="{_label(name)}",reason="{_label(reason)}"}} {n}')
+
+    lines += [
+        f"# HELP {PREFIX}_events_total Pipeline event counters.",
+        f"# TYPE {PREFIX}_events_total counter",
+    ]
+    for name, n in sorted(counters.items()):
+        lines.append(f'{PREFIX}_events_total{{name="{_label(name)}"}} {n}')
+
+    return "\n".join(lines) + "\n"
+
+
+def flush():
+    """Write buffered events and the Prometheus snapshot (no-op when disabled)."""
+    if not _enabled:
+        return
+    flush_events()
+    if _prom_path:
+        tmp = f"{_prom_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        os.replace(tmp, _prom_path)
+
+
+def summary() -> dict:
+    """{stage: {"count", "total_s", "mean_s"}} for quick printing."""
+    with _LOCK:
+        return {
+            name: {"count": h[-1], "total_s": round(h[-2], 3),
+                   "mean_s": round(h[-2] / h[-1], 4) if h[-1] else 0.0}
+            for name, h in _hist.items()
+        }
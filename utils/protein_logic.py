@@ -1,31 +1,226 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from importlib import metadata
+
 from pdbfixer import PDBFixer
 from openmm.app import PDBFile
 
-def prepare_protein(input_pdb, output_pdb, pH=7.4):
+from . import logger
+from .cache import DiskCache, hash_key
+
+
+# Bump when the preparation recipe changes, to invalidate cached receptors
+PROTEIN_CACHE_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def tool_versions() -> tuple:
+    """PDBFixer / OpenMM versions, part of the receptor cache key."""
+    versions = []
+    for package in ("pdbfixer", "openmm"):
+        try:
+            versions.append((package, metadata.version(package)))
+        except metadata.PackageNotFoundError:
+            versions.append((package, "unknown"))
+    return tuple(versions)
+
+
+def _fix_pdb_text(pdb_text: str, pH: float, name: str | None = None) -> str:
     """
     Chem LibreTexts basis:
     - Restores valence completeness
     - Assigns protonation based on bulk pH
     - Prepares topology for flexible docking
-    """
 
-    fixer = PDBFixer(filename=input_pdb)
+    Returns: prepared PDB as text
+    """
+    with logger.stage("protein_repair", name):
+        fixer = PDBFixer(pdbfile=io.StringIO(pdb_text))
 
-    fixer.findMissingResidues()
-    fixer.findNonstandardResidues()
-    fixer.replaceNonstandardResidues()
-    fixer.findMissingAtoms()
-    fixer.addMissingAtoms()
+        fixer.findMissingResidues()
+        fixer.findNonstandardResidues()
+        fixer.replaceNonstandardResidues()
+        fixer.findMissingAtoms()
+        fixer.addMissingAtoms()
 
     # Protonation at physiological pH
-    fixer.addMissingHydrogens(pH=pH)
+    with logger.stage("protein_protonate", name):
+        fixer.addMissingHydrogens(pH=pH)
 
-    with open(output_pdb, "w") as f:
+    out = io.StringIO()
+    with logger.stage("protein_write", name):
         PDBFile.writeFile(
             fixer.topology,
             fixer.positions,
-            f,
+            out,
             keepIds=True
         )
+    return out.getvalue()
+
+
+def _fix_worker(pdb_text: str, pH: float, name: str, metrics_enabled: bool) -> tuple:
+    """Pool entry point: prepared text plus this job's metrics for the parent."""
+    logger.configure(enabled=metrics_enabled)
+    return _fix_pdb_text(pdb_text, pH, name), logger.drain()
+
+
+def _protein_cache_key(pdb_text: str, pH: float) -> str:
+    """Cache key: input file content + pH + tool versions."""
+    return hash_key(
+        PROTEIN_CACHE_VERSION,
+        hash_key(pdb_text),
+        float(pH),
+        tool_versions()
+    )
+
+
+def split_models(input_pdb: str) -> list:
+    """
+    Split a PDB into one PDB text per MODEL.
+
+    Header records before the first MODEL (SEQRES, CRYST1, ...) are
+    kept in every model, so PDBFixer still sees the full sequence.
+    A file without MODEL records is returned as a single entry.
+    """
+    with open(input_pdb, "r") as f:
+        lines = f.readlines()
+
+    if not any(line.startswith("MODEL") for line in lines):
+        return ["".join(lines)]
+
+    header, models, current = [], [], None
+    for line in lines:
+        if line.startswith("MODEL"):
+            current = []
+        elif line.startswith("ENDMDL"):
+            if current is not None:
+                models.append("".join(header + current) + "END\n")
+            current = None
+        elif current is not None:
+            current.append(line)
+        elif not models and not line.startswith(("END", "CONECT", "MASTER")):
+            header.append(line)
+    return models
 
+
+def prepare_protein(input_pdb, output_pdb, pH=7.4, cache_dir=None,
+                    cache_max_mb=2048):
+    """
+    Prepare one receptor with PDBFixer.
+
+    With `cache_dir`, an unchanged input (same content, pH and
+    PDBFixer/OpenMM versions) is copied from the cache instead of
+    being re-protonated. Multi-model inputs raise ValueError (one
+    output file per model: use prepare_proteins).
+    """
+    prepare_proteins([input_pdb], os.path.dirname(output_pdb) or ".", pH,
+                     cache_dir=cache_dir, cache_max_mb=cache_max_mb,
+                     output_names=[os.path.basename(output_pdb)])
     return output_pdb
+
+
+def prepare_proteins(
+    inputs,
+    output_dir: str,
+    pH: float = 7.4,
+    n_workers: int | None = 1,
+    cache_dir: str | None = None,
+    cache_max_mb: float = 2048,
+    output_names: list | None = None
+) -> list:
+    """
+    Prepare a receptor ensemble (crystal forms, MD frames, ...).
+
+    `inputs` is a list of PDB paths, or a single path; multi-model
+    files are split into one receptor per MODEL (<stem>_model<N>).
+
+    - Cache hits (by content, pH and tool versions) are resolved first
+    - Misses run in a process pool of `n_workers` (None = all cores)
+    - Outputs: <output_dir>/<stem>_prepared.pdb, in input order; inputs
+      with the same stem get _2, _3, ... (<stem>_2_prepared.pdb)
+    - `output_names` replaces the file names, one per receptor after
+      model splitting; a count mismatch raises ValueError
+
+    Returns: list of prepared PDB paths
+    """
+    if isinstance(inputs, (str, os.PathLike)):
+        inputs = [inputs]
+
+    jobs = []
+    used = set()
+    for input_pdb in inputs:
+        base = os.path.splitext(os.path.basename(input_pdb))[0]
+        # rec.pdb from two folders must not overwrite each other
+        stem, n = base, 1
+        while stem in used:
+            n += 1
+            stem = f"{base}_{n}"
+        used.add(stem)
+        models = split_models(input_pdb)
+        if len(models) == 1:
+            jobs.append((f"{stem}_prepared.pdb", models[0]))
+        else:
+            jobs.extend(
+                (f"{stem}_model{i}_prepared.pdb", text)
+                for i, text in enumerate(models, start=1)
+            )
+    if output_names is not None:
+        if len(output_names) != len(jobs):
+            raise ValueError(
+                f"{len(output_names)} output names for {len(jobs)} receptors "
+                "(multi-model inputs give one receptor per MODEL)"
+            )
+        if len(set(output_names)) != len(output_names):
+            raise ValueError(f"Duplicate output names: {output_names}")
+        jobs = [(name, text) for name, (_, text) in zip(output_names, jobs)]
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    cache = None
+    if cache_dir:
+        cache = DiskCache(cache_dir, max_bytes=int(cache_max_mb * 1024**2))
+
+    results = [None] * len(jobs)
+    keys = [_protein_cache_key(text, pH) for _, text in jobs]
+    if cache is not None:
+        for i, key in enumerate(keys):
+            results[i] = cache.get(key)
+            logger.count("receptor_cache_hit" if results[i] is not None else "receptor_cache_miss")
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    n_workers = n_workers or os.cpu_count() or 1
+    if misses:
+        texts = [jobs[i][1] for i in misses]
+        names = [jobs[i][0] for i in misses]
+        if n_workers <= 1 or len(misses) == 1:
+            fixed = [_fix_pdb_text(text, pH, name) for text, name in zip(texts, names)]
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_workers, len(misses))) as pool:
+                fixed = []
+                for text, metrics in pool.map(
+                    _fix_worker, texts, [pH] * len(texts), names,
+                    [logger.is_enabled()] * len(texts)
+                ):
+                    fixed.append(text)
+                    logger.merge(metrics)
+        for i, text in zip(misses, fixed):
+            results[i] = text
+            if cache is not None:
+                cache.put(keys[i], text)
+
+    if cache is not None:
+        cache.close()
+
+    outputs = []
+    for (name, _), text in zip(jobs, results):
+        path = os.path.join(output_dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        outputs.append(path)
+
+    print(f"Prepared {len(outputs)} receptors "
+          f"({len(jobs) - len(misses)} from cache)")
+    logger.flush()
+    return outputs